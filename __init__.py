@@ -2,23 +2,94 @@
 # (c) FFRI Security, Inc., 2025 / Author: FFRI Security, Inc.
 #
 import binaryninja
+import argparse
+import bisect
+import codecs
+import cProfile
+import hashlib
+import heapq
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import socket
+import struct
 import sys
 import json
+import threading
+import time
+import weakref
+from array import array
+from contextlib import contextmanager
+from functools import partial
 from dataclasses import dataclass
-from typing import Dict, List, Set, DefaultDict, Optional, Tuple
-from collections import defaultdict
+from typing import (
+    Any, BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, DefaultDict, Optional, Sequence, Set, Tuple,
+    Union,
+)
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
 
+# Decoding worker processes import the decoding helpers by module name, without the
+# plugin package and binaryninja, so the plugin directory has to be importable on its own
+_PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGIN_DIR not in sys.path:
+    sys.path.append(_PLUGIN_DIR)
+from missinglink_decoding import (
+    BASE_REGISTER_CANDIDATES,
+    RECORD_START_TEXT,
+    CallSiteKey,
+    EdgeKey,
+    IntervalIndex,
+    ModuleIndex,
+    PendingEdge,
+    decode_lines,
+    decode_lines_in_worker,
+    decode_shard,
+    make_edge_key,
+    read_shard,
+)
+
 
 class Architecture(Enum):
     X86_64 = "x86_64"
 
 
+class TraceFormat(Enum):
+    JSON = "json"
+    JSON_LINES = "jsonl"
+
+
+class EvictionPolicy(Enum):
+    LRU = "lru"
+    FIFO = "fifo"
+
+
 class CommentPrefix(Enum):
     SOURCE = "src"
     DESTINATION = "dst"
 
 
+class OperandKind(Enum):
+    REGISTER = "register"
+    MEMORY = "memory"
+    RIP_RELATIVE = "rip_relative"
+
+
+class SkipReason(Enum):
+    NOT_BRANCH = "non_branch_instruction"
+    NO_DISASSEMBLY = "missing_disassembly"
+    UNKNOWN_MODULE = "unknown_module"
+
+
+class SetOperation(Enum):
+    UNION = "union"
+    INTERSECTION = "intersection"
+    DIFFERENCE = "difference"
+
+
 @dataclass
 class BranchData:
     module: str
@@ -35,39 +106,1335 @@ class BranchData:
         return self.to_bv_abs_addr(self.get_reg_value(reg_name), modules, bv)
 
 
+class _JsonStream:
+    """Incremental reader that decodes one JSON value at a time from a byte stream."""
+
+    _WHITESPACE = re.compile(r"[ \t\n\r]*")
+    _DECODER = json.JSONDecoder()
+    # A value that still does not decode once this much is buffered is malformed, not truncated
+    MAX_VALUE_SIZE = 64 << 20
+
+    def __init__(self, fin: BinaryIO, chunk_size: int, max_value_size: int = MAX_VALUE_SIZE):
+        self.fin = fin
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fin.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self) -> str:
+        while True:
+            self.pos = self._WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if (found := self.peek()) != char:
+            raise ValueError(f"Expected '{char}' but found '{found}' in trace file")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if len(self.buffer) - self.pos < self.max_value_size and self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_object_keys(self) -> Iterator[str]:
+        """Yields each key of an object; the caller must consume the value before resuming."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def iter_array(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+class TraceReader:
+    """Streams a branch trace produced by brt_save without loading it into memory.
+
+    Both the original JSON layout (``{"modules": [...], "branches": [...]}``) and a
+    JSON Lines variant are accepted. In the JSON Lines variant every line holds one
+    object: either ``{"modules": [...]}`` or a single branch record.
+    """
+
+    DEFAULT_CHUNK_SIZE = 1 << 20
+    # Bytes read to tell the layouts apart; a compact JSON trace is a single line
+    SNIFF_SIZE = 1 << 16
+
+    def __init__(
+        self, path: str, trace_format: Optional[TraceFormat] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ):
+        self.path = path
+        self.format = trace_format if trace_format is not None else self.detect_format(path)
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self.bytes_read = 0
+
+    @classmethod
+    def detect_format(cls, path: str) -> TraceFormat:
+        if path.endswith((".jsonl", ".ndjson")):
+            return TraceFormat.JSON_LINES
+        with open(path, "rb") as fin:
+            first_line = fin.readline(cls.SNIFF_SIZE)
+            if len(first_line) < cls.SNIFF_SIZE or first_line.endswith(b"\n"):
+                try:
+                    record = json.loads(first_line)
+                except ValueError:
+                    return TraceFormat.JSON
+                if isinstance(record, dict) and "branches" not in record:
+                    return TraceFormat.JSON_LINES
+                return TraceFormat.JSON
+            # A long first line is either a whole compact JSON trace or one object of a JSON
+            # Lines trace; only the latter ends right after its modules
+            fin.seek(0)
+            stream = _JsonStream(fin, cls.SNIFF_SIZE)
+            keys = stream.iter_object_keys()
+            try:
+                key = next(keys)
+                if key in ("before", "after"):
+                    return TraceFormat.JSON_LINES
+                if key != "modules":
+                    return TraceFormat.JSON
+                stream.decode_value()
+                return TraceFormat.JSON if next(keys, None) is not None else TraceFormat.JSON_LINES
+            except (ValueError, StopIteration):
+                return TraceFormat.JSON
+
+    @staticmethod
+    def parse_modules(raw_modules: List[Dict]) -> Dict[str, int]:
+        return {module["name"]: int(module["addr"], 16) for module in raw_modules}
+
+    @property
+    def progress(self) -> float:
+        return self.bytes_read / self.size if self.size else 1.0
+
+    def read_modules(self) -> Dict[str, int]:
+        with open(self.path, "rb") as fin:
+            if self.format == TraceFormat.JSON_LINES:
+                for record in self._iter_lines(fin):
+                    if "modules" in record:
+                        return self.parse_modules(record["modules"])
+            else:
+                stream = _JsonStream(fin, self.chunk_size)
+                for key in stream.iter_object_keys():
+                    if key == "modules":
+                        return self.parse_modules(stream.decode_value())
+                    elif key == "branches":
+                        for _ in stream.iter_array():
+                            pass
+                    else:
+                        stream.decode_value()
+        raise KeyError("modules")
+
+    def iter_branches(self) -> Iterator[Dict]:
+        self.bytes_read = 0
+        with open(self.path, "rb") as fin:
+            if self.format == TraceFormat.JSON_LINES:
+                for record in self._iter_lines(fin):
+                    if "modules" not in record:
+                        yield record
+                return
+
+            stream = _JsonStream(fin, self.chunk_size)
+            for key in stream.iter_object_keys():
+                if key != "branches":
+                    stream.decode_value()
+                    continue
+                for branch in stream.iter_array():
+                    self.bytes_read = fin.tell()
+                    yield branch
+        self.bytes_read = self.size
+
+    def _iter_lines(self, fin: BinaryIO) -> Iterator[Dict]:
+        for line in fin:
+            self.bytes_read += len(line)
+            if line.strip():
+                yield json.loads(line)
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class AddressCache:
+    """Bounded cache of per-address lookup results with hit/miss counters.
+
+    ``max_size=None`` disables eviction. With ``EvictionPolicy.LRU`` a hit refreshes the
+    entry, with ``EvictionPolicy.FIFO`` entries are evicted in insertion order.
+    """
+
+    def __init__(self, max_size: Optional[int] = 1 << 16, policy: EvictionPolicy = EvictionPolicy.LRU):
+        self.max_size = max_size
+        self.policy = policy
+        self.entries: "OrderedDict[int, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, addr: int, lookup: Callable[[int], Any]) -> Any:
+        try:
+            value = self.entries[addr]
+        except KeyError:
+            self.misses += 1
+            value = self.entries[addr] = lookup(addr)
+            if self.max_size is not None and len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return value
+        self.hits += 1
+        if self.policy == EvictionPolicy.LRU:
+            self.entries.move_to_end(addr)
+        return value
+
+    def put(self, addr: int, value: Any) -> None:
+        self.entries[addr] = value
+        self.entries.move_to_end(addr)
+        if self.max_size is not None and len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class BinaryViewCache:
+    """Address-keyed caches for the BinaryView lookups done by BranchAnalyzer."""
+
+    def __init__(self, max_size: Optional[int] = 1 << 16, policy: EvictionPolicy = EvictionPolicy.LRU):
+        self.instruction = AddressCache(max_size, policy)
+        self.base_register = AddressCache(max_size, policy)
+        self.func_name_at = AddressCache(max_size, policy)
+        self.func_name_containing = AddressCache(max_size, policy)
+        self.symbol = AddressCache(max_size, policy)
+
+    def _caches(self) -> Dict[str, AddressCache]:
+        return {
+            "instruction": self.instruction,
+            "base_register": self.base_register,
+            "func_name_at": self.func_name_at,
+            "func_name_containing": self.func_name_containing,
+            "symbol": self.symbol,
+        }
+
+    def clear(self) -> None:
+        for cache in self._caches().values():
+            cache.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: cache.stats() for name, cache in self._caches().items()}
+
+
+class Instrumentation:
+    """Counters and timers of one load: per pipeline stage, per BinaryView API and per
+    reason a record was skipped. Optionally runs cProfile over the whole load."""
+
+    def __init__(self, profile: bool = False):
+        self.counters: DefaultDict[str, int] = defaultdict(int)
+        self.stage_seconds: DefaultDict[str, float] = defaultdict(float)
+        self.api_calls: DefaultDict[str, int] = defaultdict(int)
+        self.api_seconds: DefaultDict[str, float] = defaultdict(float)
+        self.skipped: DefaultDict[str, int] = defaultdict(int)
+        self.profiler = cProfile.Profile() if profile else None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += time.perf_counter() - start_time
+
+    @contextmanager
+    def profiling(self) -> Iterator[None]:
+        if self.profiler is None:
+            yield
+            return
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def timed_iter(self, stage: str, iterable: Iterator[Any]) -> Iterator[Any]:
+        """Yields from ``iterable``, adding the time spent producing each item to ``stage``."""
+        iterator = iter(iterable)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stage_seconds[stage] += time.perf_counter() - start_time
+                return
+            self.stage_seconds[stage] += time.perf_counter() - start_time
+            yield item
+
+    def call(self, api: str, func: Callable[..., Any], *args: Any) -> Any:
+        """Calls a BinaryView API and records its call count and time."""
+        start_time = time.perf_counter()
+        result = func(*args)
+        self.api_seconds[api] += time.perf_counter() - start_time
+        self.api_calls[api] += 1
+        return result
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def skip(self, reason: SkipReason, records: int = 1) -> None:
+        self.skipped[reason.value] += records
+
+    def summary(self, **extra: Any) -> Dict[str, Any]:
+        summary = dict(extra)
+        summary["stages"] = {name: round(seconds, 6) for name, seconds in self.stage_seconds.items()}
+        summary["api"] = {
+            name: {"calls": self.api_calls[name], "seconds": round(self.api_seconds[name], 6)}
+            for name in self.api_calls
+        }
+        summary["counters"] = dict(self.counters)
+        summary["skipped"] = {reason.value: self.skipped.get(reason.value, 0) for reason in SkipReason}
+        return summary
+
+    def report(self, path: Optional[str] = None, **extra: Any) -> Dict[str, Any]:
+        """Logs the summary and writes it to ``path`` as JSON, with the cProfile stats
+        next to it as ``.prof`` when profiling."""
+        summary = self.summary(**extra)
+        if path is not None:
+            try:
+                if self.profiler is not None:
+                    summary["profile"] = os.path.splitext(path)[0] + ".prof"
+                    self.profiler.dump_stats(summary["profile"])
+                with open(path, "w") as fout:
+                    json.dump(summary, fout, indent=2)
+            except OSError as e:
+                print(f"Cannot write run summary {path}: {e}", file=sys.stderr)
+        # stdout carries the JSON results of headless runs
+        print(f"Binja Missing Link run summary: {json.dumps(summary)}", file=sys.stderr)
+        return summary
+
+
+def _finish_undo_actions(finish: Callable[..., None], undo_id: Optional[str]) -> None:
+    # Binary Ninja versions before 3.5 do not return an id from begin_undo_actions
+    if undo_id is None:
+        finish()
+    else:
+        finish(undo_id)
+
+
+@contextmanager
+def bulk_analysis_update(bv: binaryninja.BinaryView) -> Iterator[None]:
+    """Groups the changes made in the block into a single undo action, holds analysis while
+    they are made and requests a single analysis update afterwards. The changes are
+    reverted if the block raises."""
+    undo_id = bv.begin_undo_actions()
+    bv.set_analysis_hold(True)
+    try:
+        yield
+    except BaseException:
+        _finish_undo_actions(bv.revert_undo_actions, undo_id)
+        raise
+    else:
+        _finish_undo_actions(bv.commit_undo_actions, undo_id)
+    finally:
+        bv.set_analysis_hold(False)
+    bv.update_analysis()
+
+
+@contextmanager
+def untracked_changes(bv: binaryninja.BinaryView) -> Iterator[None]:
+    """Keeps the changes made in the block out of the undo history, without holding or
+    updating analysis, for writes as frequent as the flushes of a live session. Binary
+    Ninja versions that cannot forget undo actions get a single undo action instead."""
+    undo_id = bv.begin_undo_actions()
+    try:
+        yield
+    except BaseException:
+        _finish_undo_actions(bv.revert_undo_actions, undo_id)
+        raise
+    if undo_id is not None and hasattr(bv, "forget_undo_actions"):
+        bv.forget_undo_actions(undo_id)
+    else:
+        _finish_undo_actions(bv.commit_undo_actions, undo_id)
+
+
 class CommentManager:
-    def __init__(self, bv: binaryninja.BinaryView):
+    # Entries written per comment line; the rest of a megamorphic site is summarized as "+N more"
+    DEFAULT_MAX_ENTRIES = 8
+
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        instrumentation: Optional[Instrumentation] = None,
+        max_entries: Optional[int] = DEFAULT_MAX_ENTRIES,
+    ):
         self.bv = bv
-        self.comments_src: DefaultDict[int, Set[str]] = defaultdict(set)
-        self.comments_dst: DefaultDict[int, Set[str]] = defaultdict(set)
-
-    def add_source_comment(self, addr: int, comment: str) -> None:
-        self.comments_src[addr].add(comment)
-
-    def add_destination_comment(self, addr: int, comment: str) -> None:
-        self.comments_dst[addr].add(comment)
-
-    def set_comments(self) -> None:
-        for prefix, comments in [
-            (CommentPrefix.DESTINATION, self.comments_src),
-            (CommentPrefix.SOURCE, self.comments_dst)
-        ]:
-            self._set_comments_for_prefix(comments, prefix)
-
-    def _set_comments_for_prefix(self, comments: DefaultDict[int, Set[str]], prefix: CommentPrefix) -> None:
-        for addr, comment_set in comments.items():
-            joined_comment = f"BML_{prefix.value}: " + ", ".join(comment_set)
-            existing_comment = self.bv.get_comment_at(addr)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.max_entries = max_entries
+        self.comments_src: DefaultDict[int, DefaultDict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.comments_dst: DefaultDict[int, DefaultDict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # Addresses whose plugin lines are removed unless a comment is collected for them
+        self.cleared: Set[int] = set()
+
+    def add_source_comment(self, addr: int, comment: str, hits: int = 1) -> None:
+        self.comments_src[addr][comment] += hits
+
+    def add_destination_comment(self, addr: int, comment: str, hits: int = 1) -> None:
+        self.comments_dst[addr][comment] += hits
+
+    def clear(self, addresses: Iterable[int]) -> None:
+        """Removes the BML_src/BML_dst lines written earlier at ``addresses``, except those
+        rewritten with the comments collected for them."""
+        self.cleared.update(addresses)
+
+    def retain(self, addresses: Set[int]) -> None:
+        """Drops the comments collected for addresses outside ``addresses``."""
+        for comments in (self.comments_src, self.comments_dst):
+            for addr in [addr for addr in comments if addr not in addresses]:
+                del comments[addr]
+
+    def set_comments(self, bulk: bool = False, should_cancel: Optional[Callable[[], bool]] = None) -> int:
+        """Writes the collected comments and returns how many addresses were annotated.
+
+        In bulk mode all writes are grouped into a single undo action, analysis is held
+        while writing and a single analysis update is requested afterwards. ``should_cancel``
+        is polled between writes; in bulk mode a cancellation reverts the writes done so far
+        and raises OperationCancelled.
+        """
+        if not bulk:
+            return self._write_comments(should_cancel)
+
+        start_time = time.perf_counter()
+        with bulk_analysis_update(self.bv):
+            count = self._write_comments(should_cancel)
+        # Logged to stderr, since stdout carries the JSON results of headless runs and benchmarks
+        print(f"Applied {count} comments in {time.perf_counter() - start_time:.2f}s", file=sys.stderr)
+        return count
+
+    def render_lines(self, addr: int) -> List[str]:
+        """Returns the comment lines collected for ``addr`` without writing them."""
+        return [
+            f"BML_{prefix.value}: {self.format_entries(comments[addr])}"
+            for prefix, comments in self._prefixed_comments()
+            if addr in comments
+        ]
+
+    def _prefixed_comments(self) -> List[Tuple[CommentPrefix, DefaultDict[int, DefaultDict[str, int]]]]:
+        # A branch source lists its destinations and a destination lists its sources
+        return [(CommentPrefix.DESTINATION, self.comments_src), (CommentPrefix.SOURCE, self.comments_dst)]
+
+    def _write_comments(self, should_cancel: Optional[Callable[[], bool]]) -> int:
+        count = 0
+        for prefix, comments in self._prefixed_comments():
+            count += self._set_comments_for_prefix(comments, prefix, should_cancel)
+        return count
+
+    def _set_comments_for_prefix(
+        self,
+        comments: DefaultDict[int, DefaultDict[str, int]],
+        prefix: CommentPrefix,
+        should_cancel: Optional[Callable[[], bool]] = None,
+    ) -> int:
+        line_prefix = f"BML_{prefix.value}: "
+        for addr, comment_hits in comments.items():
+            if should_cancel is not None and should_cancel():
+                raise OperationCancelled()
+            joined_comment = line_prefix + self.format_entries(comment_hits)
+            existing_comment = self.instrumentation.call("get_comment_at", self.bv.get_comment_at, addr)
             if existing_comment:
-                joined_comment = f"{existing_comment}\n{joined_comment}"
-            self.bv.set_comment_at(addr, joined_comment)
+                # Replace the line written by an earlier run instead of stacking another one
+                kept_lines = [line for line in existing_comment.split("\n") if not line.startswith(line_prefix)]
+                joined_comment = "\n".join(kept_lines + [joined_comment])
+            self.instrumentation.call("set_comment_at", self.bv.set_comment_at, addr, joined_comment)
+        count = len(comments)
+        for addr in self.cleared:
+            if addr in comments:
+                continue
+            if should_cancel is not None and should_cancel():
+                raise OperationCancelled()
+            existing_comment = self.instrumentation.call("get_comment_at", self.bv.get_comment_at, addr)
+            lines = existing_comment.split("\n") if existing_comment else []
+            kept_lines = [line for line in lines if not line.startswith(line_prefix)]
+            if len(kept_lines) != len(lines):
+                self.instrumentation.call("set_comment_at", self.bv.set_comment_at, addr, "\n".join(kept_lines))
+                count += 1
+        return count
+
+    def format_entries(self, comment_hits: Dict[str, int]) -> str:
+        """Joins the entries of one address, most hits first, keeping at most ``max_entries``."""
+        entries = _most_common(comment_hits, self.max_entries)
+        joined = ", ".join(f"{comment} [hits:{hits}]" for comment, hits in entries)
+        if (omitted := len(comment_hits) - len(entries)) > 0:
+            omitted_hits = sum(comment_hits.values()) - sum(hits for _, hits in entries)
+            joined += f", +{omitted} more [hits:{omitted_hits}]"
+        return joined
+
+
+class XrefManager:
+    """Collects resolved branch targets and registers them with Binary Ninja's analysis, so
+    that the call graph, cross references and function discovery learn about them.
+
+    Targets of indirect calls become user code references and targets of indirect jumps
+    become user indirect branches. A function is created at every call target that does
+    not start one yet. A jump target only gets one if it leaves the jumping function (a
+    tail call); the targets of a jump table are blocks of that function.
+    """
+
+    def __init__(self, bv: binaryninja.BinaryView, instrumentation: Optional[Instrumentation] = None):
+        self.bv = bv
+        self.instrumentation = instrumentation or Instrumentation()
+        self.targets: DefaultDict[int, Set[int]] = defaultdict(set)
+
+    def add_target(self, src_addr: int, dst_addr: int) -> None:
+        self.targets[src_addr].add(dst_addr)
+
+    def apply(self, should_cancel: Optional[Callable[[], bool]] = None) -> Dict[str, int]:
+        """Creates the missing functions and adds the references. Call it inside
+        bulk_analysis_update so that analysis runs once for all of them."""
+        counts = {"functions": 0, "code_refs": 0, "indirect_branches": 0}
+        call = self.instrumentation.call
+        function_starts: Set[int] = set()
+        for src_addr, dst_addrs in self.targets.items():
+            if should_cancel is not None and should_cancel():
+                raise OperationCancelled()
+            instruction = call("get_disassembly", self.bv.get_disassembly, src_addr) or ""
+            funcs = call("get_functions_containing", self.bv.get_functions_containing, src_addr)
+            if instruction.startswith("jmp"):
+                function_starts.update(dst_addr for dst_addr in dst_addrs if self._leaves(funcs, dst_addr))
+            else:
+                function_starts.update(dst_addrs)
+            for func in funcs:
+                if instruction.startswith("jmp"):
+                    # Setting the user indirect branches replaces them, so keep those of earlier runs
+                    branches = {
+                        (branch.dest_arch, branch.dest_addr)
+                        for branch in func.get_indirect_branches_at(src_addr)
+                        if not branch.auto_defined
+                    }
+                    branches.update((func.arch, dst_addr) for dst_addr in dst_addrs)
+                    branches = sorted(branches, key=lambda branch: branch[1])
+                    call("set_user_indirect_branches", func.set_user_indirect_branches, src_addr, branches)
+                    counts["indirect_branches"] += len(dst_addrs)
+                else:
+                    for dst_addr in sorted(dst_addrs):
+                        call("add_user_code_ref", func.add_user_code_ref, src_addr, dst_addr)
+                    counts["code_refs"] += len(dst_addrs)
+
+        for dst_addr in sorted(function_starts):
+            if call("get_function_at", self.bv.get_function_at, dst_addr) is None:
+                call("create_user_function", self.bv.create_user_function, dst_addr)
+                counts["functions"] += 1
+        for name, count in counts.items():
+            self.instrumentation.count(f"xrefs.{name}", count)
+        return counts
+
+    def _leaves(self, funcs: List[Any], dst_addr: int) -> bool:
+        """Whether a jump to ``dst_addr`` leaves every function in ``funcs``. Blocks behind an
+        unresolved jump are not part of a function yet, so a function spans up to the next
+        function start."""
+        for func in funcs:
+            end = self.instrumentation.call(
+                "get_next_function_start_after", self.bv.get_next_function_start_after, func.start
+            )
+            if func.start <= dst_addr < end:
+                return False
+        return True
+
+
+# Comments added at the source and destination address of an edge, if any
+EdgeComments = Tuple[Optional[str], Optional[str]]
+
+
+class FunctionIndex(IntervalIndex):
+    """Address ranges of every function of a BinaryView, built by walking the functions once
+    so that later name lookups do not call into the BinaryView."""
+
+    def __init__(self, functions: Iterable[Tuple[int, List[Tuple[int, int]], str]]):
+        self.names_at: Dict[int, str] = {}
+        ranges = []
+        for start, address_ranges, name in functions:
+            self.names_at.setdefault(start, name)
+            ranges += [(range_start, range_end, name) for range_start, range_end in address_ranges]
+        super().__init__(ranges)
+
+    @classmethod
+    def from_binary_view(cls, bv: binaryninja.BinaryView) -> "FunctionIndex":
+        return cls(
+            (func.start, [(r.start, r.end) for r in func.address_ranges], func.name) for func in bv.functions
+        )
+
+    def name_at(self, addr: int) -> Optional[str]:
+        return self.names_at.get(addr)
+
+
+# Operand kind and register of an indirect branch; the register is the base register of a
+# memory operand or the target register of a register operand
+CallSite = Tuple[OperandKind, Optional[str]]
+
+
+class CallSiteTable:
+    """Every indirect call/jmp of a BinaryView with its operand kind and register, kept in
+    arrays sorted by address.
+
+    It is built by walking the disassembly of every function once, which replaces the
+    per-site disassembly and LLIL lifting when many unique sites have to be classified.
+    """
+
+    _KINDS = list(OperandKind)
+
+    def __init__(self, sites: Iterable[Tuple[int, OperandKind, Optional[str]]]):
+        self.registers = StringTable()
+        self.addresses = array("Q")
+        self.kinds = array("B")
+        self.register_ids = array("i")
+        for addr, kind, register in sorted(sites, key=lambda site: site[0]):
+            # Instructions shared by several functions are walked more than once
+            if self.addresses and self.addresses[-1] == addr:
+                continue
+            self.addresses.append(addr)
+            self.kinds.append(self._KINDS.index(kind))
+            self.register_ids.append(-1 if register is None else self.registers.intern(register))
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    @classmethod
+    def from_binary_view(cls, bv: binaryninja.BinaryView) -> "CallSiteTable":
+        return cls(
+            (addr, *site)
+            for func in bv.functions
+            for tokens, addr in func.instructions
+            if (site := cls.classify(tokens)) is not None
+        )
+
+    @staticmethod
+    def classify(tokens: List[Any]) -> Optional[CallSite]:
+        """Classifies the disassembly tokens of one instruction; None unless it is an
+        indirect call or jmp."""
+        texts = [text for token in tokens if (text := token.text.strip())]
+        if len(texts) < 2 or texts[0] not in ("call", "jmp"):
+            return None
+        if "[" in texts:
+            operands = texts[texts.index("[") + 1:]
+            if not operands:
+                return None
+            if operands[0] in ("rip", "rel"):
+                return OperandKind.RIP_RELATIVE, None
+            return OperandKind.MEMORY, operands[0] if operands[0] in BASE_REGISTER_CANDIDATES else None
+        if texts[-1] in BASE_REGISTER_CANDIDATES:
+            return OperandKind.REGISTER, texts[-1]
+        return None
+
+    def _site(self, index: int) -> CallSite:
+        register_id = self.register_ids[index]
+        return self._KINDS[self.kinds[index]], None if register_id < 0 else self.registers[register_id]
+
+    def lookup(self, addr: int) -> Optional[CallSite]:
+        index = bisect.bisect_left(self.addresses, addr)
+        if index < len(self.addresses) and self.addresses[index] == addr:
+            return self._site(index)
+        return None
+
+    def lookup_many(self, addresses: Sequence[int]) -> List[Optional[CallSite]]:
+        """Classifies every address in one pass; equivalent to ``[lookup(addr) for addr in addresses]``."""
+        table_addresses, size = self.addresses, len(self.addresses)
+        found: List[Optional[CallSite]] = []
+        for addr, index in zip(addresses, map(partial(bisect.bisect_left, table_addresses), addresses)):
+            found.append(self._site(index) if index < size and table_addresses[index] == addr else None)
+        return found
+
+
+class StringTable:
+    def __init__(self, strings: Optional[List[str]] = None):
+        self.strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        for string in strings or []:
+            self.intern(string)
+
+    def __getitem__(self, string_id: int) -> str:
+        return self.strings[string_id]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def intern(self, string: str) -> int:
+        if (string_id := self._string_ids.get(string)) is None:
+            string_id = self._string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+
+class EdgeStore:
+    """Deduplicated branch edges kept in typed columns instead of Python objects.
+
+    Row ``i`` of every column describes one unique edge. Module and function names are
+    interned into ``strings`` and referenced by index, a missing vtable is stored as
+    ``NO_VTABLE``, and the dedup index maps a packed edge key to its row.
+    """
+
+    NO_VTABLE = -(1 << 63)
+    _PACKED_KEY = struct.Struct("<IqIIqq")
+
+    def __init__(self):
+        self.strings = StringTable()
+        self.src_module = array("I")
+        self.src_offset = array("q")
+        self.dst_module = array("I")
+        self.dst_func = array("I")
+        self.dst_offset = array("q")
+        self.vtable_offset = array("q")
+        self.hits = array("Q")
+        self._index: Dict[bytes, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.hits)
+
+    def add(self, key: EdgeKey, hits: int = 1) -> Tuple[int, bool]:
+        """Adds ``hits`` to an edge and returns its row and whether the edge is new."""
+        src_module, src_offset, dst_module, dst_func, dst_offset, vtable_offset = key
+        intern = self.strings.intern
+        row_values = (
+            intern(src_module), src_offset, intern(dst_module), intern(dst_func), dst_offset,
+            self.NO_VTABLE if vtable_offset is None else vtable_offset,
+        )
+        packed_key = self._PACKED_KEY.pack(*row_values)
+        if (row := self._index.get(packed_key)) is not None:
+            self.hits[row] += hits
+            return row, False
+
+        row = self._index[packed_key] = len(self.hits)
+        for column, value in zip(self._key_columns(), row_values):
+            column.append(value)
+        self.hits.append(hits)
+        return row, True
+
+    def key(self, row: int) -> EdgeKey:
+        vtable_offset = self.vtable_offset[row]
+        return (
+            self.strings[self.src_module[row]], self.src_offset[row],
+            self.strings[self.dst_module[row]], self.strings[self.dst_func[row]], self.dst_offset[row],
+            None if vtable_offset == self.NO_VTABLE else vtable_offset,
+        )
+
+    def items(self) -> Iterator[Tuple[EdgeKey, int]]:
+        for row in range(len(self)):
+            yield self.key(row), self.hits[row]
+
+    def clear(self) -> None:
+        """Drops every edge and releases the columns and the dedup index."""
+        self.__init__()
+
+    def _key_columns(self) -> Tuple[array, ...]:
+        return self.src_module, self.src_offset, self.dst_module, self.dst_func, self.dst_offset, self.vtable_offset
+
+
+class EdgeCache:
+    """Memory-mapped binary file holding the deduplicated edges of a branch trace.
+
+    Layout (little endian): a fixed header, a module table of (name id, base address),
+    a string table of end offsets followed by the UTF-8 blob, and fixed-width edge
+    records. The header identifies the trace the edges were taken from by size, mtime
+    and a digest of its content, so a cache can be reused as long as the trace is
+    unchanged and can also be shared as a standalone export.
+    """
+
+    SUFFIX = ".bmlc"
+    MAGIC = b"BMLEDGE\0"
+    VERSION = 1
+    _HEADER = struct.Struct("<8sIIQq16sQQQQ")
+    _MODULE = struct.Struct("<IIQ")
+    _STRING_END = struct.Struct("<Q")
+    # src module, dst module, dst func, padding, src offset, dst offset, vtable offset, hits
+    _EDGE = struct.Struct("<IIIIqqqQ")
+    _DIGEST_CHUNK_SIZE = 1 << 20
+    NO_DIGEST = bytes(16)
+
+    def __init__(self, path: str, data: Optional[bytes] = None):
+        """Maps the cache file at ``path``, or parses ``data`` if given (e.g. from metadata)."""
+        self.path = path
+        if data is not None:
+            self._buffer = data
+        else:
+            with open(path, "rb") as fin:
+                self._buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except (struct.error, ValueError):
+            self._close_buffer()
+            raise
+
+    def _parse(self) -> None:
+        (
+            magic, version, edge_size, self.source_size, self.source_mtime_ns, self.source_digest,
+            module_count, string_count, blob_size, edge_count,
+        ) = self._HEADER.unpack_from(self._buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION or edge_size != self._EDGE.size:
+            raise ValueError(f"{self.path} is not a version {self.VERSION} edge cache")
+
+        offset = self._HEADER.size
+        modules = list(self._MODULE.iter_unpack(self._buffer[offset:offset + module_count * self._MODULE.size]))
+        offset += module_count * self._MODULE.size
+
+        blob_start = offset + string_count * self._STRING_END.size
+        self.strings: List[str] = []
+        string_start = blob_start
+        for (string_end,) in self._STRING_END.iter_unpack(self._buffer[offset:blob_start]):
+            self.strings.append(self._buffer[string_start:blob_start + string_end].decode("utf-8"))
+            string_start = blob_start + string_end
+        offset = self._align(blob_start + blob_size)
+
+        self.modules = {self.strings[name_id]: base for name_id, _, base in modules}
+        self.edge_count = edge_count
+        if offset + edge_count * self._EDGE.size > len(self._buffer):
+            raise ValueError(f"{self.path} is truncated")
+        self._edges = memoryview(self._buffer)[offset:offset + edge_count * self._EDGE.size]
+
+    def __len__(self) -> int:
+        return self.edge_count
+
+    def __enter__(self) -> "EdgeCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._edges.release()
+        self._close_buffer()
+
+    def _close_buffer(self) -> None:
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def items(self) -> Iterator[Tuple[EdgeKey, int]]:
+        strings = self.strings
+        for src_module, dst_module, dst_func, _, src_offset, dst_offset, vtable_offset, hits in (
+            self._EDGE.iter_unpack(self._edges)
+        ):
+            if vtable_offset == EdgeStore.NO_VTABLE:
+                vtable_offset = None
+            key = (strings[src_module], src_offset, strings[dst_module], strings[dst_func], dst_offset, vtable_offset)
+            yield key, hits
+
+    def matches(self, trace_path: str) -> bool:
+        stat = os.stat(trace_path)
+        if stat.st_size != self.source_size:
+            return False
+        if stat.st_mtime_ns == self.source_mtime_ns:
+            return True
+        # A touched or copied trace is only accepted if its whole content is unchanged
+        return self.source_digest != self.NO_DIGEST and self.digest(trace_path) == self.source_digest
+
+    @classmethod
+    def path_for(cls, trace_path: str) -> str:
+        return trace_path + cls.SUFFIX
+
+    @classmethod
+    def open_for_trace(cls, trace_path: str) -> Optional["EdgeCache"]:
+        """Returns the cache next to ``trace_path`` if it exists and was built from that trace."""
+        cache_path = cls.path_for(trace_path)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            cache = cls(cache_path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Ignoring unreadable edge cache {cache_path}: {e}", file=sys.stderr)
+            return None
+        if not cache.matches(trace_path):
+            cache.close()
+            return None
+        return cache
+
+    @classmethod
+    def digest(cls, trace_path: str) -> bytes:
+        hasher = hashlib.blake2b(digest_size=16)
+        with open(trace_path, "rb") as fin:
+            hasher.update(os.fstat(fin.fileno()).st_size.to_bytes(8, "little"))
+            while chunk := fin.read(cls._DIGEST_CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.digest()
+
+    @classmethod
+    def write(
+        cls,
+        path: str,
+        modules: Dict[str, int],
+        edges: Union[EdgeStore, "EdgeCache"],
+        trace_path: Optional[str] = None,
+        digest: Optional[bytes] = None,
+    ) -> None:
+        """Writes ``edges`` to ``path``; ``trace_path`` records the trace they were built from."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as fout:
+            fout.write(cls.serialize(modules, edges, trace_path, digest))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def serialize(
+        cls,
+        modules: Dict[str, int],
+        edges: Union[EdgeStore, "EdgeCache"],
+        trace_path: Optional[str] = None,
+        digest: Optional[bytes] = None,
+    ) -> bytes:
+        """``digest`` is that of ``trace_path`` if already known; with NO_DIGEST the trace is
+        identified by size and mtime alone."""
+        strings = StringTable()
+        module_table = b"".join(cls._MODULE.pack(strings.intern(name), 0, base) for name, base in modules.items())
+        edge_table = bytearray()
+        for (src_module, src_offset, dst_module, dst_func, dst_offset, vtable_offset), hits in edges.items():
+            edge_table += cls._EDGE.pack(
+                strings.intern(src_module), strings.intern(dst_module), strings.intern(dst_func), 0,
+                src_offset, dst_offset, EdgeStore.NO_VTABLE if vtable_offset is None else vtable_offset, hits,
+            )
+
+        string_ends = bytearray()
+        blob = bytearray()
+        for string in strings.strings:
+            blob += string.encode("utf-8")
+            string_ends += cls._STRING_END.pack(len(blob))
+        string_table = bytes(string_ends) + bytes(blob)
+        string_table += bytes(cls._align(len(string_table)) - len(string_table))
+
+        source_size, source_mtime_ns, source_digest = 0, 0, cls.NO_DIGEST
+        if trace_path is not None:
+            stat = os.stat(trace_path)
+            source_size, source_mtime_ns = stat.st_size, stat.st_mtime_ns
+            source_digest = digest if digest is not None else cls.digest(trace_path)
+        header = cls._HEADER.pack(
+            cls.MAGIC, cls.VERSION, cls._EDGE.size, source_size, source_mtime_ns, source_digest,
+            len(modules), len(strings), len(blob), len(edge_table) // cls._EDGE.size,
+        )
+        return b"".join((header, module_table, string_table, edge_table))
+
+    @staticmethod
+    def _align(offset: int) -> int:
+        return (offset + 7) & ~7
+
+
+class AnalysisMetadata:
+    """Edge set of every trace loaded into a BinaryView, persisted in its metadata.
+
+    The edges are stored in the EdgeCache format so that a later load only has to
+    annotate edges it adds or makes hotter. The traces merged so far are recorded by
+    path and digest: the hits of a trace not merged before are added to the stored
+    ones, while re-loading the same or an extended trace keeps the highest hit count
+    seen, so it does not inflate the counts.
+    """
+
+    KEY = "binja_missinglink.edges"
+    # The trace module of a BinaryView annotated by a MultiModuleAnnotator
+    MODULE_KEY = "binja_missinglink.module"
+    TRACES_KEY = "binja_missinglink.traces"
+    # Which annotations of the stored edges are complete
+    STATE_KEY = "binja_missinglink.state"
+
+    @classmethod
+    def load(cls, bv: binaryninja.BinaryView) -> EdgeStore:
+        edges = EdgeStore()
+        try:
+            data = bv.query_metadata(cls.KEY)
+        except KeyError:
+            return edges
+        try:
+            with EdgeCache(cls.KEY, bytes(data)) as previous_edges:
+                for key, hits in previous_edges.items():
+                    edges.add(key, hits)
+        except (ValueError, struct.error) as e:
+            print(f"Ignoring unreadable {cls.KEY} metadata: {e}", file=sys.stderr)
+        return edges
+
+    @classmethod
+    def load_module(cls, bv: binaryninja.BinaryView) -> Optional[str]:
+        try:
+            return str(bv.query_metadata(cls.MODULE_KEY))
+        except KeyError:
+            return None
+
+    @classmethod
+    def load_traces(cls, bv: binaryninja.BinaryView) -> List[Dict[str, Optional[str]]]:
+        """Returns the ``{"path": ..., "digest": ...}`` of every trace merged into the view."""
+        try:
+            return json.loads(str(bv.query_metadata(cls.TRACES_KEY)))
+        except KeyError:
+            return []
+
+    @classmethod
+    def load_state(cls, bv: binaryninja.BinaryView) -> Dict[str, bool]:
+        """Returns the state of the stored edges. ``comments`` is False once a lazy load stored
+        edges whose comments were not written, and ``xrefs`` is True while the cross
+        references of every stored edge are registered."""
+        state = {"comments": True, "xrefs": False}
+        try:
+            state.update(json.loads(str(bv.query_metadata(cls.STATE_KEY))))
+        except KeyError:
+            pass
+        return state
+
+    @staticmethod
+    def record_trace(traces: List[Dict[str, Optional[str]]], trace_path: str, digest: Optional[bytes]) -> bool:
+        """Adds the trace to ``traces`` and returns whether it is new, i.e. neither its path
+        nor its content was merged before. A known path is an extended trace."""
+        path = os.path.abspath(trace_path)
+        digest_hex = digest.hex() if digest is not None and digest != EdgeCache.NO_DIGEST else None
+        for trace in traces:
+            if trace["path"] == path or (digest_hex is not None and trace["digest"] == digest_hex):
+                if trace["path"] == path and digest_hex is not None:
+                    trace["digest"] = digest_hex
+                return False
+        traces.append({"path": path, "digest": digest_hex})
+        return True
+
+    @classmethod
+    def store(
+        cls,
+        bv: binaryninja.BinaryView,
+        modules: Dict[str, int],
+        edges: EdgeStore,
+        module: Optional[str] = None,
+        traces: Optional[List[Dict[str, Optional[str]]]] = None,
+        state: Optional[Dict[str, bool]] = None,
+    ) -> None:
+        bv.store_metadata(cls.KEY, EdgeCache.serialize(modules, edges))
+        if module is not None:
+            bv.store_metadata(cls.MODULE_KEY, module)
+        if traces is not None:
+            bv.store_metadata(cls.TRACES_KEY, json.dumps(traces))
+        if state is not None:
+            bv.store_metadata(cls.STATE_KEY, json.dumps(state))
+
+    @staticmethod
+    def merge(edges: EdgeStore, new_edges: Union[EdgeStore, EdgeCache], accumulate: bool = False) -> List[EdgeKey]:
+        """Merges ``new_edges`` into ``edges`` and returns the keys that are new or hotter."""
+        return AnalysisMetadata.merge_items(edges, new_edges.items(), accumulate)
+
+    @staticmethod
+    def merge_items(
+        edges: EdgeStore, new_edges: Iterable[Tuple[EdgeKey, int]], accumulate: bool = False
+    ) -> List[EdgeKey]:
+        """Adds the hits of ``new_edges`` with ``accumulate``, and otherwise keeps the higher count."""
+        changed = []
+        for key, hits in new_edges:
+            row, _ = edges.add(key, 0)
+            if accumulate and hits:
+                edges.hits[row] += hits
+                changed.append(key)
+            elif hits > edges.hits[row]:
+                edges.hits[row] = hits
+                changed.append(key)
+        return changed
+
+
+class PolymorphismIndex:
+    """Per call site, the hits of every target and vtable it branched to, and per target
+    the call sites that reached it. Sites and targets are (module, offset) pairs.
+
+    It is built from the deduplicated edges, so queries such as the hottest or the
+    megamorphic call sites are answered without reading the trace again. Comments are
+    sorted and truncated by CommentManager from the hits of their own entries.
+    """
+
+    def __init__(self):
+        self.site_hits: DefaultDict[CallSiteKey, int] = defaultdict(int)
+        self.targets: DefaultDict[CallSiteKey, DefaultDict[CallSiteKey, int]] = defaultdict(lambda: defaultdict(int))
+        # vtable offsets are relative to the call site's module
+        self.vtables: DefaultDict[CallSiteKey, DefaultDict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.callers: DefaultDict[CallSiteKey, Set[CallSiteKey]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self.site_hits)
+
+    @classmethod
+    def from_edges(cls, edges: Union[EdgeStore, EdgeCache]) -> "PolymorphismIndex":
+        index = cls()
+        for key, hits in edges.items():
+            index.add(key, hits)
+        return index
+
+    def add(self, key: EdgeKey, hits: int = 1) -> None:
+        src_module, src_offset, dst_module, _, dst_offset, vtable_offset = key
+        site, target = (src_module, src_offset), (dst_module, dst_offset)
+        self.site_hits[site] += hits
+        self.targets[site][target] += hits
+        if vtable_offset is not None:
+            self.vtables[site][vtable_offset] += hits
+        self.callers[target].add(site)
+
+    def hottest(self, count: int) -> List[Tuple[CallSiteKey, int]]:
+        """Returns the ``count`` call sites with the most hits, hottest first."""
+        return heapq.nlargest(count, self.site_hits.items(), key=lambda item: (item[1], item[0]))
+
+    def megamorphic(self, min_targets: int) -> List[CallSiteKey]:
+        """Returns the call sites with more than ``min_targets`` targets, most targets first."""
+        sites = [site for site, targets in self.targets.items() if len(targets) > min_targets]
+        return sorted(sites, key=lambda site: (-len(self.targets[site]), site))
+
+    def targets_of(self, site: CallSiteKey, count: Optional[int] = None) -> List[Tuple[CallSiteKey, int]]:
+        """Returns the targets of a call site with their hits, hottest first."""
+        return _most_common(self.targets.get(site, {}), count)
+
+    def vtables_of(self, site: CallSiteKey, count: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Returns the vtable offsets seen at a call site with their hits, most frequent first."""
+        return _most_common(self.vtables.get(site, {}), count)
+
+    def callers_of(self, target: CallSiteKey) -> List[CallSiteKey]:
+        return sorted(self.callers.get(target, ()))
+
+    def summary(self, count: int = 10, min_targets: int = 4) -> Dict[str, Any]:
+        return {
+            "sites": len(self.site_hits),
+            "targets": len(self.callers),
+            "megamorphic_sites": len(self.megamorphic(min_targets)),
+            "hottest": [
+                {
+                    "site": f"{module}+{hex(offset)}",
+                    "hits": hits,
+                    "targets": len(self.targets[(module, offset)]),
+                    "vtables": [hex(vtable) for vtable, _ in self.vtables_of((module, offset), 3)],
+                }
+                for (module, offset), hits in self.hottest(count)
+            ],
+        }
+
+
+class TraceSet:
+    """The deduplicated edges of several traces of the same binaries.
+
+    Every edge is tagged with the traces it was hit in, as a bit mask over ``names``, and
+    keeps the sum of its hits over them. Edges are module-relative, so traces of runs
+    with different load addresses merge into the same edges.
+    """
+
+    def __init__(self, names: Sequence[str]):
+        if len(set(names)) != len(names):
+            raise ValueError("trace names must be unique")
+        self.names = list(names)
+        self.modules: Dict[str, int] = {}
+        self.edges = EdgeStore()
+        # Per edge row, bit i is set if trace names[i] hit the edge
+        self.masks: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.edges)
+
+    def add_trace(self, name: str, modules: Dict[str, int], edges: Union[EdgeStore, EdgeCache]) -> None:
+        """Streams the edges of one trace into the set."""
+        bit = 1 << self.names.index(name)
+        for module, base in modules.items():
+            self.modules.setdefault(module, base)
+        for key, hits in edges.items():
+            row, is_new = self.edges.add(key, hits)
+            if is_new:
+                self.masks.append(bit)
+            else:
+                self.masks[row] |= bit
+
+    def traces_of(self, row: int) -> List[str]:
+        mask = self.masks[row]
+        return [name for index, name in enumerate(self.names) if mask >> index & 1]
+
+    def select(
+        self,
+        operation: SetOperation = SetOperation.UNION,
+        names: Optional[Sequence[str]] = None,
+        others: Optional[Sequence[str]] = None,
+    ) -> List[int]:
+        """Returns the rows of the edges hit by any of ``names`` (UNION), by all of them
+        (INTERSECTION), or by any of them and none of ``others`` (DIFFERENCE). ``names``
+        defaults to every trace and ``others`` to every trace not in ``names``."""
+        selected = self._mask(names if names is not None else self.names)
+        if operation == SetOperation.UNION:
+            return [row for row, mask in enumerate(self.masks) if mask & selected]
+        if operation == SetOperation.INTERSECTION:
+            return [row for row, mask in enumerate(self.masks) if mask & selected == selected]
+        excluded = self._mask(others) if others is not None else ((1 << len(self.names)) - 1) & ~selected
+        return [row for row, mask in enumerate(self.masks) if mask & selected and not mask & excluded]
+
+    def query(
+        self,
+        operation: SetOperation = SetOperation.UNION,
+        names: Optional[Sequence[str]] = None,
+        others: Optional[Sequence[str]] = None,
+    ) -> EdgeStore:
+        """Returns the edges selected by ``select`` with their hits."""
+        return self.subset(self.select(operation, names, others))
+
+    def subset(self, rows: Iterable[int]) -> EdgeStore:
+        edges = EdgeStore()
+        for row in rows:
+            edges.add(self.edges.key(row), self.edges.hits[row])
+        return edges
+
+    def export(self, path: str, rows: Optional[Iterable[int]] = None) -> None:
+        """Writes the edges in ``rows`` (by default all) to ``path``: as an edge cache if it ends
+        with .bmlc, otherwise as JSON Lines with the traces of every edge."""
+        rows = range(len(self)) if rows is None else rows
+        if path.endswith(EdgeCache.SUFFIX):
+            EdgeCache.write(path, self.modules, self.subset(rows))
+            return
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as fout:
+            modules = [{"name": name, "addr": hex(base)} for name, base in self.modules.items()]
+            fout.write(json.dumps({"modules": modules, "traces": self.names}) + "\n")
+            for row in rows:
+                src_module, src_offset, dst_module, dst_func, dst_offset, vtable_offset = self.edges.key(row)
+                fout.write(json.dumps({
+                    "src_module": src_module,
+                    "src_offset": hex(src_offset),
+                    "dst_module": dst_module,
+                    "dst_func": dst_func,
+                    "dst_offset": hex(dst_offset),
+                    "vtable_offset": None if vtable_offset is None else hex(vtable_offset),
+                    "hits": self.edges.hits[row],
+                    "traces": self.traces_of(row),
+                }) + "\n")
+        os.replace(temp_path, path)
+
+    def _mask(self, names: Sequence[str]) -> int:
+        mask = 0
+        for name in names:
+            if name not in self.names:
+                raise KeyError(f"unknown trace {name}")
+            mask |= 1 << self.names.index(name)
+        return mask
+
+
+def _trace_names(trace_paths: Sequence[str]) -> List[str]:
+    """Names traces by their file names, or by their paths if file names repeat."""
+    names = [os.path.basename(path) for path in trace_paths]
+    return names if len(set(names)) == len(names) else list(trace_paths)
+
+
+def _most_common(counts: Dict[Any, int], count: Optional[int] = None) -> List[Tuple[Any, int]]:
+    """Returns the items of ``counts`` by descending count, ties ordered by key."""
+    if count is not None:
+        return heapq.nsmallest(count, counts.items(), key=lambda item: (-item[1], item[0]))
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+class PreviewCheckpoint:
+    """Edges collected by a windowed preview and the trace offset it stopped at, kept in
+    the metadata so that a later run continues from there instead of starting over."""
+
+    KEY = "binja_missinglink.preview"
+    EDGES_KEY = "binja_missinglink.preview_edges"
+
+    @classmethod
+    def store(
+        cls, bv: binaryninja.BinaryView, trace_path: str, offset: int, records: int,
+        modules: Dict[str, int], edges: EdgeStore,
+    ) -> None:
+        bv.store_metadata(cls.KEY, json.dumps({"trace": trace_path, "offset": offset, "records": records}))
+        # Hashing the whole trace would cost more than the preview itself
+        bv.store_metadata(cls.EDGES_KEY, EdgeCache.serialize(modules, edges, trace_path, EdgeCache.NO_DIGEST))
+
+    @classmethod
+    def load(cls, bv: binaryninja.BinaryView, trace_path: str) -> Optional[Tuple[int, int, EdgeStore]]:
+        """Returns (offset, records, edges) of the preview of ``trace_path`` if the trace is unchanged."""
+        try:
+            state = json.loads(bv.query_metadata(cls.KEY))
+            data = bytes(bv.query_metadata(cls.EDGES_KEY))
+        except KeyError:
+            return None
+        if state["trace"] != trace_path:
+            return None
+        edges = EdgeStore()
+        try:
+            with EdgeCache(cls.EDGES_KEY, data) as preview_edges:
+                if not preview_edges.matches(trace_path):
+                    return None
+                for key, hits in preview_edges.items():
+                    edges.add(key, hits)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Ignoring unreadable {cls.KEY} metadata: {e}", file=sys.stderr)
+            return None
+        return state["offset"], state["records"], edges
+
+    @classmethod
+    def clear(cls, bv: binaryninja.BinaryView) -> None:
+        for key in (cls.KEY, cls.EDGES_KEY):
+            try:
+                bv.remove_metadata(key)
+            except KeyError:
+                pass
 
 
 class BranchAnalyzer:
-    def __init__(self, bv: binaryninja.BinaryView, modules: Dict[str, int]):
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        modules: Dict[str, int],
+        cache_size: Optional[int] = 1 << 16,
+        eviction_policy: EvictionPolicy = EvictionPolicy.LRU,
+        instrumentation: Optional[Instrumentation] = None,
+        call_site_table_after: Optional[int] = None,
+        module: Optional[str] = None,
+    ):
         self.bv = bv
         self.modules = modules
-        self.comment_manager = CommentManager(bv)
+        # The trace module held by the BinaryView. Only edges from or to it are annotated;
+        # None treats the view as every module of the trace.
+        self.module = module
+        self.module_index = ModuleIndex(modules)
+        # Set to resolve function names from a FunctionIndex instead of the BinaryView
+        self.function_index: Optional[FunctionIndex] = None
+        # Set, or built once ``call_site_table_after`` distinct sites were classified, to
+        # classify branch sites without disassembling and lifting each one
+        self.call_sites: Optional[CallSiteTable] = None
+        self.call_site_table_after = call_site_table_after
+        self.instrumentation = instrumentation or Instrumentation()
+        self.comment_manager = CommentManager(bv, self.instrumentation)
+        # Set to also collect the resolved intra-module targets as cross references
+        self.xref_manager: Optional[XrefManager] = None
+        # Set to the targets and callers of every call site in the view's edges, for get_site_vtables
+        self.polymorphism: Optional[PolymorphismIndex] = None
+        self.cache = BinaryViewCache(cache_size, eviction_policy)
+        self.edges = EdgeStore()
+        # Per edge row, the interned source/destination comment or -1 if there is none
+        self._comment_strings = StringTable()
+        self._src_comments = array("i")
+        self._dst_comments = array("i")
 
     @staticmethod
     def get_memory_disp(tokens: List[str]) -> List[str]:
@@ -85,56 +1452,248 @@ class BranchAnalyzer:
         return operands
 
     def get_func_name_at(self, addr: int) -> Optional[str]:
-        func = self.bv.get_function_at(addr)
-        if func is not None and not func.name.startswith("sub"):
-            return func.name
-        return None
+        return self.cache.func_name_at.get(addr, self._lookup_func_name_at)
 
     def get_func_name_containing(self, addr: int) -> Optional[str]:
-        funcs = self.bv.get_functions_containing(addr)
-        if funcs and not funcs[0].name.startswith("sub"):
-            return funcs[0].name
+        return self.cache.func_name_containing.get(addr, self._lookup_func_name_containing)
+
+    def get_symbol_name_at(self, addr: int) -> Optional[str]:
+        return self.cache.symbol.get(addr, self._lookup_symbol_name_at)
+
+    @staticmethod
+    def _filter_func_name(name: Optional[str]) -> Optional[str]:
+        # Auto-generated sub_* names add nothing to the address shown next to them
+        if name is not None and not name.startswith("sub"):
+            return name
         return None
 
+    def _lookup_func_name_at(self, addr: int) -> Optional[str]:
+        if self.function_index is not None:
+            return self._filter_func_name(self.function_index.name_at(addr))
+        func = self.instrumentation.call("get_function_at", self.bv.get_function_at, addr)
+        return self._filter_func_name(func.name if func is not None else None)
+
+    def _lookup_func_name_containing(self, addr: int) -> Optional[str]:
+        if self.function_index is not None:
+            return self._filter_func_name(self.function_index.find(addr))
+        funcs = self.instrumentation.call("get_functions_containing", self.bv.get_functions_containing, addr)
+        return self._filter_func_name(funcs[0].name if funcs else None)
+
+    def prefetch_function_names(self, keys: Iterable[EdgeKey]) -> None:
+        """Resolves the function names needed by the intra-module edges in ``keys`` in one
+        batch over the function index and puts them in the lookup caches."""
+        if self.function_index is None:
+            return
+        src_addrs, dst_addrs = set(), set()
+        for src_module, src_offset, dst_module, _, dst_offset, _ in keys:
+            if src_module == dst_module and self._is_local(src_module):
+                src_addrs.add(src_offset + self.bv.start)
+                dst_addrs.add(dst_offset + self.bv.start)
+        src_addrs = sorted(src_addrs)
+        for addr, name in zip(src_addrs, self.function_index.find_many(src_addrs)):
+            self.cache.func_name_containing.put(addr, self._filter_func_name(name))
+        for addr in dst_addrs:
+            self.cache.func_name_at.put(addr, self._filter_func_name(self.function_index.name_at(addr)))
+
+    def prefetch_call_sites(self, addresses: Iterable[int]) -> None:
+        """Classifies the branch sites at ``addresses`` in one batch over the call-site table
+        and puts the results in the lookup caches. Sites missing from the table are left to
+        the per-site lookups."""
+        if self._get_call_sites() is None:
+            return
+        addresses = sorted(set(addresses))
+        for addr, site in zip(addresses, self.call_sites.lookup_many(addresses)):
+            if site is not None:
+                self.cache.instruction.put(addr, None)
+                self.cache.base_register.put(addr, self._get_call_site_base_register(site))
+
+    def prefetch_sites(self, sites: Iterable[CallSiteKey]) -> None:
+        self.prefetch_call_sites(
+            src_offset + self.bv.start for src_module, src_offset in sites if self._is_local(src_module)
+        )
+
+    def _lookup_symbol_name_at(self, addr: int) -> Optional[str]:
+        symbol = self.instrumentation.call("get_symbol_at", self.bv.get_symbol_at, addr)
+        return symbol.name if symbol is not None else None
+
+    def _is_local(self, module: str) -> bool:
+        return self.module is None or module == self.module
+
     def analyze_branch(self, branch: Dict) -> None:
-        before = BranchData(**branch["before"])
-        after = BranchData(**branch["after"])
+        self.add_edge(self.get_edge_key(branch))
+
+    def get_edge_key(self, branch: Dict) -> EdgeKey:
+        return make_edge_key(branch, self.module_index, self.get_site_base_register)
+
+    def get_site_base_register(self, src_module: str, src_offset: int) -> Optional[str]:
+        """Returns the base register of a call site, or None if it is not in this BinaryView."""
+        if not self._is_local(src_module):
+            return None
+        return self.get_base_register(src_offset + self.bv.start)
+
+    @property
+    def edge_hits(self) -> Dict[EdgeKey, int]:
+        return dict(self.edges.items())
+
+    def add_edge(self, key: EdgeKey, hits: int = 1) -> None:
+        """Counts ``hits`` occurrences of an edge, resolving it against the BinaryView only once."""
+        row, is_new = self.edges.add(key, hits)
+        if is_new:
+            self.instrumentation.count("resolved_edges")
+            for comment_ids, comment in zip((self._src_comments, self._dst_comments), self._resolve_edge(key)):
+                comment_ids.append(-1 if comment is None else self._comment_strings.intern(comment))
 
-        src_addr = before.get_reg_value_as_bv("rip", self.modules, self.bv)
-        
-        if before.module == after.module:
-            self._analyze_internal_branch(before, after, src_addr)
+        src_comment, dst_comment = self._src_comments[row], self._dst_comments[row]
+        self._add_comments(
+            key, hits,
+            self._comment_strings[src_comment] if src_comment >= 0 else None,
+            self._comment_strings[dst_comment] if dst_comment >= 0 else None,
+        )
+
+    def resolve_edge(self, key: EdgeKey, hits: int) -> None:
+        """Adds the comments of an already deduplicated edge without keeping it in ``edges``."""
+        self.instrumentation.count("resolved_edges")
+        self._add_comments(key, hits, *self._resolve_edge(key))
+
+    def _add_comments(
+        self, key: EdgeKey, hits: int, src_comment: Optional[str], dst_comment: Optional[str]
+    ) -> None:
+        src_module, src_offset, dst_module, _, dst_offset, _ = key
+        if src_comment is None and dst_comment is None:
+            # Only an intra-module edge whose source is not an indirect branch has no comment
+            if self._is_local(src_module):
+                self.instrumentation.skip(self._get_skip_reason(src_offset + self.bv.start), hits)
+            return
+        if src_comment is not None:
+            self.comment_manager.add_source_comment(src_offset + self.bv.start, src_comment, hits)
+        if dst_comment is not None:
+            self.comment_manager.add_destination_comment(dst_offset + self.bv.start, dst_comment, hits)
+        # An intra-module edge has a source comment only if its source is a valid local branch
+        if self.xref_manager is not None and src_module == dst_module and src_comment is not None:
+            self.xref_manager.add_target(src_offset + self.bv.start, dst_offset + self.bv.start)
+
+    def analyze_edges(self, edges: Union[EdgeStore, EdgeCache]) -> None:
+        """Adds every edge of a store or cache with its hit count."""
+        for key, hits in edges.items():
+            self.add_edge(key, hits)
+
+    def annotate_changed(
+        self, edges: EdgeStore, changed: Optional[List[EdgeKey]], resolve_all: bool = False
+    ) -> None:
+        """Resolves only the edges sharing an address with ``changed`` (None if every edge
+        changed) and keeps only the comments of those addresses, so that unchanged comments
+        are not rewritten. With ``resolve_all`` every edge is resolved, so that all their
+        cross references are collected."""
+        if changed is None:
+            self.annotate_rows(edges, range(len(edges)))
+            return
+        touched: Set[int] = set()
+        for key in changed:
+            touched.update(self.get_edge_addresses(key))
+        if resolve_all:
+            rows: Sequence[int] = range(len(edges))
         else:
-            self.comment_manager.add_source_comment(
-                src_addr, f"<{after.module}>.{after.func}"
-            )
+            rows = array("Q", (
+                row for row in range(len(edges)) if not touched.isdisjoint(self.get_edge_addresses(edges.key(row)))
+            ))
+        self.annotate_rows(edges, rows, touched)
+
+    def annotate_rows(self, edges: EdgeStore, rows: Sequence[int], addresses: Optional[Set[int]] = None) -> None:
+        """Resolves the edges in ``rows`` straight from ``edges``, which must hold every edge
+        annotating ``addresses``, and keeps only the comments of those addresses (by default all)."""
+        self.prefetch_sites(
+            (edges.strings[edges.src_module[row]], edges.src_offset[row]) for row in rows
+            if edges.src_module[row] == edges.dst_module[row]
+        )
+        self.prefetch_function_names(edges.key(row) for row in rows)
+        for row in rows:
+            self.resolve_edge(edges.key(row), edges.hits[row])
+        if addresses is not None:
+            self.comment_manager.retain(addresses)
+
+    def get_edge_addresses(self, key: EdgeKey) -> Tuple[int, ...]:
+        """Returns the addresses in this BinaryView that an edge annotates."""
+        src_module, src_offset, dst_module, _, dst_offset, _ = key
+        addresses = []
+        if self._is_local(src_module):
+            addresses.append(src_offset + self.bv.start)
+        if dst_module == self.module or (src_module == dst_module and self._is_local(dst_module)):
+            addresses.append(dst_offset + self.bv.start)
+        return tuple(addresses)
+
+    def _resolve_edge(self, key: EdgeKey) -> EdgeComments:
+        src_module, src_offset, dst_module, dst_func, dst_offset, vtable_offset = key
+        src_addr = src_offset + self.bv.start
+        if src_module != dst_module:
+            src_addr_comment = f"<{dst_module}>.{dst_func}" if self._is_local(src_module) else None
+            # The caller lies in another module's view, so only its module and offset are known
+            dst_addr_comment = f"<{src_module}>+{hex(src_offset)}" if dst_module == self.module else None
+            return src_addr_comment, dst_addr_comment
+        if not self._is_local(src_module):
+            return None, None
 
-    def _analyze_internal_branch(self, before: BranchData, after: BranchData, src_addr: int) -> None:
         if not self._validate_instruction(src_addr):
-            return
+            return None, None
+
+        dst_addr = dst_offset + self.bv.start
+        src_addr_comment = self._create_address_comment_for_src(dst_addr)
+        if vtable_offset is not None:
+            src_addr_comment = self._add_vtable_info(vtable_offset + self.bv.start, src_addr_comment)
+        dst_addr_comment = self._create_address_comment_for_dst(src_addr)
+        return src_addr_comment, dst_addr_comment
+
+    def get_base_register(self, src_addr: int) -> Optional[str]:
+        """Returns the base register of the memory operand of the branch at ``src_addr``."""
+        return self.cache.base_register.get(src_addr, self._lookup_base_register)
 
-        dst_addr = after.get_reg_value_as_bv("rip", self.modules, self.bv)
-        self._add_branch_comments(before, src_addr, dst_addr)
+    def _lookup_base_register(self, addr: int) -> Optional[str]:
+        if (call_sites := self._get_call_sites()) is not None and (site := call_sites.lookup(addr)) is not None:
+            return self._get_call_site_base_register(site)
+        if not self._validate_instruction(addr):
+            return None
+        llil = self.instrumentation.call(
+            "get_instruction_low_level_il_instruction",
+            self.bv.arch.get_instruction_low_level_il_instruction, self.bv, addr,
+        )
+        if reg_and_imm := self.get_memory_disp(llil.operands[0].tokens):
+            return reg_and_imm[0]
+        return None
 
     def _validate_instruction(self, addr: int) -> bool:
-        instruction = self.bv.get_disassembly(addr)
+        return self._get_skip_reason(addr) is None
+
+    def _get_skip_reason(self, addr: int) -> Optional[SkipReason]:
+        """Returns why branches from ``addr`` cannot be annotated, or None if they can."""
+        return self.cache.instruction.get(addr, self._lookup_skip_reason)
+
+    @staticmethod
+    def _get_call_site_base_register(site: CallSite) -> Optional[str]:
+        kind, register = site
+        return register if kind == OperandKind.MEMORY else None
+
+    def _get_call_sites(self) -> Optional[CallSiteTable]:
+        if (
+            self.call_sites is None
+            and self.call_site_table_after is not None
+            and self.cache.instruction.misses >= self.call_site_table_after
+        ):
+            with self.instrumentation.stage("call_site_table"):
+                self.call_sites = CallSiteTable.from_binary_view(self.bv)
+            self.instrumentation.count("call_sites", len(self.call_sites))
+        return self.call_sites
+
+    def _lookup_skip_reason(self, addr: int) -> Optional[SkipReason]:
+        if (call_sites := self._get_call_sites()) is not None and call_sites.lookup(addr) is not None:
+            return None
+        # Sites outside the table, e.g. in code that is not part of a function, are disassembled
+        instruction = self.instrumentation.call("get_disassembly", self.bv.get_disassembly, addr)
         if instruction is None:
             print(f"Cannot get instruction @ {hex(addr)}", file=sys.stderr)
-            return False
+            return SkipReason.NO_DISASSEMBLY
         if not instruction.startswith(("call", "jmp")):
             print(f"{instruction} @ {hex(addr)} is not an indirect branch instruction", file=sys.stderr)
-            return False
-        return True
-
-    def _add_branch_comments(self, before: BranchData, src_addr: int, dst_addr: int) -> None:
-        # Add source comments
-        src_addr_comment = self._create_address_comment_for_src(dst_addr)
-        src_addr_comment = self._add_vtable_info(before, src_addr, src_addr_comment)
-        self.comment_manager.add_source_comment(src_addr, src_addr_comment)
-
-        # Add destination comments
-        dst_addr_comment = self._create_address_comment_for_dst(src_addr)
-        self.comment_manager.add_destination_comment(dst_addr, dst_addr_comment)
+            return SkipReason.NOT_BRANCH
+        return None
 
     def _create_address_comment_for_src(self, addr: int) -> str:
         comment = hex(addr)
@@ -148,41 +1707,1787 @@ class BranchAnalyzer:
             comment += f"({func_name})"
         return comment
 
-    def _add_vtable_info(self, before: BranchData, src_addr: int, comment: str) -> str:
-        llil = self.bv.arch.get_instruction_low_level_il_instruction(self.bv, src_addr)
-        reg_and_imm = self.get_memory_disp(llil.operands[0].tokens)
-        if reg_and_imm and reg_and_imm[0] in before.registers.keys():
-            reg_value = before.get_reg_value_as_bv(reg_and_imm[0], self.modules, self.bv)
-            if (symbol := self.bv.get_symbol_at(reg_value)) is not None:
-                comment += f" (vt:{hex(reg_value)}({symbol.name}))"
+    def get_site_vtables(self, site: CallSiteKey, count: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Returns the vtables seen at a call site of the polymorphism index, most frequent
+        first, named by their symbol when the BinaryView has one."""
+        module, _ = site
+        vtables = []
+        for vtable_offset, hits in self.polymorphism.vtables_of(site, count):
+            vtable_addr = vtable_offset + self.bv.start
+            symbol_name = self.get_symbol_name_at(vtable_addr) if self._is_local(module) else None
+            vtables.append((symbol_name or hex(vtable_addr), hits))
+        return vtables
+
+    def _add_vtable_info(self, vtable_addr: int, comment: str) -> str:
+        if (symbol_name := self.get_symbol_name_at(vtable_addr)) is not None:
+            comment += f" (vt:{hex(vtable_addr)}({symbol_name}))"
         return comment
 
 
-def load(bv: binaryninja.BinaryView) -> None:
+class MultiModuleAnalyzer:
+    """One BranchAnalyzer per module BinaryView. While a trace is collected, the lookups of
+    each call site are routed to the analyzer of the site's module."""
+
+    def __init__(
+        self,
+        views: Dict[str, binaryninja.BinaryView],
+        modules: Dict[str, int],
+        instrumentation: Optional[Instrumentation] = None,
+        call_site_table_after: Optional[int] = None,
+    ):
+        self.modules = modules
+        self.module_index = ModuleIndex(modules)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.analyzers = {
+            name: BranchAnalyzer(
+                view,
+                modules,
+                instrumentation=Instrumentation(),
+                call_site_table_after=call_site_table_after,
+                module=name,
+            )
+            for name, view in views.items()
+        }
+
+    def get_edge_key(self, branch: Dict) -> EdgeKey:
+        return make_edge_key(branch, self.module_index, self.get_site_base_register)
+
+    def get_site_base_register(self, src_module: str, src_offset: int) -> Optional[str]:
+        if (analyzer := self.analyzers.get(src_module)) is None:
+            return None
+        return analyzer.get_site_base_register(src_module, src_offset)
+
+    def prefetch_sites(self, sites: Iterable[CallSiteKey]) -> None:
+        sites_by_module: DefaultDict[str, List[CallSiteKey]] = defaultdict(list)
+        for site in sites:
+            sites_by_module[site[0]].append(site)
+        for module, module_sites in sites_by_module.items():
+            if (analyzer := self.analyzers.get(module)) is not None:
+                analyzer.prefetch_sites(module_sites)
+
+    def partition(self, edges: Union[EdgeStore, EdgeCache]) -> Dict[str, EdgeStore]:
+        """Splits the edges into the edges each module's view annotates: its intra-module
+        edges and the cross-module edges from or to it."""
+        partitions = {name: EdgeStore() for name in self.analyzers}
+        for key, hits in edges.items():
+            src_module, _, dst_module, _, _, _ = key
+            if (partition := partitions.get(src_module)) is not None:
+                partition.add(key, hits)
+            if dst_module != src_module and (partition := partitions.get(dst_module)) is not None:
+                partition.add(key, hits)
+        return partitions
+
+
+class AnnotationQuery:
+    """Renders the ``BML_src``/``BML_dst`` lines of an address or a function on demand from
+    the edges stored in a BinaryView's metadata, so that comments only have to be written
+    at the addresses an analyst asks for.
+
+    Edges are resolved against the BinaryView the first time an address needs them, and
+    the rendered lines of recently queried addresses are kept in an LRU cache.
+    """
+
+    DEFAULT_CACHE_SIZE = 4096
+    # The query of every open BinaryView queried or loaded lazily in this session
+    _views: "weakref.WeakKeyDictionary[binaryninja.BinaryView, AnnotationQuery]" = weakref.WeakKeyDictionary()
+
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        edges: EdgeStore,
+        module: Optional[str] = None,
+        cache_size: Optional[int] = DEFAULT_CACHE_SIZE,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        # Held weakly, so that the query kept in _views does not keep a closed view alive
+        self._view = weakref.ref(bv)
+        self.bv = weakref.proxy(bv)
+        self.edges = edges
+        # Stored edges are already module-relative, so resolving them needs no module bases
+        self.analyzer = BranchAnalyzer(self.bv, {}, instrumentation=instrumentation, module=module)
+        # Rows of the edges annotating each address
+        self._rows: DefaultDict[int, List[int]] = defaultdict(list)
+        for row in range(len(edges)):
+            for addr in self.analyzer.get_edge_addresses(edges.key(row)):
+                self._rows[addr].append(row)
+        self.addresses = sorted(self._rows)
+        self.rendered = AddressCache(cache_size, EvictionPolicy.LRU)
+
+    @classmethod
+    def for_view(cls, bv: binaryninja.BinaryView) -> "AnnotationQuery":
+        """Returns the query of a BinaryView, loading its stored edges on first use."""
+        if (query := cls._views.get(bv)) is None:
+            query = cls._views[bv] = cls(bv, AnalysisMetadata.load(bv), AnalysisMetadata.load_module(bv))
+        return query
+
+    @classmethod
+    def register(cls, query: "AnnotationQuery") -> None:
+        if (bv := query._view()) is not None:
+            cls._views[bv] = query
+
+    @classmethod
+    def forget(cls, bv: binaryninja.BinaryView) -> None:
+        """Drops the query of a BinaryView whose stored edges changed."""
+        cls._views.pop(bv, None)
+
+    def annotations_at(self, addr: int) -> Optional[str]:
+        """Returns the comment lines of ``addr``, or None if no edge annotates it."""
+        return self.rendered.get(addr, self._render)
+
+    def addresses_in(self, start: int, end: int) -> List[int]:
+        """Returns the annotated addresses in [start, end)."""
+        return self.addresses[bisect.bisect_left(self.addresses, start):bisect.bisect_left(self.addresses, end)]
+
+    def addresses_in_function(self, func: binaryninja.Function) -> List[int]:
+        return [
+            addr for address_range in func.address_ranges
+            for addr in self.addresses_in(address_range.start, address_range.end)
+        ]
+
+    def annotations_in_function(self, func: binaryninja.Function) -> Dict[int, str]:
+        annotations = {}
+        for addr in self.addresses_in_function(func):
+            if (text := self.annotations_at(addr)) is not None:
+                annotations[addr] = text
+        return annotations
+
+    def materialize(self, addresses: Iterable[int], should_cancel: Optional[Callable[[], bool]] = None) -> int:
+        """Writes the comments of ``addresses`` as one undo action and returns how many were written."""
+        return self._collect(addresses).set_comments(bulk=True, should_cancel=should_cancel)
+
+    def _collect(self, addresses: Iterable[int]) -> CommentManager:
+        analyzer = self.analyzer
+        analyzer.comment_manager = CommentManager(self.bv, analyzer.instrumentation)
+        addresses = set(addresses)
+        rows = sorted({row for addr in addresses for row in self._rows.get(addr, ())})
+        analyzer.annotate_rows(self.edges, rows, addresses)
+        return analyzer.comment_manager
+
+    def _render(self, addr: int) -> Optional[str]:
+        lines = self._collect([addr]).render_lines(addr)
+        return "\n".join(lines) if lines else None
+
+
+class TraceScanner:
+    """Iterates the branch records that start within a byte range of a trace.
+
+    ``offset`` is the byte offset at which the records not yet yielded start, so a scan
+    that is stopped early can later be resumed from there.
+    """
+
+    DEFAULT_CHUNK_SIZE = 4 << 20
+
+    def __init__(self, path: str, start: int = 0, end: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.end = self.size if end is None else min(end, self.size)
+        self.chunk_size = chunk_size
+        # Current chunk text, the byte offset it starts at and the position of the next record
+        self._text = ""
+        self._base = start
+        self._pos = 0
+        self._ascii = True
+
+    @property
+    def offset(self) -> int:
+        if self._ascii:
+            return self._base + self._pos
+        return self._base + len(self._text[:self._pos].encode("utf-8"))
+
+    def __iter__(self) -> Iterator[Dict]:
+        decoder = json.JSONDecoder()
+        chunk_start = self.offset
+        while chunk_start < self.end:
+            chunk_end = min(chunk_start + self.chunk_size, self.end)
+            text, base = read_shard(self.path, chunk_start, chunk_end)
+            self._text, self._base, self._pos, self._ascii = text, base, 0, text.isascii()
+            match = RECORD_START_TEXT.search(text)
+            while match is not None:
+                branch, record_end = decoder.raw_decode(text, match.start())
+                match = RECORD_START_TEXT.search(text, record_end)
+                self._pos = match.start() if match is not None else len(text)
+                yield branch
+            chunk_start = chunk_end
+        # Only the closing brackets of the trace can follow the last record
+        self._text, self._base, self._pos, self._ascii = "", self.end, 0, True
+
+
+def _add_pending_edges(
+    analyzer: Union[BranchAnalyzer, MultiModuleAnalyzer],
+    add_edge: Callable[[EdgeKey, int], Any],
+    pending: Dict[PendingEdge, int],
+    base_registers: Dict[CallSiteKey, Optional[str]],
+) -> None:
+    """Resolves the base registers of new call sites, adding them to ``base_registers``,
+    and adds the pending edges with their vtables."""
+    analyzer.prefetch_sites(
+        (src_module, src_offset) for (src_module, src_offset, *_), _ in pending.items()
+        if (src_module, src_offset) not in base_registers
+    )
+    for (src_module, src_offset, dst_module, dst_func, dst_offset, candidates), hits in pending.items():
+        site = (src_module, src_offset)
+        if site not in base_registers:
+            base_registers[site] = analyzer.get_site_base_register(src_module, src_offset)
+        registers = dict(candidates)
+        vtable_offset = None
+        if (base_reg := base_registers[site]) in registers:
+            vtable_offset = analyzer.module_index.offset_in(src_module, registers[base_reg])
+        add_edge((src_module, src_offset, dst_module, dst_func, dst_offset, vtable_offset), hits)
+
+
+class ParallelTraceDecoder:
+    """Decodes and rebases branch records in a pool of worker processes.
+
+    The trace file is split into byte ranges that workers decode into deduplicated,
+    module-relative edge keys with hit counts, so only the BinaryView lookups run in
+    the calling thread. Workers can only resolve the vtable of call sites whose base
+    register they are given; records of new call sites come back with their register
+    values and are resolved here, and every shard submitted afterwards carries the
+    base registers learned so far.
+    """
+
+    DEFAULT_SHARD_SIZE = 32 << 20
+
+    def __init__(
+        self,
+        trace_path: str,
+        modules: Dict[str, int],
+        workers: Optional[int] = None,
+        shard_size: int = DEFAULT_SHARD_SIZE,
+        start: int = 0,
+    ):
+        self.trace_path = trace_path
+        self.modules = modules
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.size = os.path.getsize(trace_path)
+        # Byte offset of the first record to decode, e.g. where a preview stopped
+        self.start = start
+
+    def shards(self) -> List[Tuple[int, int]]:
+        return [
+            (start, min(start + self.shard_size, self.size))
+            for start in range(self.start, self.size, self.shard_size)
+        ]
+
+    def run(
+        self,
+        analyzer: Union[BranchAnalyzer, MultiModuleAnalyzer],
+        progress: Optional[Callable[[int, float], None]] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+        edges: Optional[EdgeStore] = None,
+    ) -> int:
+        """Feeds every record of the trace into ``analyzer``, or only collects the edges into
+        ``edges`` if given, and returns the number of records."""
+        add_edge = edges.add if edges is not None else analyzer.add_edge
+        base_registers: Dict[CallSiteKey, Optional[str]] = {}
+        shards = deque(self.shards())
+        in_flight = deque()
+        records = 0
+        bytes_done = 0
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            def submit_shards() -> None:
+                while shards and len(in_flight) < 2 * self.workers:
+                    start, end = shards.popleft()
+                    future = pool.submit(
+                        decode_shard, self.trace_path, start, end, self.modules, dict(base_registers)
+                    )
+                    in_flight.append((future, end - start))
+
+            submit_shards()
+            while in_flight:
+                future, shard_size = in_flight.popleft()
+                shard_edges, pending, shard_records, unknown_module = future.result()
+                analyzer.instrumentation.skip(SkipReason.UNKNOWN_MODULE, unknown_module)
+                for key, hits in shard_edges.items():
+                    add_edge(key, hits)
+                _add_pending_edges(analyzer, add_edge, pending, base_registers)
+
+                records += shard_records
+                bytes_done += shard_size
+                if should_cancel is not None and should_cancel():
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise OperationCancelled()
+                if progress is not None:
+                    progress(records, (self.start + bytes_done) / self.size if self.size else 1.0)
+                submit_shards()
+        return records
+
+
+LiveAddress = Union[Tuple[str, int], str]
+
+
+class LiveTraceServer:
+    """Accepts newline-delimited branch records on a localhost TCP port or a Unix socket.
+
+    Every connection is read in its own thread, and the complete lines of each chunk
+    received are put on a bounded queue. When the queue is full the reader stops
+    receiving, so the socket buffers fill and the sender is slowed down instead of
+    records being dropped.
+    """
+
+    RECV_SIZE = 1 << 18
+    # Seconds between checks of whether the server was stopped
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, address: LiveAddress, queue_size: int = 256):
+        self.queue: "queue.Queue[bytes]" = queue.Queue(queue_size)
+        self.connections = 0
+        self._stopped = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._unix_path = address if isinstance(address, str) else None
+        if self._unix_path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(address)
+        self._socket.listen()
+        self._socket.settimeout(self.POLL_INTERVAL)
+        self.address: LiveAddress = self._socket.getsockname()
+
+    def __str__(self) -> str:
+        if self._unix_path is not None:
+            return self._unix_path
+        host, port = self.address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> None:
+        self._start_thread(self._accept_connections)
+
+    def stop(self) -> None:
+        """Stops accepting and reading; lines already queued stay on the queue."""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._socket.close()
+        if self._unix_path is not None:
+            try:
+                os.unlink(self._unix_path)
+            except OSError:
+                pass
+
+    def _start_thread(self, target: Callable, *args) -> None:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _accept_connections(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.connections += 1
+            self._start_thread(self._read_connection, conn)
+
+    def _read_connection(self, conn: socket.socket) -> None:
+        conn.settimeout(self.POLL_INTERVAL)
+        partial_line = b""
+        with conn:
+            while not self._stopped.is_set():
+                try:
+                    data = conn.recv(self.RECV_SIZE)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                if not data:
+                    break
+                data = partial_line + data
+                line_end = data.rfind(b"\n") + 1
+                partial_line = data[line_end:]
+                if line_end:
+                    self._put(data[:line_end])
+        if partial_line.strip():
+            self._put(partial_line + b"\n")
+
+    def _put(self, lines: bytes) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(lines, timeout=self.POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+
+@dataclass
+class PreviewOptions:
+    """Limits of a preview run, which stops at the first limit reached and annotates the
+    edges collected so far."""
+
+    max_records: Optional[int] = None
+    max_bytes: Optional[int] = None
+    time_budget: Optional[float] = None
+    # Stop once this many consecutive records added no new unique edge
+    stable_records: Optional[int] = 100000
+    # Scan this many windows of sample_bytes spread over the whole trace instead of one
+    # window from where the last preview stopped. A sampled preview is not resumable.
+    samples: Optional[int] = None
+    sample_bytes: int = 1 << 20
+
+
+# Seconds the "preview" command spends on each window of the trace
+PREVIEW_TIME_BUDGET = 10.0
+
+
+def _spread_order(count: int) -> List[int]:
+    """Returns 0..count-1 in bit-reversed order, so that every prefix is spread over the range."""
+    bits = max((count - 1).bit_length(), 1)
+    return sorted(range(count), key=lambda index: int(format(index, f"0{bits}b")[::-1], 2))
+
+
+class TraceAnnotator:
+    """Loads a branch trace (or its edge cache) and annotates one BinaryView with it."""
+
+    PROGRESS_INTERVAL = 10000
+    STATS_SUFFIX = ".stats.json"
+    # Walking every function costs more than the lookups it saves on small updates
+    FUNCTION_INDEX_MIN_EDGES = 1000
+    CALL_SITE_TABLE_MIN_SITES = 1000
+
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        trace_path: str,
+        workers: int = 1,
+        use_cache: bool = True,
+        progress: Optional[Callable[[str], None]] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        stats_path: Optional[str] = None,
+        apply_xrefs: bool = False,
+        preview: Optional[PreviewOptions] = None,
+        lazy: bool = False,
+    ):
+        self.bv = bv
+        self.trace_path = trace_path
+        self.workers = workers
+        self.use_cache = use_cache
+        self.progress = progress or (lambda text: None)
+        self.should_cancel = should_cancel or (lambda: False)
+        self.instrumentation = instrumentation or Instrumentation()
+        # Where the run summary is written; None only logs it
+        self.stats_path = stats_path
+        self.summary: Dict[str, Any] = {}
+        self.cache_stats: Dict[str, Dict[str, int]] = {}
+        # Also register the resolved intra-module targets as cross references
+        self.apply_xrefs = apply_xrefs
+        self.preview = preview
+        # Only store the edges and leave rendering them to AnnotationQuery
+        self.lazy = lazy
+        # How the trace was scanned: from where, up to where and why it stopped
+        self.scan: Dict[str, Any] = {}
+        self._polymorphism: Optional[PolymorphismIndex] = None
+        # Identifies the trace among those merged into the view before, if known
+        self.trace_digest: Optional[bytes] = None
+        # Preview checkpoint updates, written with the metadata once annotating succeeded
+        self._checkpoint_writes: List[Callable[[], None]] = []
+
+    def run(self) -> int:
+        """Annotates the BinaryView and returns the number of addresses whose comment changed.
+
+        The run summary is logged, written to ``stats_path`` and kept in ``summary`` even
+        if the run fails or is cancelled.
+        """
+        start_time = time.perf_counter()
+        status = "failed"
+        try:
+            with self.instrumentation.profiling():
+                count = self._run()
+            status = "ok"
+            return count
+        except OperationCancelled:
+            status = "cancelled"
+            raise
+        finally:
+            self.summary = self.instrumentation.report(
+                self.stats_path,
+                trace=self.trace_path,
+                status=status,
+                seconds=round(time.perf_counter() - start_time, 6),
+                **self._summary_details(),
+            )
+
+    @property
+    def polymorphism(self) -> Optional[PolymorphismIndex]:
+        """The call sites of every edge stored in the view, including earlier loads. It is
+        built from the metadata on first use, so that loads do not pay for it."""
+        if self._polymorphism is None and self.bv is not None:
+            self._polymorphism = PolymorphismIndex.from_edges(AnalysisMetadata.load(self.bv))
+        return self._polymorphism
+
+    def _summary_details(self) -> Dict[str, Any]:
+        return {"cache": self.cache_stats, "scan": self.scan}
+
+    def _run(self) -> int:
+        # A cached trace is annotated in full even in a preview, since that costs less than a preview
+        if self.trace_path.endswith(EdgeCache.SUFFIX):
+            with EdgeCache(self.trace_path) as cache:
+                self.trace_digest = cache.source_digest
+                return self._annotate(self._create_analyzer(cache.modules), cache)
+        elif self.use_cache and (cache := EdgeCache.open_for_trace(self.trace_path)) is not None:
+            with cache:
+                self.instrumentation.count("cache_hits")
+                self.trace_digest = cache.source_digest
+                return self._annotate(self._create_analyzer(cache.modules), cache)
+        analyzer, edges = self._collect_trace()
+        # The edges of an unfinished preview are kept for its checkpoint
+        return self._annotate(analyzer, edges, owned=self.preview is None)
+
+    def _create_analyzer(self, modules: Dict[str, int]) -> BranchAnalyzer:
+        return BranchAnalyzer(
+            self.bv,
+            modules,
+            instrumentation=self.instrumentation,
+            call_site_table_after=self.CALL_SITE_TABLE_MIN_SITES,
+        )
+
+    def _collect_trace(self) -> Tuple[Union[BranchAnalyzer, MultiModuleAnalyzer], EdgeStore]:
+        reader = TraceReader(self.trace_path)
+        modules = reader.read_modules()
+        analyzer = self._create_analyzer(modules)
+        edges = EdgeStore()
+        instrumentation = self.instrumentation
+        start_offset = previous_records = 0
+        # Only a single view keeps a preview checkpoint
+        sampled = self.preview is not None and self.preview.samples is not None
+        if self.bv is not None and not sampled:
+            checkpoint = PreviewCheckpoint.load(self.bv, self.trace_path)
+            if checkpoint is not None:
+                start_offset, previous_records, edges = checkpoint
+                self.progress(f"Binja Missing Link: resuming the preview at byte {start_offset:,}")
+        self.scan = {"start": start_offset}
+
+        with instrumentation.stage("collect"):
+            if self.preview is not None:
+                records, offset = self._collect_preview(analyzer, edges, modules, start_offset)
+            elif self.workers > 1:
+                start_time = time.perf_counter()
+                records = ParallelTraceDecoder(self.trace_path, modules, self.workers, start=start_offset).run(
+                    analyzer,
+                    progress=lambda count, file_progress: self._report_progress(count, start_time, file_progress),
+                    should_cancel=self.should_cancel,
+                    edges=edges,
+                )
+                offset = reader.size
+            elif start_offset:
+                scanner = TraceScanner(self.trace_path, start_offset)
+                records, _ = self._collect_records(
+                    analyzer, edges, modules, scanner, lambda: scanner.offset / scanner.size
+                )
+                offset = reader.size
+            else:
+                records, _ = self._collect_records(
+                    analyzer, edges, modules, reader.iter_branches(), lambda: reader.progress
+                )
+                offset = reader.size
+        records += previous_records
+        instrumentation.count("records", records)
+        complete = offset >= reader.size and not sampled
+        self.scan.update(end=offset, complete=complete)
+
+        # A run cancelled before its comments are written must leave the checkpoint as it was
+        if self.bv is not None and self.preview is not None and not sampled:
+            if complete:
+                self._checkpoint_writes.append(partial(PreviewCheckpoint.clear, self.bv))
+            else:
+                self._checkpoint_writes.append(partial(
+                    PreviewCheckpoint.store, self.bv, self.trace_path, offset, records, modules, edges
+                ))
+        elif self.bv is not None and start_offset:
+            self._checkpoint_writes.append(partial(PreviewCheckpoint.clear, self.bv))
+
+        if complete and self.use_cache and not self.should_cancel():
+            with instrumentation.stage("write_cache"):
+                try:
+                    self.trace_digest = EdgeCache.digest(self.trace_path)
+                    EdgeCache.write(
+                        EdgeCache.path_for(self.trace_path), modules, edges, self.trace_path, self.trace_digest
+                    )
+                except OSError as e:
+                    print(f"Cannot write edge cache for {self.trace_path}: {e}", file=sys.stderr)
+        return analyzer, edges
+
+    def _collect_preview(
+        self, analyzer: Union[BranchAnalyzer, MultiModuleAnalyzer], edges: EdgeStore, modules: Dict[str, int],
+        start_offset: int,
+    ) -> Tuple[int, int]:
+        """Collects the edges of a window from ``start_offset`` or of sampled windows until
+        a preview limit is reached, and returns the number of records and the offset at
+        which the window stopped."""
+        preview = self.preview
+        size = os.path.getsize(self.trace_path)
+        if preview.samples is None:
+            end = start_offset + preview.max_bytes if preview.max_bytes is not None else None
+            scanner = TraceScanner(self.trace_path, start_offset, end)
+            records, self.scan["stopped"] = self._collect_records(
+                analyzer, edges, modules, scanner, lambda: scanner.offset / scanner.size, preview
+            )
+            return records, scanner.offset
+
+        stride = size / preview.samples
+        window = min(preview.sample_bytes, max(int(stride), 1))
+        starts = [int(index * stride) for index in _spread_order(preview.samples)]
+        windows_scanned = 0
+
+        def iter_windows() -> Iterator[Dict]:
+            nonlocal windows_scanned
+            for window_start in starts:
+                yield from TraceScanner(self.trace_path, window_start, window_start + window)
+                windows_scanned += 1
+
+        records, self.scan["stopped"] = self._collect_records(
+            analyzer, edges, modules, iter_windows(), lambda: windows_scanned / len(starts), preview
+        )
+        self.scan["windows"] = windows_scanned
+        return records, size
+
+    def _collect_records(
+        self,
+        analyzer: Union[BranchAnalyzer, MultiModuleAnalyzer],
+        edges: EdgeStore,
+        modules: Dict[str, int],
+        branches: Iterable[Dict],
+        file_progress: Callable[[], float],
+        limits: Optional[PreviewOptions] = None,
+    ) -> Tuple[int, Optional[str]]:
+        """Adds the edge of every record to ``edges``. Returns the number of records and,
+        if a preview limit stopped the collection early, the name of that limit."""
+        instrumentation = self.instrumentation
+        start_time = time.perf_counter()
+        max_records = stable_records = deadline = None
+        if limits is not None:
+            max_records, stable_records = limits.max_records, limits.stable_records
+            if limits.time_budget is not None:
+                deadline = start_time + limits.time_budget
+        records = unchanged = 0
+        # "collect.parse" is the part of "collect" spent reading and decoding JSON
+        for records, branch in enumerate(instrumentation.timed_iter("collect.parse", branches), 1):
+            if branch["before"]["module"] not in modules:
+                instrumentation.skip(SkipReason.UNKNOWN_MODULE)
+            else:
+                _, is_new = edges.add(analyzer.get_edge_key(branch))
+                unchanged = 0 if is_new else unchanged + 1
+            if max_records is not None and records >= max_records:
+                return records, "max_records"
+            if stable_records is not None and unchanged >= stable_records:
+                return records, "stable"
+            if records % self.PROGRESS_INTERVAL == 0:
+                if self.should_cancel():
+                    raise OperationCancelled()
+                self._report_progress(records, start_time, file_progress())
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return records, "time_budget"
+        return records, None
+
+    def _annotate(
+        self, analyzer: BranchAnalyzer, trace_edges: Union[EdgeStore, EdgeCache], owned: bool = False
+    ) -> int:
+        count = self._annotate_view(analyzer, trace_edges, owned)
+        self.cache_stats = analyzer.cache.stats()
+        return count
+
+    def _annotate_view(
+        self, analyzer: BranchAnalyzer, trace_edges: Union[EdgeStore, EdgeCache], owned: bool = False
+    ) -> int:
+        """Merges the edges into the view's metadata and rewrites the comments that changed.
+        An ``owned`` store of the trace's edges is consumed by the merge."""
+        if self.should_cancel():
+            raise OperationCancelled()
+        bv = analyzer.bv
+        instrumentation = analyzer.instrumentation
+        instrumentation.count("unique_edges", len(trace_edges))
+        self.progress(f"Binja Missing Link: annotating {len(trace_edges):,} edges")
+        with instrumentation.stage("merge"):
+            edges, traces, changed = self._merge_stored(analyzer, trace_edges, owned)
+            if owned and trace_edges is not edges:
+                trace_edges.clear()
+            del trace_edges
+            state = AnalysisMetadata.load_state(bv)
+            if not self.lazy and not state["comments"]:
+                # An earlier lazy load stored edges whose comments were never written
+                changed = None
+            # Earlier loads without cross references leave the targets of unchanged edges unregistered
+            resolve_all = self.apply_xrefs and not state["xrefs"]
+            changed_count = len(edges) if changed is None else len(changed)
+            state["comments"] = not self.lazy or (state["comments"] and not changed_count)
+            state["xrefs"] = self.apply_xrefs or (state["xrefs"] and not changed_count)
+        instrumentation.count("changed_edges", changed_count)
+        if (len(edges) if resolve_all else changed_count) >= self.FUNCTION_INDEX_MIN_EDGES:
+            with instrumentation.stage("function_index"):
+                analyzer.function_index = FunctionIndex.from_binary_view(bv)
+            instrumentation.count("indexed_function_ranges", len(analyzer.function_index))
+        if self.apply_xrefs:
+            analyzer.xref_manager = XrefManager(bv, instrumentation)
+        if self.lazy and analyzer.xref_manager is None:
+            count = 0
+        else:
+            with instrumentation.stage("resolve"):
+                analyzer.annotate_changed(edges, changed, resolve_all)
+            if self.lazy:
+                # Cross references need every target resolved, but no comment is written
+                analyzer.comment_manager.retain(set())
+            if analyzer.xref_manager is None:
+                with instrumentation.stage("set_comments"):
+                    count = analyzer.comment_manager.set_comments(bulk=True, should_cancel=self.should_cancel)
+            else:
+                # Comments and cross references share one undo action and one analysis update
+                with bulk_analysis_update(bv):
+                    with instrumentation.stage("set_comments"):
+                        count = analyzer.comment_manager.set_comments(should_cancel=self.should_cancel)
+                    with instrumentation.stage("apply_xrefs"):
+                        analyzer.xref_manager.apply(self.should_cancel)
+        instrumentation.count("annotated_addresses", count)
+        with instrumentation.stage("store_metadata"):
+            AnalysisMetadata.store(bv, analyzer.modules, edges, analyzer.module, traces, state)
+            for write_checkpoint in self._checkpoint_writes:
+                write_checkpoint()
+            self._checkpoint_writes.clear()
+        if self.lazy:
+            with instrumentation.stage("query_index"):
+                query = AnnotationQuery(bv, edges, analyzer.module, instrumentation=instrumentation)
+            AnnotationQuery.register(query)
+            instrumentation.count("queryable_addresses", len(query.addresses))
+        else:
+            AnnotationQuery.forget(bv)
+        return count
+
+    def _merge_stored(
+        self, analyzer: BranchAnalyzer, trace_edges: Union[EdgeStore, EdgeCache], owned: bool = False
+    ) -> Tuple[EdgeStore, List[Dict[str, Optional[str]]], Optional[List[EdgeKey]]]:
+        """Returns the edges and traces to store in the view and the keys whose comments
+        changed, or None if all did."""
+        edges = AnalysisMetadata.load(analyzer.bv)
+        traces = AnalysisMetadata.load_traces(analyzer.bv)
+        # Another trace adds its hits; the same or an extended one keeps the higher count
+        new_trace = AnalysisMetadata.record_trace(traces, self.trace_path, self.trace_digest)
+        if not len(edges) and owned and isinstance(trace_edges, EdgeStore):
+            # Nothing is stored yet, so the trace's edges are stored as they are instead of copied
+            return trace_edges, traces, None
+        return edges, traces, AnalysisMetadata.merge(edges, trace_edges, accumulate=new_trace)
+
+    def _report_progress(self, count: int, start_time: float, file_progress: float) -> None:
+        rate = count / max(time.perf_counter() - start_time, 1e-9)
+        self.progress(f"Binja Missing Link: {count:,} records ({rate:,.0f} records/s, {file_progress:.1%} of file)")
+
+
+class MultiModuleAnnotator(TraceAnnotator):
+    """Loads one trace and annotates the BinaryView of every listed module with it, so a
+    trace spanning many libraries is parsed once instead of once per library.
+
+    The edges are partitioned by module once and every view is annotated in its own thread.
+    Besides its intra-module edges, a view gets the source comment of its outgoing
+    cross-module edges and a destination comment for its incoming ones.
+    """
+
+    def __init__(
+        self,
+        views: Dict[str, binaryninja.BinaryView],
+        trace_path: str,
+        workers: int = 1,
+        use_cache: bool = True,
+        progress: Optional[Callable[[str], None]] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        stats_path: Optional[str] = None,
+        threads: Optional[int] = None,
+        apply_xrefs: bool = False,
+        preview: Optional[PreviewOptions] = None,
+        lazy: bool = False,
+    ):
+        # There is no single BinaryView; every view is reached through its module's analyzer.
+        # Without one to keep a checkpoint in, a windowed preview always starts from the beginning.
+        super().__init__(
+            None, trace_path, workers, use_cache, progress, should_cancel, instrumentation, stats_path, apply_xrefs,
+            preview, lazy,
+        )
+        self.views = views
+        self.threads = threads or min(len(views), os.cpu_count() or 1) or 1
+        # Number of annotated addresses per module
+        self.module_counts: Dict[str, int] = {}
+        self._analyzer: Optional[MultiModuleAnalyzer] = None
+
+    def _create_analyzer(self, modules: Dict[str, int]) -> MultiModuleAnalyzer:
+        for name in self.views:
+            if name not in modules:
+                print(f"Module {name} is not in the trace; its BinaryView is not annotated", file=sys.stderr)
+        self._analyzer = MultiModuleAnalyzer(
+            {name: view for name, view in self.views.items() if name in modules},
+            modules,
+            self.instrumentation,
+            self.CALL_SITE_TABLE_MIN_SITES,
+        )
+        return self._analyzer
+
+    def _annotate(
+        self, analyzer: MultiModuleAnalyzer, trace_edges: Union[EdgeStore, EdgeCache], owned: bool = False
+    ) -> int:
+        if self.should_cancel():
+            raise OperationCancelled()
+        self.instrumentation.count("unique_edges", len(trace_edges))
+        with self.instrumentation.stage("partition"):
+            partitions = analyzer.partition(trace_edges)
+        if owned:
+            trace_edges.clear()
+        with self.instrumentation.stage("annotate"), ThreadPoolExecutor(max_workers=self.threads) as pool:
+            futures = {
+                name: pool.submit(self._annotate_view, analyzer.analyzers[name], edges, True)
+                for name, edges in partitions.items()
+            }
+            self.module_counts = {name: future.result() for name, future in futures.items()}
+        return sum(self.module_counts.values())
+
+    @property
+    def module_polymorphism(self) -> Dict[str, PolymorphismIndex]:
+        """The polymorphism index of every annotated module, built on first use."""
+        if self._analyzer is None:
+            return {}
+        for analyzer in self._analyzer.analyzers.values():
+            if analyzer.polymorphism is None:
+                analyzer.polymorphism = PolymorphismIndex.from_edges(AnalysisMetadata.load(analyzer.bv))
+        return {name: analyzer.polymorphism for name, analyzer in self._analyzer.analyzers.items()}
+
+    def _summary_details(self) -> Dict[str, Any]:
+        if self._analyzer is None:
+            return {}
+        return {
+            "modules": {
+                name: analyzer.instrumentation.summary(
+                    annotated=self.module_counts.get(name),
+                    cache=analyzer.cache.stats(),
+                )
+                for name, analyzer in self._analyzer.analyzers.items()
+            }
+        }
+
+
+class LiveTraceAnnotator(TraceAnnotator):
+    """Annotates a BinaryView with branch records streamed over a LiveTraceServer while the
+    traced program runs.
+
+    Received lines are decoded into edges as they arrive, in ``workers`` processes if
+    more than one. Every ``flush_interval`` seconds the comments of the addresses that got
+    a new edge are rewritten, outside the undo history and without an analysis update.
+    Rewriting every address whose hit counts grew costs as much as all active edges, so hit
+    counts are only refreshed every ``REFRESH_INTERVAL`` seconds. The metadata is stored every ``STORE_INTERVAL`` seconds
+    and when the run ends. Cancelling stops the server and flushes the records received
+    so far.
+
+    A ``{"modules": [...]}`` line declares the module table; it can also be passed as
+    ``modules``. Records of modules not declared yet are skipped.
+    """
+
+    DEFAULT_ADDRESS = ("127.0.0.1", 5678)
+    DEFAULT_FLUSH_INTERVAL = 1.0
+    REFRESH_INTERVAL = 10.0
+    STORE_INTERVAL = 30.0
+    # Queued chunks are joined up to this size before they are decoded
+    BATCH_BYTES = 1 << 20
+
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        address: LiveAddress = DEFAULT_ADDRESS,
+        modules: Optional[Dict[str, int]] = None,
+        workers: int = 1,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        queue_size: int = 256,
+        progress: Optional[Callable[[str], None]] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        stats_path: Optional[str] = None,
+    ):
+        self.server = LiveTraceServer(address, queue_size)
+        super().__init__(
+            bv, f"live:{self.server}", workers, False, progress, should_cancel, instrumentation, stats_path
+        )
+        self.modules = dict(modules or {})
+        self.flush_interval = flush_interval
+        self.records = 0
+        self.malformed_records = 0
+        self.flushes = 0
+        self._stopped = threading.Event()
+        # Hits of this session, the rows hit since the last refresh and the rows added
+        # since the last flush
+        self._session = EdgeStore()
+        self._touched: Set[int] = set()
+        self._new_rows: Set[int] = set()
+        # Hits of each session row already added to the view's edges
+        self._merged_hits = array("Q")
+        # Rows of the view's edges annotating each address
+        self._rows: DefaultDict[int, List[int]] = defaultdict(list)
+        # Base registers of the call sites seen so far. With workers, they are also appended
+        # to a log of which each batch only carries the entries some worker has not seen
+        self._base_registers: Dict[CallSiteKey, Optional[str]] = {}
+        self._base_register_log: List[Tuple[CallSiteKey, Optional[str]]] = []
+        # Number of log entries each worker process covers, by process id
+        self._worker_log_sizes: Dict[int, int] = {}
+
+    def stop(self) -> None:
+        """Makes ``run`` flush the records received so far and return."""
+        self._stopped.set()
+
+    def _summary_details(self) -> Dict[str, Any]:
+        details = super()._summary_details()
+        details["live"] = {
+            "address": str(self.server),
+            "connections": self.server.connections,
+            "flushes": self.flushes,
+            "malformed_records": self.malformed_records,
+        }
+        return details
+
+    def _run(self) -> int:
+        analyzer = self._create_analyzer(self.modules)
+        edges = AnalysisMetadata.load(self.bv)
+        self._loaded_edges = len(edges)
+        self._index_rows(analyzer, edges, 0)
+        in_flight: Deque[Tuple[Future, bytes]] = deque()
+        count = 0
+        start_time = time.perf_counter()
+        pool = None
+        if self.workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.server.start()
+        self.progress(f"Binja Missing Link: listening for branch records on {self.server}")
+        try:
+            next_flush = time.perf_counter() + self.flush_interval
+            next_refresh = time.perf_counter() + self.REFRESH_INTERVAL
+            next_store = time.perf_counter() + self.STORE_INTERVAL
+            while not self._stopped.is_set() and not self.should_cancel():
+                timeout = 0 if in_flight else max(next_flush - time.perf_counter(), 0)
+                if (lines := self._next_batch(timeout)) is not None:
+                    in_flight.append((self._decode(pool, analyzer, lines), lines))
+                # Decoded batches are added in the order they were received
+                while in_flight and (lines is None or in_flight[0][0].done() or len(in_flight) > 2 * self.workers):
+                    self._add_batch(analyzer, *in_flight.popleft())
+                if (now := time.perf_counter()) < next_flush:
+                    continue
+                refresh, store = now >= next_refresh, now >= next_store
+                count += self._flush(analyzer, edges, refresh, store)
+                if refresh:
+                    next_refresh = now + self.REFRESH_INTERVAL
+                if store:
+                    next_store = now + self.STORE_INTERVAL
+                self._report_rate(start_time)
+                next_flush = time.perf_counter() + self.flush_interval
+        finally:
+            self.server.stop()
+            try:
+                while (lines := self._next_batch(0)) is not None:
+                    in_flight.append((self._decode(pool, analyzer, lines), lines))
+                while in_flight:
+                    self._add_batch(analyzer, *in_flight.popleft())
+            finally:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+        count += self._flush(analyzer, edges, refresh=True, store=True)
+        self.instrumentation.count("records", self.records)
+        self.instrumentation.count("unique_edges", len(self._session))
+        return count
+
+    def _next_batch(self, timeout: float) -> Optional[bytes]:
+        """Returns the queued lines, joined up to BATCH_BYTES, or None if none arrived in time."""
+        try:
+            chunks = [self.server.queue.get(timeout=timeout) if timeout > 0 else self.server.queue.get_nowait()]
+        except queue.Empty:
+            return None
+        size = len(chunks[0])
+        while size < self.BATCH_BYTES:
+            try:
+                chunks.append(self.server.queue.get_nowait())
+            except queue.Empty:
+                break
+            size += len(chunks[-1])
+        return b"".join(chunks)
+
+    def _decode(self, pool: Optional[ProcessPoolExecutor], analyzer: BranchAnalyzer, lines: bytes) -> Future:
+        if b'"modules"' in lines:
+            self._read_modules(analyzer, lines)
+        if pool is not None:
+            log_start = min(self._worker_log_sizes.values(), default=0)
+            return pool.submit(
+                decode_lines_in_worker, lines, analyzer.modules, log_start, self._base_register_log[log_start:]
+            )
+        future = Future()
+        with self.instrumentation.stage("decode"):
+            try:
+                future.set_result(decode_lines(lines, analyzer.modules, self._base_registers))
+            except (KeyError, TypeError, ValueError) as e:
+                future.set_exception(e)
+        return future
+
+    @staticmethod
+    def _read_modules(analyzer: BranchAnalyzer, lines: bytes) -> None:
+        for line in lines.split(b"\n"):
+            if b'"modules"' not in line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "modules" in record:
+                analyzer.modules.update(TraceReader.parse_modules(record["modules"]))
+                analyzer.module_index = ModuleIndex(analyzer.modules)
+
+    def _add_edge(self, key: EdgeKey, hits: int) -> None:
+        row, is_new = self._session.add(key, hits)
+        self._touched.add(row)
+        if is_new:
+            self._new_rows.add(row)
+            self._merged_hits.append(0)
+
+    def _add_batch(self, analyzer: BranchAnalyzer, future: Future, lines: bytes) -> None:
+        with self.instrumentation.stage("collect"):
+            try:
+                result = future.result()
+            except (KeyError, TypeError, ValueError):
+                self._add_lines(analyzer, lines)
+                return
+            if self.workers > 1:
+                result, pid, log_size = result
+                self._worker_log_sizes[pid] = log_size
+            edges, pending, records, unknown_module = result
+            self.instrumentation.skip(SkipReason.UNKNOWN_MODULE, unknown_module)
+            for key, hits in edges.items():
+                self._add_edge(key, hits)
+            new_sites = {(src_module, src_offset) for src_module, src_offset, *_ in pending}
+            new_sites.difference_update(self._base_registers)
+            _add_pending_edges(analyzer, self._add_edge, pending, self._base_registers)
+            if self.workers > 1:
+                self._base_register_log.extend((site, self._base_registers[site]) for site in new_sites)
+            self.records += records - unknown_module
+
+    def _add_lines(self, analyzer: BranchAnalyzer, lines: bytes) -> None:
+        """Adds the records of a batch one by one, skipping the ones that cannot be decoded."""
+        for line in lines.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                branch = json.loads(line)
+                if "modules" in branch:
+                    continue
+                if branch["before"]["module"] not in analyzer.modules:
+                    self.instrumentation.skip(SkipReason.UNKNOWN_MODULE)
+                    continue
+                self._add_edge(analyzer.get_edge_key(branch), 1)
+            except (KeyError, TypeError, ValueError) as e:
+                # One bad record must not end a session that cannot be replayed
+                print(f"Ignoring malformed branch record: {e!r}", file=sys.stderr)
+                self.malformed_records += 1
+                continue
+            self.records += 1
+
+    def _index_rows(self, analyzer: BranchAnalyzer, edges: EdgeStore, start: int) -> None:
+        for row in range(start, len(edges)):
+            for addr in analyzer.get_edge_addresses(edges.key(row)):
+                self._rows[addr].append(row)
+
+    def _flush(self, analyzer: BranchAnalyzer, edges: EdgeStore, refresh: bool, store: bool) -> int:
+        """Merges the new edges, or with ``refresh`` every edge hit since the last refresh,
+        into ``edges`` and rewrites the comments of the addresses they changed."""
+        rows = self._touched if refresh else self._new_rows
+        if not rows and not store:
+            return 0
+        count = 0
+        with self.instrumentation.stage("flush"):
+            indexed = len(edges)
+            # A session is a new run, so its hits are added to those of earlier loads
+            changed = AnalysisMetadata.merge_items(edges, self._unmerged_hits(sorted(rows)), accumulate=True)
+            self._index_rows(analyzer, edges, indexed)
+            if refresh:
+                self._touched.clear()
+            self._new_rows.clear()
+            if changed:
+                addresses: Set[int] = set()
+                for key in changed:
+                    addresses.update(analyzer.get_edge_addresses(key))
+                edge_rows = sorted({row for addr in addresses for row in self._rows[addr]})
+                analyzer.comment_manager = CommentManager(self.bv, self.instrumentation)
+                analyzer.annotate_rows(edges, edge_rows, addresses)
+                # Not cancellable: cancelling a live run ends it with this flush. Comments only
+                # need no analysis update, and a flush every second must not flood the undo history
+                with untracked_changes(self.bv):
+                    count = analyzer.comment_manager.set_comments()
+                AnnotationQuery.forget(self.bv)
+                self.flushes += 1
+            if store:
+                state = AnalysisMetadata.load_state(self.bv)
+                # The edges a session adds get comments but no cross references
+                state["xrefs"] = state["xrefs"] and len(edges) == self._loaded_edges
+                AnalysisMetadata.store(self.bv, analyzer.modules, edges, state=state)
+        return count
+
+    def _unmerged_hits(self, rows: List[int]) -> Iterator[Tuple[EdgeKey, int]]:
+        session = self._session
+        for row in rows:
+            hits = session.hits[row]
+            yield session.key(row), hits - self._merged_hits[row]
+            self._merged_hits[row] = hits
+
+    def _report_rate(self, start_time: float) -> None:
+        rate = self.records / max(time.perf_counter() - start_time, 1e-9)
+        self.progress(
+            f"Binja Missing Link: {self.records:,} records from {self.server} ({rate:,.0f} records/s, "
+            f"{self.server.queue.qsize()} chunks queued)"
+        )
+
+
+class MultiTraceAnnotator(TraceAnnotator):
+    """Merges several traces of the same binaries into a TraceSet and annotates the view
+    with, or exports, the edges selected by a set operation over them.
+
+    Every trace is read once, from its edge cache when it has one, and streamed into the
+    set; annotating the result is a single comment update however many traces were given.
+    The result replaces the edges stored in the view, so that it shows exactly the
+    selected edges even after earlier loads or set operations.
+    """
+
+    # Kept apart from the stats of a load of the first trace alone
+    MERGE_STATS_SUFFIX = ".merge.stats.json"
+
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        trace_paths: Sequence[str],
+        names: Optional[Sequence[str]] = None,
+        operation: SetOperation = SetOperation.UNION,
+        selected: Optional[Sequence[str]] = None,
+        others: Optional[Sequence[str]] = None,
+        export_path: Optional[str] = None,
+        annotate: bool = True,
+        workers: int = 1,
+        use_cache: bool = True,
+        progress: Optional[Callable[[str], None]] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        stats_path: Optional[str] = None,
+        apply_xrefs: bool = False,
+    ):
+        super().__init__(
+            bv, ", ".join(trace_paths), workers, use_cache, progress, should_cancel, instrumentation, stats_path,
+            apply_xrefs,
+        )
+        self.trace_paths = list(trace_paths)
+        self.trace_set = TraceSet(names if names is not None else _trace_names(self.trace_paths))
+        self.operation = operation
+        # The traces the operation applies to (default: all) and, for a difference, the
+        # traces whose edges are excluded (default: all others)
+        self.selected = selected
+        self.others = others
+        self.export_path = export_path
+        self.annotate = annotate
+        self.result: Optional[EdgeStore] = None
+        self.trace_digests: Dict[str, Optional[bytes]] = {}
+
+    def _summary_details(self) -> Dict[str, Any]:
+        details = super()._summary_details()
+        details["traces"] = dict(zip(self.trace_set.names, self.trace_paths))
+        details["set"] = {
+            "operation": self.operation.value,
+            "selected": self.selected,
+            "others": self.others,
+            "merged_edges": len(self.trace_set),
+            "selected_edges": len(self.result) if self.result is not None else None,
+        }
+        return details
+
+    def _run(self) -> int:
+        trace_set = self.trace_set
+        for index, (name, trace_path) in enumerate(zip(trace_set.names, self.trace_paths)):
+            if self.should_cancel():
+                raise OperationCancelled()
+            self.progress(f"Binja Missing Link: reading trace {index + 1}/{len(self.trace_paths)} ({name})")
+            self.trace_path = trace_path
+            try:
+                self._merge_trace(name)
+            finally:
+                self.trace_path = ", ".join(self.trace_paths)
+        self.instrumentation.count("merged_edges", len(trace_set))
+
+        with self.instrumentation.stage("select"):
+            rows = trace_set.select(self.operation, self.selected, self.others)
+            self.result = trace_set.subset(rows)
+        if self.export_path is not None:
+            with self.instrumentation.stage("export"):
+                trace_set.export(self.export_path, rows)
+        if not self.annotate:
+            return 0
+        return self._annotate(self._create_analyzer(trace_set.modules), self.result)
+
+    def _merge_trace(self, name: str) -> None:
+        self.trace_digest = None
+        if self.trace_path.endswith(EdgeCache.SUFFIX):
+            cache = EdgeCache(self.trace_path)
+        elif not self.use_cache or (cache := EdgeCache.open_for_trace(self.trace_path)) is None:
+            analyzer, edges = self._collect_trace()
+            with self.instrumentation.stage("merge_traces"):
+                self.trace_set.add_trace(name, analyzer.modules, edges)
+            self.trace_digests[self.trace_path] = self.trace_digest
+            return
+        else:
+            self.instrumentation.count("cache_hits")
+        with cache, self.instrumentation.stage("merge_traces"):
+            self.trace_set.add_trace(name, cache.modules, cache)
+            self.trace_digests[self.trace_path] = cache.source_digest
+
+    def _merge_stored(
+        self, analyzer: BranchAnalyzer, trace_edges: Union[EdgeStore, EdgeCache], owned: bool = False
+    ) -> Tuple[EdgeStore, List[Dict[str, Optional[str]]], Optional[List[EdgeKey]]]:
+        """Replaces the stored edges with the result and clears the comments of the stored
+        edges it drops. The hits of a result edge are those of every merged trace, so the
+        merged traces are recorded in place of the traces loaded before."""
+        stored_hits = dict(AnalysisMetadata.load(analyzer.bv).items())
+        edges = EdgeStore()
+        changed = []
+        for key, hits in trace_edges.items():
+            edges.add(key, hits)
+            if stored_hits.pop(key, None) != hits:
+                changed.append(key)
+        # The edges left are not in the result
+        for key in stored_hits:
+            changed.append(key)
+            analyzer.comment_manager.clear(analyzer.get_edge_addresses(key))
+        traces: List[Dict[str, Optional[str]]] = []
+        for trace_path in self.trace_paths:
+            AnalysisMetadata.record_trace(traces, trace_path, self.trace_digests.get(trace_path))
+        return edges, traces, changed
+
+
+class BranchTraceLoadTask(binaryninja.BackgroundTaskThread):
+    """Runs a TraceAnnotator without blocking the UI."""
+
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        trace_path: str,
+        workers: int = 1,
+        use_cache: bool = True,
+        profile: bool = False,
+        apply_xrefs: bool = False,
+        preview: Optional[PreviewOptions] = None,
+        lazy: bool = False,
+    ):
+        super().__init__("Binja Missing Link: loading branch trace", can_cancel=True)
+        self.annotator = TraceAnnotator(
+            bv,
+            trace_path,
+            workers,
+            use_cache,
+            progress=self._set_progress,
+            should_cancel=lambda: self.cancelled,
+            instrumentation=Instrumentation(profile),
+            stats_path=trace_path + TraceAnnotator.STATS_SUFFIX,
+            apply_xrefs=apply_xrefs,
+            preview=preview,
+            lazy=lazy,
+        )
+
+    def run(self) -> None:
+        try:
+            self.annotator.run()
+        except OperationCancelled:
+            print("Loading branch trace was cancelled; no comments were applied", file=sys.stderr)
+        except (json.JSONDecodeError, KeyError, ValueError, struct.error) as e:
+            print(f"Error processing JSON file: {e}", file=sys.stderr)
+
+    def _set_progress(self, text: str) -> None:
+        self.progress = text
+
+
+class LiveTraceTask(binaryninja.BackgroundTaskThread):
+    """Runs a LiveTraceAnnotator until it is cancelled from the UI."""
+
+    def __init__(
+        self, bv: binaryninja.BinaryView, address: LiveAddress = LiveTraceAnnotator.DEFAULT_ADDRESS, workers: int = 1
+    ):
+        super().__init__("Binja Missing Link: waiting for branch records", can_cancel=True)
+        self.annotator = LiveTraceAnnotator(
+            bv, address, workers=workers, progress=self._set_progress, should_cancel=lambda: self.cancelled
+        )
+
+    def run(self) -> None:
+        try:
+            count = self.annotator.run()
+            print(f"Live trace from {self.annotator.server} ended; {count} comments were written")
+        except (KeyError, ValueError, struct.error) as e:
+            print(f"Error processing live branch records: {e}", file=sys.stderr)
+
+    def _set_progress(self, text: str) -> None:
+        self.progress = text
+
+
+class TraceMergeTask(binaryninja.BackgroundTaskThread):
+    """Runs a MultiTraceAnnotator without blocking the UI."""
+
+    def __init__(
+        self,
+        bv: binaryninja.BinaryView,
+        trace_paths: List[str],
+        operation: SetOperation = SetOperation.UNION,
+        selected: Optional[List[str]] = None,
+    ):
+        super().__init__("Binja Missing Link: merging branch traces", can_cancel=True)
+        self.annotator = MultiTraceAnnotator(
+            bv,
+            trace_paths,
+            operation=operation,
+            selected=selected,
+            progress=self._set_progress,
+            should_cancel=lambda: self.cancelled,
+            stats_path=trace_paths[0] + MultiTraceAnnotator.MERGE_STATS_SUFFIX,
+        )
+
+    def run(self) -> None:
+        try:
+            self.annotator.run()
+        except OperationCancelled:
+            print("Merging branch traces was cancelled; no comments were applied", file=sys.stderr)
+        except (json.JSONDecodeError, KeyError, ValueError, struct.error) as e:
+            print(f"Error processing JSON file: {e}", file=sys.stderr)
+
+    def _set_progress(self, text: str) -> None:
+        self.progress = text
+
+
+@dataclass
+class HeadlessJob:
+    binary_path: str
+    trace_path: str
+    # Defaults to saving a .bndb input in place and to <binary>.bndb otherwise
+    output_path: Optional[str] = None
+
+
+def _open_binary(binary_path: str) -> binaryninja.BinaryView:
+    bv = binaryninja.load(binary_path)
+    if bv is None:
+        raise ValueError(f"Cannot open {binary_path}")
+    if bv.arch.name != Architecture.X86_64.value:
+        bv.file.close()
+        raise ValueError(f"{binary_path}: this plugin only supports x86_64 binaries")
+    return bv
+
+
+def _save_database(bv: binaryninja.BinaryView, binary_path: str, output_path: Optional[str]) -> str:
+    """Saves a .bndb input in place unless ``output_path`` is given, and other inputs to
+    ``output_path`` or <binary>.bndb. Returns the path of the database."""
+    if output_path is None and binary_path.endswith(".bndb"):
+        saved = bv.file.save_auto_snapshot()
+        output_path = binary_path
+    else:
+        output_path = output_path or f"{binary_path}.bndb"
+        saved = bv.file.create_database(output_path)
+    if not saved:
+        raise OSError(f"Cannot save database {output_path}")
+    return output_path
+
+
+def _output_path_in(output_dir: str, binary_path: str) -> str:
+    name = os.path.basename(binary_path)
+    return os.path.join(output_dir, name if name.endswith(".bndb") else f"{name}.bndb")
+
+
+def annotate_headless(
+    job: HeadlessJob, workers: int = 1, use_cache: bool = True, profile: bool = False, apply_xrefs: bool = False
+) -> Dict[str, Any]:
+    """Opens ``job.binary_path`` without the UI, annotates it with the trace and saves a database.
+
+    The run summary is written next to the trace and returned under ``stats``.
+    """
+    start_time = time.perf_counter()
+    bv = _open_binary(job.binary_path)
+    try:
+        annotator = TraceAnnotator(
+            bv,
+            job.trace_path,
+            workers,
+            use_cache,
+            instrumentation=Instrumentation(profile),
+            stats_path=job.trace_path + TraceAnnotator.STATS_SUFFIX,
+            apply_xrefs=apply_xrefs,
+        )
+        annotated = annotator.run()
+        bv.update_analysis_and_wait()
+        output_path = _save_database(bv, job.binary_path, job.output_path)
+    finally:
+        bv.file.close()
+
+    return {
+        "binary": job.binary_path,
+        "trace": job.trace_path,
+        "output": output_path,
+        "annotated": annotated,
+        "seconds": round(time.perf_counter() - start_time, 3),
+        "stats": annotator.summary,
+    }
+
+
+def _run_headless_job(
+    job: HeadlessJob, workers: int, use_cache: bool, profile: bool, apply_xrefs: bool
+) -> Dict[str, Any]:
+    try:
+        return annotate_headless(job, workers, use_cache, profile, apply_xrefs)
+    except Exception as e:
+        return {"binary": job.binary_path, "trace": job.trace_path, "error": f"{type(e).__name__}: {e}"}
+
+
+def run_headless_jobs(
+    jobs: List[HeadlessJob],
+    processes: Optional[int] = None,
+    workers: int = 1,
+    use_cache: bool = True,
+    profile: bool = False,
+    apply_xrefs: bool = False,
+) -> List[Dict[str, Any]]:
+    """Annotates every job, each in its own process with its own BinaryView.
+
+    Returns one summary per job in the same order; a failed job has an ``error`` entry
+    instead of aborting the batch. ``workers`` is the number of trace decoding
+    processes used by each job.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        return [_run_headless_job(job, workers, use_cache, profile, apply_xrefs) for job in jobs]
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(processes, len(jobs) or 1), mp_context=context) as pool:
+        futures = [
+            pool.submit(_run_headless_job, job, workers, use_cache, profile, apply_xrefs) for job in jobs
+        ]
+        return [future.result() for future in futures]
+
+
+def annotate_modules_headless(
+    trace_path: str,
+    binaries: Dict[str, str],
+    output_dir: Optional[str] = None,
+    workers: int = 1,
+    use_cache: bool = True,
+    profile: bool = False,
+    apply_xrefs: bool = False,
+) -> Dict[str, Any]:
+    """Annotates the binary or database of every module in ``binaries`` (module name to
+    path) with one trace in a single pass and saves a database for each."""
+    start_time = time.perf_counter()
+    views: Dict[str, binaryninja.BinaryView] = {}
+    try:
+        for module, binary_path in binaries.items():
+            views[module] = _open_binary(binary_path)
+        annotator = MultiModuleAnnotator(
+            views,
+            trace_path,
+            workers,
+            use_cache,
+            instrumentation=Instrumentation(profile),
+            stats_path=trace_path + TraceAnnotator.STATS_SUFFIX,
+            apply_xrefs=apply_xrefs,
+        )
+        annotator.run()
+        modules = {}
+        for module, bv in views.items():
+            bv.update_analysis_and_wait()
+            binary_path = binaries[module]
+            output_path = _output_path_in(output_dir, binary_path) if output_dir is not None else None
+            modules[module] = {
+                "binary": binary_path,
+                "output": _save_database(bv, binary_path, output_path),
+                "annotated": annotator.module_counts.get(module, 0),
+            }
+    finally:
+        for bv in views.values():
+            bv.file.close()
+
+    return {
+        "trace": trace_path,
+        "modules": modules,
+        "seconds": round(time.perf_counter() - start_time, 3),
+        "stats": annotator.summary,
+    }
+
+
+def annotate_traces_headless(
+    binary_path: str,
+    trace_paths: List[str],
+    output_path: Optional[str] = None,
+    operation: SetOperation = SetOperation.UNION,
+    selected: Optional[List[str]] = None,
+    export_path: Optional[str] = None,
+    workers: int = 1,
+    use_cache: bool = True,
+    profile: bool = False,
+    apply_xrefs: bool = False,
+) -> Dict[str, Any]:
+    """Merges several traces of one binary, annotates it with the edges selected by
+    ``operation`` and saves a database."""
+    start_time = time.perf_counter()
+    bv = _open_binary(binary_path)
+    try:
+        annotator = MultiTraceAnnotator(
+            bv,
+            trace_paths,
+            operation=operation,
+            selected=selected,
+            export_path=export_path,
+            workers=workers,
+            use_cache=use_cache,
+            instrumentation=Instrumentation(profile),
+            stats_path=trace_paths[0] + MultiTraceAnnotator.MERGE_STATS_SUFFIX,
+            apply_xrefs=apply_xrefs,
+        )
+        annotated = annotator.run()
+        bv.update_analysis_and_wait()
+        output_path = _save_database(bv, binary_path, output_path)
+    finally:
+        bv.file.close()
+
+    return {
+        "binary": binary_path,
+        "traces": trace_paths,
+        "output": output_path,
+        "annotated": annotated,
+        "seconds": round(time.perf_counter() - start_time, 3),
+        "stats": annotator.summary,
+    }
+
+
+def _parse_module_binaries(arguments: List[str]) -> Dict[str, str]:
+    """Maps ``NAME=PATH`` arguments, or bare paths named after their file, to module names."""
+    binaries = {}
+    for argument in arguments:
+        module, separator, path = argument.partition("=")
+        if not separator:
+            path = argument
+            module = os.path.basename(path)
+            if module.endswith(".bndb"):
+                module = module[:-len(".bndb")]
+        binaries[module] = path
+    return binaries
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point of the headless batch mode (see headless.py)."""
+    parser = argparse.ArgumentParser(
+        description="Annotate binaries or databases with branch traces without the Binary Ninja UI"
+    )
+    parser.add_argument(
+        "--pair", nargs=2, action="append", default=[], metavar=("BINARY", "TRACE"),
+        help="binary or .bndb and the trace to annotate it with (repeatable)",
+    )
+    parser.add_argument(
+        "--jobs-file",
+        help='JSON file with a list of {"binary": ..., "trace": ..., "output": ...} objects',
+    )
+    parser.add_argument(
+        "--modules", nargs="+", action="append", default=[], metavar="TRACE_OR_BINARY",
+        help="a trace followed by the binaries of the modules it covers, as PATH or MODULE=PATH; "
+        "all of them are annotated in one pass (repeatable)",
+    )
+    parser.add_argument(
+        "--traces", nargs="+", action="append", default=[], metavar="BINARY_OR_TRACE",
+        help="a binary followed by several of its traces, which are merged and annotated in one pass (repeatable)",
+    )
+    parser.add_argument(
+        "--set-op", choices=[operation.value for operation in SetOperation], default=SetOperation.UNION.value,
+        help="which edges of the --traces traces to annotate (default: union)",
+    )
+    parser.add_argument(
+        "--select", action="append", metavar="TRACE",
+        help="a trace the --set-op applies to, by file name (repeatable; default: all); "
+        "a difference keeps the edges of these traces that no other trace hit",
+    )
+    parser.add_argument("--export", help="also write the selected edges of --traces to this .jsonl or .bmlc file")
+    parser.add_argument("--output-dir", help="directory for the annotated databases")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="number of jobs run concurrently")
+    parser.add_argument("--decode-workers", type=int, default=1, help="trace decoding processes per job")
+    parser.add_argument("--no-cache", action="store_true", help="neither read nor write .bmlc edge caches")
+    parser.add_argument("--profile", action="store_true", help="write cProfile stats next to each trace")
+    parser.add_argument(
+        "--xrefs", action="store_true",
+        help="also add resolved targets as cross references and create functions at unknown targets",
+    )
+    args = parser.parse_args(argv)
+
+    jobs = [HeadlessJob(binary, trace) for binary, trace in args.pair]
+    if args.jobs_file is not None:
+        with open(args.jobs_file, "r") as fin:
+            jobs += [HeadlessJob(job["binary"], job["trace"], job.get("output")) for job in json.load(fin)]
+    if not jobs and not args.modules and not args.traces:
+        parser.error("no jobs given; use --pair, --jobs-file, --modules or --traces")
+    if any(len(paths) < 2 for paths in args.modules):
+        parser.error("--modules takes a trace followed by at least one binary")
+    if any(len(paths) < 2 for paths in args.traces):
+        parser.error("--traces takes a binary followed by at least one trace")
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for job in jobs:
+            if job.output_path is None:
+                job.output_path = _output_path_in(args.output_dir, job.binary_path)
+
+    results = run_headless_jobs(
+        jobs, args.processes, args.decode_workers, not args.no_cache, args.profile, args.xrefs
+    )
+    for trace_path, *binaries in args.modules:
+        try:
+            results.append(annotate_modules_headless(
+                trace_path, _parse_module_binaries(binaries), args.output_dir, args.decode_workers,
+                not args.no_cache, args.profile, args.xrefs,
+            ))
+        except Exception as e:
+            results.append({"trace": trace_path, "error": f"{type(e).__name__}: {e}"})
+    for binary_path, *trace_paths in args.traces:
+        output_path = _output_path_in(args.output_dir, binary_path) if args.output_dir is not None else None
+        try:
+            results.append(annotate_traces_headless(
+                binary_path, trace_paths, output_path, SetOperation(args.set_op), args.select, args.export,
+                args.decode_workers, not args.no_cache, args.profile, args.xrefs,
+            ))
+        except Exception as e:
+            results.append({"binary": binary_path, "traces": trace_paths, "error": f"{type(e).__name__}: {e}"})
+    print(json.dumps(results, indent=2))
+    return 1 if any("error" in result for result in results) else 0
+
+
+def load(
+    bv: binaryninja.BinaryView,
+    profile: bool = False,
+    apply_xrefs: bool = False,
+    preview: Optional[PreviewOptions] = None,
+    lazy: bool = False,
+) -> None:
     if bv.arch.name != Architecture.X86_64.value:
         print("This plugin only supports x86_64 binaries", file=sys.stderr)
         return
 
-    input_json = binaryninja.get_open_filename_input("filename:", "*.json")
+    input_json = binaryninja.get_open_filename_input("filename:", f"*.json *.jsonl *{EdgeCache.SUFFIX}")
     if input_json is None:
         print("Please specify a json file", file=sys.stderr)
         return
-    
+
+    BranchTraceLoadTask(bv, input_json, profile=profile, apply_xrefs=apply_xrefs, preview=preview, lazy=lazy).start()
+
+
+def load_profiled(bv: binaryninja.BinaryView) -> None:
+    load(bv, profile=True)
+
+
+def load_with_xrefs(bv: binaryninja.BinaryView) -> None:
+    load(bv, apply_xrefs=True)
+
+
+def load_preview(bv: binaryninja.BinaryView) -> None:
+    load(bv, preview=PreviewOptions(time_budget=PREVIEW_TIME_BUDGET))
+
+
+def load_on_demand(bv: binaryninja.BinaryView) -> None:
+    load(bv, lazy=True)
+
+
+def load_live(bv: binaryninja.BinaryView) -> None:
+    if bv.arch.name != Architecture.X86_64.value:
+        print("This plugin only supports x86_64 binaries", file=sys.stderr)
+        return
+
+    host, default_port = LiveTraceAnnotator.DEFAULT_ADDRESS
+    port = binaryninja.get_int_input(f"port on {host} (default {default_port}):", "Binja Missing Link live trace")
+    if port is None:
+        return
     try:
-        with open(input_json, "r") as fin:
-            raw_data = json.loads(fin.read())
-            modules = {module["name"]: int(module["addr"], 16) for module in raw_data["modules"]}
-            branches = raw_data["branches"]
-
-        analyzer = BranchAnalyzer(bv, modules)
-        for branch in branches:
-            analyzer.analyze_branch(branch)
-        
-        analyzer.comment_manager.set_comments()
-
-    except (json.JSONDecodeError, KeyError, ValueError) as e:
-        print(f"Error processing JSON file: {e}", file=sys.stderr)
+        # Records are decoded in the UI process: the interpreter embedded in Binary Ninja
+        # cannot be relied on to spawn decoding workers
+        task = LiveTraceTask(bv, (host, port or default_port))
+    except OSError as e:
+        print(f"Cannot listen on {host}:{port or default_port}: {e}", file=sys.stderr)
+        return
+    print(f"Listening for branch records on {task.annotator.server}; cancel the task to stop")
+    task.start()
+
+
+def load_merged(bv: binaryninja.BinaryView) -> None:
+    if bv.arch.name != Architecture.X86_64.value:
+        print("This plugin only supports x86_64 binaries", file=sys.stderr)
+        return
+
+    trace_paths: List[str] = []
+    while True:
+        trace_path = binaryninja.get_open_filename_input(
+            f"trace {len(trace_paths) + 1} (cancel when done):", f"*.json *.jsonl *{EdgeCache.SUFFIX}"
+        )
+        if trace_path is None:
+            break
+        trace_paths.append(trace_path)
+    if len(trace_paths) < 2:
+        print("Please specify at least two traces", file=sys.stderr)
         return
 
+    names = _trace_names(trace_paths)
+    choices = ["all traces (union)", "all traces (intersection)"] + [f"only {name}" for name in names]
+    choice = binaryninja.get_choice_input("edges to annotate:", "Binja Missing Link merge traces", choices)
+    if choice is None:
+        return
+    if choice < 2:
+        operation = SetOperation.UNION if choice == 0 else SetOperation.INTERSECTION
+        TraceMergeTask(bv, trace_paths, operation).start()
+    else:
+        TraceMergeTask(bv, trace_paths, SetOperation.DIFFERENCE, [names[choice - 2]]).start()
+
+
+def show_annotations_at(bv: binaryninja.BinaryView, addr: int) -> None:
+    text = AnnotationQuery.for_view(bv).annotations_at(addr)
+    if text is None:
+        print(f"No branch was traced at {hex(addr)}", file=sys.stderr)
+        return
+    binaryninja.show_plain_text_report(f"Binja Missing Link: {hex(addr)}", text)
+
+
+def annotate_function(bv: binaryninja.BinaryView, func: binaryninja.Function) -> None:
+    query = AnnotationQuery.for_view(bv)
+    count = query.materialize(query.addresses_in_function(func))
+    print(f"Annotated {count} addresses in {func.name}")
+
 
 binaryninja.PluginCommand.register("Binja Missing Link", "Load branch tracking info", load)
+binaryninja.PluginCommand.register(
+    "Binja Missing Link (profiled)",
+    "Load branch tracking info and write cProfile stats next to the trace",
+    load_profiled,
+)
+binaryninja.PluginCommand.register(
+    "Binja Missing Link (apply xrefs)",
+    "Load branch tracking info and add the resolved targets as cross references",
+    load_with_xrefs,
+)
+binaryninja.PluginCommand.register(
+    "Binja Missing Link (preview)",
+    "Annotate the part of a branch trace read within a few seconds; loading it again continues from there",
+    load_preview,
+)
+binaryninja.PluginCommand.register(
+    "Binja Missing Link (on demand)",
+    "Store branch tracking info without writing comments; query it per address or function",
+    load_on_demand,
+)
+binaryninja.PluginCommand.register(
+    "Binja Missing Link (live)",
+    "Annotate branch records streamed from a running debugging session over a local socket",
+    load_live,
+)
+binaryninja.PluginCommand.register(
+    "Binja Missing Link (merge traces)",
+    "Merge several branch traces and annotate their union, intersection or the edges only one of them hit",
+    load_merged,
+)
+binaryninja.PluginCommand.register_for_address(
+    "Binja Missing Link (show at address)",
+    "Show the traced branch sources and destinations of the current address",
+    show_annotations_at,
+)
+binaryninja.PluginCommand.register_for_function(
+    "Binja Missing Link (annotate function)",
+    "Write the traced branch comments of the current function",
+    annotate_function,
+)
@@ -0,0 +1,17 @@
+#
+# (c) FFRI Security, Inc., 2025 / Author: FFRI Security, Inc.
+#
+# Headless batch mode: annotate many binaries or databases with branch traces without the UI.
+#
+#   python3 headless.py --pair ./main main_branches.json --pair ./libfoo.dylib.bndb foo_branches.jsonl -j 4
+#
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if __name__ == "__main__":
+    # Imported here, since spawned decoding workers run this file again without loading binaryninja
+    from __init__ import main
+
+    sys.exit(main())
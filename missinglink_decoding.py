@@ -0,0 +1,225 @@
+#
+# (c) FFRI Security, Inc., 2025 / Author: FFRI Security, Inc.
+#
+# Decoding of branch records into module-relative edges. This module does not import
+# binaryninja, so that decoding worker processes can import it without loading the
+# plugin or Binary Ninja.
+#
+import bisect
+import json
+import os
+import re
+from array import array
+from collections import defaultdict
+from functools import partial
+from typing import Any, Callable, DefaultDict, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# (source module, source offset, destination module, destination function,
+#  destination offset, vtable offset or None); offsets are relative to the module base
+EdgeKey = Tuple[str, int, str, str, int, Optional[int]]
+# (source module, source offset) of a call site
+CallSiteKey = Tuple[str, int]
+
+
+class IntervalIndex:
+    """Sorted, non-overlapping [start, end) address ranges, each mapped to a value.
+
+    Lookups bisect the sorted start addresses, so a batch of addresses is resolved without
+    touching the BinaryView. Where input ranges overlap, the range that starts first keeps
+    the shared addresses.
+    """
+
+    def __init__(self, ranges: Iterable[Tuple[int, int, Any]]):
+        self.starts = array("Q")
+        self.ends = array("Q")
+        self.values: List[Any] = []
+        for start, end, value in sorted(ranges, key=lambda item: (item[0], -item[1])):
+            if self.ends and start < self.ends[-1]:
+                if end <= self.ends[-1]:
+                    continue
+                start = self.ends[-1]
+            self.starts.append(start)
+            self.ends.append(end)
+            self.values.append(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def find(self, addr: int) -> Optional[Any]:
+        """Returns the value of the range containing ``addr``, or None."""
+        index = bisect.bisect_right(self.starts, addr) - 1
+        if index >= 0 and addr < self.ends[index]:
+            return self.values[index]
+        return None
+
+    def find_many(self, addresses: Sequence[int]) -> List[Optional[Any]]:
+        """Resolves every address in one pass; equivalent to ``[find(addr) for addr in addresses]``."""
+        ends, values = self.ends, self.values
+        found: List[Optional[Any]] = []
+        for addr, position in zip(addresses, map(partial(bisect.bisect_right, self.starts), addresses)):
+            found.append(values[position - 1] if position and addr < ends[position - 1] else None)
+        return found
+
+
+class ModuleIndex(IntervalIndex):
+    """Address ranges of the trace's modules. The trace only records base addresses, so a
+    module is assumed to extend up to the next module's base."""
+
+    _ADDRESS_END = (1 << 64) - 1
+
+    def __init__(self, modules: Dict[str, int]):
+        self.bases = modules
+        module_bases = sorted((base, name) for name, base in modules.items())
+        ends = [base for base, _ in module_bases[1:]] + [self._ADDRESS_END]
+        super().__init__((base, end, name) for (base, name), end in zip(module_bases, ends))
+
+    def offset_in(self, module: str, addr: int) -> Optional[int]:
+        """Returns ``addr`` relative to the base of ``module``, or None if it lies in another module."""
+        if self.find(addr) != module:
+            return None
+        return addr - self.bases[module]
+
+
+# x86_64 registers that can be the base of the memory operand of an indirect branch
+BASE_REGISTER_CANDIDATES = frozenset((
+    "rax", "rbx", "rcx", "rdx", "rsi", "rdi", "rbp", "rsp",
+    "r8", "r9", "r10", "r11", "r12", "r13", "r14", "r15",
+))
+
+
+def decode_branch(branch: Dict, modules: Dict[str, int]) -> Tuple[str, int, str, str, int]:
+    """Returns (source module, source offset, destination module, destination function,
+    destination offset) of a branch record, with offsets relative to the module base."""
+    before, after = branch["before"], branch["after"]
+    src_module, dst_module = before["module"], after["module"]
+    src_offset = int(before["registers"]["rip"], 16) - modules[src_module]
+    # Inter-module destinations are only reported by name, so an unlisted module is tolerated
+    dst_offset = int(after["registers"]["rip"], 16) - modules.get(dst_module, 0)
+    return src_module, src_offset, dst_module, after["func"], dst_offset
+
+
+def make_edge_key(
+    branch: Dict, module_index: ModuleIndex, get_base_register: Callable[[str, int], Optional[str]]
+) -> EdgeKey:
+    """Returns the edge key of a branch record; ``get_base_register`` is called with the
+    call site of intra-module branches."""
+    src_module, src_offset, dst_module, dst_func, dst_offset = decode_branch(branch, module_index.bases)
+    vtable_offset = None
+    if src_module == dst_module:
+        base_reg = get_base_register(src_module, src_offset)
+        vtable_offset = get_vtable_offset(branch["before"]["registers"], base_reg, module_index, src_module)
+    return (src_module, src_offset, dst_module, dst_func, dst_offset, vtable_offset)
+
+
+def get_vtable_offset(
+    registers: Dict[str, str], base_reg: Optional[str], module_index: ModuleIndex, module: str
+) -> Optional[int]:
+    """Returns the base register value relative to ``module``; a value outside the module
+    cannot be looked up in its BinaryView and gives None."""
+    if base_reg is None or base_reg not in registers:
+        return None
+    return module_index.offset_in(module, int(registers[base_reg], 16))
+
+
+# The first key of every branch record; never matches the modules table or nested objects
+RECORD_START = re.compile(rb'\{\s*"(?:before|after)"\s*:')
+RECORD_START_TEXT = re.compile(r'\{\s*"(?:before|after)"\s*:')
+_SHARD_TAIL_CHUNK_SIZE = 1 << 16
+
+# Edge whose call site had no known base register yet, with the integer values of
+# every register that may turn out to be the base register
+PendingEdge = Tuple[str, int, str, str, int, Tuple[Tuple[str, int], ...]]
+
+
+def read_shard(path: str, start: int, end: int) -> Tuple[str, int]:
+    """Returns the text of every record whose first byte lies in [start, end) and the byte
+    offset at which that text starts."""
+    with open(path, "rb") as fin:
+        fin.seek(start)
+        data = fin.read(end - start)
+        own_size = len(data)
+        while (next_record := RECORD_START.search(data, own_size)) is None:
+            if not (chunk := fin.read(_SHARD_TAIL_CHUNK_SIZE)):
+                break
+            data += chunk
+    if (first_record := RECORD_START.search(data)) is None or first_record.start() >= own_size:
+        return "", end
+    tail = next_record.start() if next_record is not None else len(data)
+    return data[first_record.start():tail].decode("utf-8"), start + first_record.start()
+
+
+def decode_shard(
+    path: str, start: int, end: int, modules: Dict[str, int], base_registers: Dict[CallSiteKey, Optional[str]]
+) -> Tuple[Dict[EdgeKey, int], Dict[PendingEdge, int], int, int]:
+    """Worker side of ParallelTraceDecoder: turns a byte range of the trace into edge hit
+    counts. Also returns the number of records and of records from unknown modules."""
+    text, _ = read_shard(path, start, end)
+    return decode_records(text, modules, base_registers)
+
+
+def decode_records(
+    text: str, modules: Dict[str, int], base_registers: Dict[CallSiteKey, Optional[str]]
+) -> Tuple[Dict[EdgeKey, int], Dict[PendingEdge, int], int, int]:
+    """Turns the branch records in ``text`` into edge hit counts. Records of intra-module
+    call sites missing from ``base_registers`` are returned as pending edges, with their
+    candidate base register values."""
+    edges: DefaultDict[EdgeKey, int] = defaultdict(int)
+    pending: DefaultDict[PendingEdge, int] = defaultdict(int)
+    records = 0
+    unknown_module = 0
+    decoder = json.JSONDecoder()
+    module_index = ModuleIndex(modules)
+    match = RECORD_START_TEXT.search(text)
+    while match is not None:
+        branch, record_end = decoder.raw_decode(text, match.start())
+        records += 1
+        match = RECORD_START_TEXT.search(text, record_end)
+        if branch["before"]["module"] not in modules:
+            unknown_module += 1
+            continue
+
+        src_module, src_offset, dst_module, dst_func, dst_offset = decode_branch(branch, modules)
+        registers = branch["before"]["registers"]
+        if src_module != dst_module:
+            edges[(src_module, src_offset, dst_module, dst_func, dst_offset, None)] += 1
+        elif (site := (src_module, src_offset)) in base_registers:
+            vtable_offset = get_vtable_offset(registers, base_registers[site], module_index, src_module)
+            edges[(src_module, src_offset, dst_module, dst_func, dst_offset, vtable_offset)] += 1
+        else:
+            candidates = tuple(
+                (name, int(value, 16)) for name, value in registers.items() if name in BASE_REGISTER_CANDIDATES
+            )
+            pending[(src_module, src_offset, dst_module, dst_func, dst_offset, candidates)] += 1
+    return dict(edges), dict(pending), records, unknown_module
+
+
+def decode_lines(
+    lines: bytes, modules: Dict[str, int], base_registers: Dict[CallSiteKey, Optional[str]]
+) -> Tuple[Dict[EdgeKey, int], Dict[PendingEdge, int], int, int]:
+    """Worker side of LiveTraceAnnotator: decodes a batch of newline-delimited records."""
+    return decode_records(lines.decode("utf-8", errors="replace"), modules, base_registers)
+
+
+# Base registers known to a decoding worker process of a live session, and how many
+# entries of the session's base register log they cover
+_worker_base_registers: Dict[CallSiteKey, Optional[str]] = {}
+_worker_log_size = 0
+
+
+def decode_lines_in_worker(
+    lines: bytes, modules: Dict[str, int], log_start: int, log: List[Tuple[CallSiteKey, Optional[str]]]
+) -> Tuple[Tuple[Dict[EdgeKey, int], Dict[PendingEdge, int], int, int], int, int]:
+    """Worker side of a LiveTraceAnnotator with several workers: decodes a batch with the
+    base registers this process has learned so far.
+
+    ``log`` holds the session's base register log from ``log_start`` on. Returns the
+    decoded batch, the process id and how much of the log the process covers, so that
+    later batches only carry the entries some worker has not seen yet.
+    """
+    global _worker_log_size
+    # A process that missed earlier entries keeps its size and is sent them again
+    if log_start <= _worker_log_size:
+        _worker_base_registers.update(log[_worker_log_size - log_start:])
+        _worker_log_size = max(_worker_log_size, log_start + len(log))
+    return decode_lines(lines, modules, _worker_base_registers), os.getpid(), _worker_log_size
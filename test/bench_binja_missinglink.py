@@ -0,0 +1,420 @@
+#
+# (c) FFRI Security, Inc., 2025 / Author: FFRI Security, Inc.
+#
+# Benchmark of TraceAnnotator runs on synthetic traces and a mock BinaryView.
+# It does not need Binary Ninja: when binaryninja is not imported yet, a stand-in module
+# that only provides what the plugin needs at import time is installed.
+#
+#   python3 test/bench_binja_missinglink.py --records 1000000 --call-sites 5000 --fanout 8 \
+#       --decode-workers 4 --output bench.json --baseline previous_bench.json
+#
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_binaryninja_stand_in() -> types.ModuleType:
+    module = types.ModuleType("binaryninja")
+
+    class BackgroundTaskThread(threading.Thread):
+        def __init__(self, initial_progress_text: str = "", can_cancel: bool = False):
+            super().__init__()
+            self.progress = initial_progress_text
+            self.can_cancel = can_cancel
+            self.cancelled = False
+
+        def cancel(self) -> None:
+            self.cancelled = True
+
+    module.BinaryView = object
+    module.Function = object
+    module.BackgroundTaskThread = BackgroundTaskThread
+    module.PluginCommand = types.SimpleNamespace(
+        register=lambda *args, **kwargs: None,
+        register_for_address=lambda *args, **kwargs: None,
+        register_for_function=lambda *args, **kwargs: None,
+    )
+    module.get_open_filename_input = lambda *args, **kwargs: None
+    return module
+
+
+if "binaryninja" not in sys.modules:
+    sys.modules["binaryninja"] = _make_binaryninja_stand_in()
+
+from __init__ import (  # noqa: E402
+    TraceAnnotator,
+    TraceFormat,
+    TraceReader,
+)
+
+MAIN_BASE = 0x100000000
+LIBRARY_BASE = 0x7ff800000000
+LIBRARY_STRIDE = 0x100000
+SITE_STRIDE = 0x40
+FUNCTION_SIZE = 0x100
+OTHER_REGISTERS = ("rbx", "rcx", "rdx", "rsi", "rdi", "rbp", "rsp", "r8", "r9", "r10", "r11", "r12", "r13", "r14", "r15")
+
+
+@dataclass
+class TraceConfig:
+    records: int = 100000
+    call_sites: int = 1000
+    fanout: int = 4
+    modules: int = 4
+    duplicate_ratio: float = 0.9
+    trace_format: str = TraceFormat.JSON.value
+    seed: int = 0
+
+
+@dataclass
+class StageResult:
+    seconds: float
+    items: int
+    items_per_sec: float
+    peak_mb: Optional[float] = None
+
+
+@dataclass
+class BenchmarkResult:
+    config: TraceConfig
+    latency_us: float
+    trace_mb: float
+    unique_edges: int
+    decode_workers: int = 1
+    stages: Dict[str, StageResult] = field(default_factory=dict)
+    bv_calls: Dict[str, int] = field(default_factory=dict)
+    # Of the whole benchmark process, including tracemalloc's overhead
+    peak_rss_mb: Optional[float] = None
+    python: str = platform.python_version()
+    timestamp: float = field(default_factory=time.time)
+
+
+def _site_addr(site: int) -> int:
+    return MAIN_BASE + 0x1000 + site * SITE_STRIDE
+
+
+def _target_addr(module: int, target: int) -> int:
+    base = MAIN_BASE if module == 0 else LIBRARY_BASE + module * LIBRARY_STRIDE
+    return base + 0x100000 + target * FUNCTION_SIZE
+
+
+def _vtable_addr(target: int) -> int:
+    return MAIN_BASE + 0x800000 + target * 0x20
+
+
+def module_name(module: int) -> str:
+    return "main" if module == 0 else f"lib{module}.dylib"
+
+
+def generate_trace(path: str, config: TraceConfig) -> None:
+    """Writes a synthetic trace of ``config.records`` records over ``call_sites * fanout`` edges.
+
+    Target ``j`` of a call site lives in module ``j % modules``, so module 0 ("main") gets the
+    intra-module edges. A record repeats an already emitted edge with probability
+    ``duplicate_ratio`` and otherwise takes the next edge in round-robin order.
+    """
+    rng = random.Random(config.seed)
+    unique_edges = config.call_sites * config.fanout
+    modules = [{"name": module_name(0), "addr": hex(MAIN_BASE)}] + [
+        {"name": module_name(module), "addr": hex(LIBRARY_BASE + module * LIBRARY_STRIDE)}
+        for module in range(1, config.modules)
+    ]
+
+    def record(edge: int) -> str:
+        site, target = divmod(edge, config.fanout)
+        module = target % config.modules
+        target_id = site * config.fanout + target
+        registers = {"rax": f"0x{_vtable_addr(target_id):016x}"}
+        registers.update((name, f"0x{rng.getrandbits(48):016x}") for name in OTHER_REGISTERS)
+        registers["rip"] = f"0x{_site_addr(site):016x}"
+        registers["rflags"] = "0x0000000000000246"
+        return json.dumps({
+            "before": {"module": "main", "func": f"caller_{site}", "registers": registers},
+            "after": {
+                "module": module_name(module),
+                "func": f"target_{target_id}",
+                "registers": {"rip": f"0x{_target_addr(module, target_id):016x}"},
+            },
+        })
+
+    emitted = 0
+    with open(path, "w") as fout:
+        if config.trace_format == TraceFormat.JSON_LINES.value:
+            fout.write(json.dumps({"modules": modules}) + "\n")
+        else:
+            fout.write('{"modules": ' + json.dumps(modules) + ', "branches": [\n')
+        for index in range(config.records):
+            if emitted and rng.random() < config.duplicate_ratio:
+                edge = rng.randrange(min(emitted, unique_edges))
+            else:
+                edge = emitted % unique_edges
+                emitted += 1
+            if config.trace_format == TraceFormat.JSON_LINES.value:
+                fout.write(record(edge) + "\n")
+            else:
+                fout.write(("" if index == 0 else ",\n") + record(edge))
+        if config.trace_format != TraceFormat.JSON_LINES.value:
+            fout.write("\n]}\n")
+
+
+def _make_functions(config: TraceConfig) -> List[types.SimpleNamespace]:
+    """Returns the functions of "main" in a trace of generate_trace(): blocks of FUNCTION_SIZE
+    holding the call sites, and every intra-module target."""
+    def function(start: int, instructions: List[Any]) -> types.SimpleNamespace:
+        return types.SimpleNamespace(
+            start=start,
+            name=f"func_{start:x}",
+            address_ranges=[types.SimpleNamespace(start=start, end=start + FUNCTION_SIZE)],
+            instructions=instructions,
+        )
+
+    call_tokens = [types.SimpleNamespace(text=text) for text in ("call", "qword", "[", "rax", "+", "0x10", "]")]
+    sites_per_function = FUNCTION_SIZE // SITE_STRIDE
+    functions = [
+        function(_site_addr(first), [
+            (call_tokens, _site_addr(site)) for site in range(first, min(first + sites_per_function, config.call_sites))
+        ])
+        for first in range(0, config.call_sites, sites_per_function)
+    ]
+    functions += [
+        function(_target_addr(0, target_id), [])
+        for target_id in range(config.call_sites * config.fanout)
+        if target_id % config.fanout % config.modules == 0
+    ]
+    return functions
+
+
+class LatencyBinaryView:
+    """Mock BinaryView matching generate_trace() whose API calls each cost ``latency_us``.
+    Without ``config``, e.g. for an existing trace, it has no functions."""
+
+    class _Arch:
+        name = "x86_64"
+
+        def __init__(self, bv: "LatencyBinaryView"):
+            self.bv = bv
+
+        def get_instruction_low_level_il_instruction(self, bv, addr: int):
+            self.bv._call("get_instruction_low_level_il_instruction")
+            tokens = [types.SimpleNamespace(text=text) for text in ("[", "rax", "+", "0x10", "]")]
+            return types.SimpleNamespace(operands=[types.SimpleNamespace(tokens=tokens)])
+
+    def __init__(self, latency_us: float = 0.0, config: Optional[TraceConfig] = None):
+        self.start = MAIN_BASE
+        self.arch = self._Arch(self)
+        self.latency = latency_us / 1e6
+        self.calls: Dict[str, int] = {}
+        self._comments: Dict[int, str] = {}
+        self._metadata: Dict[str, Any] = {}
+        self._functions = _make_functions(config) if config is not None else []
+
+    def _call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            deadline = time.perf_counter() + self.latency
+            while time.perf_counter() < deadline:
+                pass
+
+    @property
+    def functions(self) -> List[types.SimpleNamespace]:
+        self._call("functions")
+        return self._functions
+
+    def get_disassembly(self, addr: int) -> Optional[str]:
+        self._call("get_disassembly")
+        return "call qword [rax+0x10]"
+
+    def get_function_at(self, addr: int):
+        self._call("get_function_at")
+        if addr % FUNCTION_SIZE == 0:
+            return types.SimpleNamespace(name=f"func_{addr:x}")
+        return None
+
+    def get_functions_containing(self, addr: int):
+        self._call("get_functions_containing")
+        return [types.SimpleNamespace(name=f"func_{addr - addr % FUNCTION_SIZE:x}")]
+
+    def get_symbol_at(self, addr: int):
+        self._call("get_symbol_at")
+        return types.SimpleNamespace(name=f"vtable_{addr:x}")
+
+    def get_comment_at(self, addr: int) -> str:
+        self._call("get_comment_at")
+        return self._comments.get(addr, "")
+
+    def set_comment_at(self, addr: int, comment: str) -> None:
+        self._call("set_comment_at")
+        self._comments[addr] = comment
+
+    def query_metadata(self, key: str):
+        return self._metadata[key]
+
+    def store_metadata(self, key: str, value) -> None:
+        self._metadata[key] = value
+
+    def begin_undo_actions(self) -> str:
+        return "bench"
+
+    def commit_undo_actions(self, undo_id: str) -> None:
+        pass
+
+    def revert_undo_actions(self, undo_id: str) -> None:
+        pass
+
+    def set_analysis_hold(self, enable: bool) -> None:
+        pass
+
+    def update_analysis(self) -> None:
+        pass
+
+
+def _measure(run: Callable[[], int], memory: bool) -> StageResult:
+    if memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        items = run()
+        seconds = time.perf_counter() - start_time
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6 if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return StageResult(round(seconds, 4), items, round(items / seconds if seconds else 0.0, 1), peak_mb)
+
+
+# Stages of a TraceAnnotator run whose throughput is counted in records instead of edges
+_RECORD_STAGES = ("collect", "collect.parse", "collect.decode")
+
+
+def run_benchmark(
+    config: TraceConfig,
+    latency_us: float = 0.0,
+    memory: bool = True,
+    trace_path: Optional[str] = None,
+    decode_workers: int = 1,
+) -> BenchmarkResult:
+    """Measures parsing the trace alone, a first TraceAnnotator load (also broken down into
+    the stages of its run summary), a reload of the same trace into the annotated view and,
+    with ``decode_workers`` above 1, a load decoded in that many worker processes.
+
+    Peak memory is measured with tracemalloc, which slows the stages down, so the
+    throughput of a run with ``memory=True`` is only comparable to other such runs.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        generated = trace_path is None
+        if generated:
+            suffix = ".jsonl" if config.trace_format == TraceFormat.JSON_LINES.value else ".json"
+            trace_path = os.path.join(temp_dir, f"bench{suffix}")
+            generate_trace(trace_path, config)
+
+        reader = TraceReader(trace_path)
+        bv = LatencyBinaryView(latency_us, config if generated else None)
+        result = BenchmarkResult(config, latency_us, round(reader.size / 1e6, 2), 0, decode_workers)
+        records = 0
+
+        def parse() -> int:
+            nonlocal records
+            records = sum(1 for _ in reader.iter_branches())
+            return records
+
+        def load(view: LatencyBinaryView, workers: int = 1, use_cache: bool = True) -> Callable[[], int]:
+            def run() -> int:
+                annotator = TraceAnnotator(view, trace_path, workers, use_cache)
+                annotator.run()
+                runs.append(annotator.summary)
+                return records
+            return run
+
+        runs: List[Dict[str, Any]] = []
+        result.stages["parse"] = _measure(parse, memory)
+        result.stages["load"] = _measure(load(bv), memory)
+        summary = runs[-1]
+        result.unique_edges = summary["counters"]["unique_edges"]
+        for name, seconds in summary["stages"].items():
+            items = records if name in _RECORD_STAGES else result.unique_edges
+            result.stages[f"load.{name}"] = StageResult(seconds, items, round(items / seconds if seconds else 0.0, 1))
+        # Reads the edge cache written by the first load and finds nothing to rewrite
+        result.stages["reload"] = _measure(load(bv), memory)
+        result.bv_calls = dict(sorted(bv.calls.items()))
+        if decode_workers > 1:
+            parallel_bv = LatencyBinaryView(latency_us, config if generated else None)
+            result.stages["load_parallel"] = _measure(load(parallel_bv, decode_workers, use_cache=False), memory)
+        if resource is not None:
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Kilobytes on Linux, bytes on macOS
+            result.peak_rss_mb = round(max_rss / (1e6 if sys.platform == "darwin" else 1e3), 1)
+    return result
+
+
+def find_regressions(result: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Returns a message for every stage whose throughput dropped by more than ``max_regression``."""
+    regressions = []
+    for name, stage in result["stages"].items():
+        if (baseline_stage := baseline["stages"].get(name)) is None or not baseline_stage["items_per_sec"]:
+            continue
+        ratio = stage["items_per_sec"] / baseline_stage["items_per_sec"]
+        if ratio < 1.0 - max_regression:
+            regressions.append(
+                f"{name}: {stage['items_per_sec']:,.0f}/s vs {baseline_stage['items_per_sec']:,.0f}/s ({ratio:.0%})"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    defaults = TraceConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the Binja Missing Link trace loading pipeline")
+    parser.add_argument("--records", type=int, default=defaults.records)
+    parser.add_argument("--call-sites", type=int, default=defaults.call_sites)
+    parser.add_argument("--fanout", type=int, default=defaults.fanout, help="targets per call site")
+    parser.add_argument("--modules", type=int, default=defaults.modules)
+    parser.add_argument("--duplicate-ratio", type=float, default=defaults.duplicate_ratio)
+    parser.add_argument("--format", choices=[fmt.value for fmt in TraceFormat], default=defaults.trace_format)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--latency-us", type=float, default=0.0, help="cost of every BinaryView call")
+    parser.add_argument("--trace", help="benchmark an existing trace instead of a synthetic one")
+    parser.add_argument(
+        "--decode-workers", type=int, default=1, help="also measure a load decoded in this many processes"
+    )
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc peak memory measurement")
+    parser.add_argument("--output", help="append the result as one JSON line to this file")
+    parser.add_argument("--baseline", help="JSON result to compare throughput against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    config = TraceConfig(
+        args.records, args.call_sites, args.fanout, args.modules, args.duplicate_ratio, args.format, args.seed
+    )
+    result = asdict(run_benchmark(config, args.latency_us, not args.no_memory, args.trace, args.decode_workers))
+    print(json.dumps(result, indent=2))
+    if args.output is not None:
+        with open(args.output, "a") as fout:
+            fout.write(json.dumps(result) + "\n")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as fin:
+            baseline = json.loads(fin.read().splitlines()[-1])
+        if regressions := find_regressions(result, baseline, args.max_regression):
+            print("Throughput regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
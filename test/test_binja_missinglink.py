@@ -1,9 +1,17 @@
 #
 # (c) FFRI Security, Inc., 2025 / Author: FFRI Security, Inc.
 #
+import binaryninja
+import gc
+import json
 import os
 import pytest
+import re
+import socket
 import sys
+import threading
+import time
+import weakref
 from typing import Dict
 
 # Add parent directory to Python path
@@ -11,9 +19,44 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import directly from __init__.py
 from __init__ import (
+    _JsonStream,
+    AddressCache,
+    AnalysisMetadata,
+    AnnotationQuery,
     BranchData,
     BranchAnalyzer,
+    BranchTraceLoadTask,
+    CallSiteTable,
+    CommentManager,
+    EdgeCache,
+    EdgeStore,
+    EvictionPolicy,
+    FunctionIndex,
+    HeadlessJob,
+    IntervalIndex,
+    Instrumentation,
+    LiveTraceAnnotator,
+    ModuleIndex,
+    MultiModuleAnnotator,
+    MultiTraceAnnotator,
+    OperationCancelled,
+    OperandKind,
+    ParallelTraceDecoder,
+    PolymorphismIndex,
+    PreviewCheckpoint,
+    PreviewOptions,
+    run_headless_jobs,
+    SetOperation,
+    TraceAnnotator,
+    TraceFormat,
+    TraceReader,
+    TraceScanner,
+    TraceSet,
+    XrefManager,
 )
+import missinglink_decoding
+from missinglink_decoding import decode_lines_in_worker
+
 
 class TestBinjaMissingLink:
     @pytest.fixture
@@ -156,6 +199,8 @@ class TestBinjaMissingLink:
                 self.start = 0x100000000
                 self.arch = MockArch()
                 self._comments = {}
+                self._metadata = {}
+                self.undo_log = []
                 self._functions = {
                     0x100000100: type('Function', (), {'name': 'test_intra_module_call1'})(),
                     0x100000200: type('Function', (), {'name': 'module_func1'})(),
@@ -176,6 +221,22 @@ class TestBinjaMissingLink:
                     0x200000100: type('Symbol', (), {'name': 'external_func1'})(),
                 }
 
+            @property
+            def functions(self):
+                return [
+                    type('Function', (), {
+                        'start': addr,
+                        'name': func.name,
+                        'address_ranges': [type('AddressRange', (), {'start': addr, 'end': addr + 0x100})()],
+                        'instructions': [
+                            ([type('Token', (), {'text': text})() for text in re.findall(r"\w+|\S", disassembly)], site)
+                            for site in range(addr, addr + 0x100, 0x80)
+                            if (disassembly := self.get_disassembly(site)) is not None
+                        ],
+                    })()
+                    for addr, func in self._functions.items()
+                ]
+
             def get_function_at(self, addr: int):
                 return self._functions.get(addr)
 
@@ -185,6 +246,9 @@ class TestBinjaMissingLink:
                         return [func]
                 return []
 
+            def get_next_function_start_after(self, addr: int) -> int:
+                return min((func_addr for func_addr in self._functions if func_addr > addr), default=0x300000000)
+
             def get_comment_at(self, addr: int) -> str:
                 return self._comments.get(addr, "")
 
@@ -203,6 +267,34 @@ class TestBinjaMissingLink:
             def get_symbol_at(self, addr: int):
                 return self._symbols.get(addr)
 
+            def query_metadata(self, key: str):
+                return self._metadata[key]
+
+            def store_metadata(self, key: str, value) -> None:
+                self._metadata[key] = value
+
+            def remove_metadata(self, key: str) -> None:
+                del self._metadata[key]
+
+            def begin_undo_actions(self) -> str:
+                self.undo_log.append("begin")
+                return "undo-1"
+
+            def commit_undo_actions(self, undo_id: str) -> None:
+                self.undo_log.append(f"commit:{undo_id}")
+
+            def revert_undo_actions(self, undo_id: str) -> None:
+                self.undo_log.append(f"revert:{undo_id}")
+
+            def forget_undo_actions(self, undo_id: str) -> None:
+                self.undo_log.append(f"forget:{undo_id}")
+
+            def set_analysis_hold(self, enable: bool) -> None:
+                self.undo_log.append(f"hold:{enable}")
+
+            def update_analysis(self) -> None:
+                self.undo_log.append("update")
+
         return MockBinaryView()
 
     def test_branch_data_parsing(self, sample_branch_data):
@@ -342,4 +434,956 @@ class TestBinjaMissingLink:
             modules,
             mock_binary_view
         )
-        assert mock_binary_view.get_comment_at(src_addr) == "" 
\ No newline at end of file
+        assert mock_binary_view.get_comment_at(src_addr) == ""
+
+    def test_trace_reader_json(self, tmp_path, sample_branch_data):
+        """Test streaming a JSON trace in small chunks"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data, indent=2))
+
+        reader = TraceReader(str(trace_path), chunk_size=16)
+        assert reader.format == TraceFormat.JSON
+        assert reader.read_modules() == {"main": 0x100000000, "libtest_module": 0x200000000}
+        assert list(reader.iter_branches()) == sample_branch_data["branches"]
+        assert reader.progress == 1.0
+
+    def test_trace_reader_branches_before_modules(self, tmp_path, sample_branch_data):
+        """Test a JSON trace whose branches precede its modules"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps({
+            "branches": sample_branch_data["branches"],
+            "modules": sample_branch_data["modules"],
+        }))
+
+        reader = TraceReader(str(trace_path), chunk_size=16)
+        assert reader.read_modules() == {"main": 0x100000000, "libtest_module": 0x200000000}
+        assert list(reader.iter_branches()) == sample_branch_data["branches"]
+
+    def test_trace_reader_json_lines(self, tmp_path, sample_branch_data):
+        """Test streaming the JSON Lines variant of a trace"""
+        trace_path = tmp_path / "branches.trace"
+        lines = [json.dumps({"modules": sample_branch_data["modules"]})]
+        lines += [json.dumps(branch) for branch in sample_branch_data["branches"]]
+        trace_path.write_text("\n".join(lines) + "\n")
+
+        reader = TraceReader(str(trace_path))
+        assert reader.format == TraceFormat.JSON_LINES
+        assert reader.read_modules() == {"main": 0x100000000, "libtest_module": 0x200000000}
+        assert list(reader.iter_branches()) == sample_branch_data["branches"]
+
+    @pytest.mark.parametrize("layout, expected", [
+        ({"modules": 0, "branches": 1}, TraceFormat.JSON),
+        ({"branches": 1, "modules": 0}, TraceFormat.JSON),
+        ({"modules": 0}, TraceFormat.JSON_LINES),
+    ])
+    def test_detect_long_first_line(self, tmp_path, monkeypatch, sample_branch_data, layout, expected):
+        """Test telling the layouts apart from a bounded prefix when the first line is long"""
+        monkeypatch.setattr(TraceReader, "SNIFF_SIZE", 64)
+        trace_path = tmp_path / "branches.trace"
+        values = [sample_branch_data["modules"], sample_branch_data["branches"]]
+        first_line = json.dumps({key: values[index] for key, index in layout.items()})
+        assert len(first_line) > TraceReader.SNIFF_SIZE
+        branch_lines = [json.dumps(branch) for branch in sample_branch_data["branches"]]
+        trace_path.write_text("\n".join([first_line] + (branch_lines if len(layout) == 1 else [])))
+
+        reader = TraceReader(str(trace_path))
+        assert reader.format == expected
+        assert list(reader.iter_branches()) == sample_branch_data["branches"]
+
+    def test_malformed_json_is_not_buffered(self, tmp_path):
+        """Test that a malformed value fails without reading the rest of the trace"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text('{"branches": [{"before": oops' + " " * (1 << 20) + "}]}")
+
+        with open(trace_path, "rb") as fin:
+            stream = _JsonStream(fin, 16, max_value_size=256)
+            assert next(stream.iter_object_keys()) == "branches"
+            with pytest.raises(ValueError):
+                list(stream.iter_array())
+            assert fin.tell() < 1024
+
+    def test_duplicated_branches_are_resolved_once(self, mock_binary_view, sample_branch_data):
+        """Test that repeated branch records only count hits"""
+        disassembly_calls = []
+        get_disassembly = mock_binary_view.get_disassembly
+
+        def counting_get_disassembly(addr):
+            disassembly_calls.append(addr)
+            return get_disassembly(addr)
+
+        mock_binary_view.get_disassembly = counting_get_disassembly
+        modules = {
+            module["name"]: int(module["addr"], 16)
+            for module in sample_branch_data["modules"]
+        }
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            analyzer.analyze_branch(branch)
+        calls_after_trace = len(disassembly_calls)
+        analyzer.analyze_branch(sample_branch_data["branches"][1])
+        analyzer.comment_manager.set_comments()
+
+        assert len(disassembly_calls) == calls_after_trace
+        assert len(analyzer.edge_hits) == 4
+        assert analyzer.edge_hits[("main", 0x480, "main", "module_func1", 0x200, 0x900)] == 3
+
+        comment = mock_binary_view.get_comment_at(0x100000480)
+        assert f"{hex(0x100000200)}(module_func1) (vt:{hex(0x100000900)}(func_table2)) [hits:3]" in comment
+        assert f"{hex(0x100000500)}(module_func2) (vt:{hex(0x100001000)}(func_table3)) [hits:1]" in comment
+
+    @pytest.mark.parametrize("policy, evicted", [
+        (EvictionPolicy.LRU, 0x20),
+        (EvictionPolicy.FIFO, 0x10),
+    ])
+    def test_address_cache_eviction(self, policy, evicted):
+        """Test bounded address cache eviction and counters"""
+        lookups = []
+
+        def lookup(addr):
+            lookups.append(addr)
+            return hex(addr)
+
+        cache = AddressCache(max_size=2, policy=policy)
+        assert cache.get(0x10, lookup) == "0x10"
+        assert cache.get(0x20, lookup) == "0x20"
+        assert cache.get(0x10, lookup) == "0x10"
+        cache.get(0x30, lookup)
+
+        assert evicted not in cache.entries
+        assert cache.stats() == {"size": 2, "hits": 1, "misses": 3, "evictions": 1}
+        assert lookups == [0x10, 0x20, 0x30]
+
+    def test_analyzer_caches_binary_view_lookups(self, mock_binary_view, sample_branch_data):
+        """Test that call sites and targets shared by several edges are looked up once"""
+        modules = {
+            module["name"]: int(module["addr"], 16)
+            for module in sample_branch_data["modules"]
+        }
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            analyzer.analyze_branch(branch)
+
+        stats = analyzer.cache.stats()
+        assert stats["base_register"]["misses"] == 2
+        assert stats["instruction"]["hits"] == 3
+        assert stats["func_name_containing"] == {"size": 2, "hits": 1, "misses": 2, "evictions": 0}
+
+    def test_bulk_set_comments(self, mock_binary_view, sample_branch_data, capsys):
+        """Test that bulk comment application is grouped into one undo action"""
+        modules = {
+            module["name"]: int(module["addr"], 16)
+            for module in sample_branch_data["modules"]
+        }
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            analyzer.analyze_branch(branch)
+
+        assert analyzer.comment_manager.set_comments(bulk=True) == 5
+        assert mock_binary_view.undo_log == ["begin", "hold:True", "commit:undo-1", "hold:False", "update"]
+        assert "BML_dst:" in mock_binary_view.get_comment_at(0x100000480)
+        out, err = capsys.readouterr()
+        assert out == "" and "Applied 5 comments" in err
+
+    def test_bulk_set_comments_reverts_on_error(self, mock_binary_view, sample_branch_data):
+        """Test that a failing bulk comment application is reverted"""
+        def failing_set_comment_at(addr, comment):
+            raise RuntimeError("write failed")
+
+        mock_binary_view.set_comment_at = failing_set_comment_at
+        modules = {
+            module["name"]: int(module["addr"], 16)
+            for module in sample_branch_data["modules"]
+        }
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        analyzer.analyze_branch(sample_branch_data["branches"][0])
+
+        with pytest.raises(RuntimeError):
+            analyzer.comment_manager.set_comments(bulk=True)
+        assert mock_binary_view.undo_log == ["begin", "hold:True", "revert:undo-1", "hold:False"]
+
+    def test_load_task(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test running the whole pipeline as a background task"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+
+        task = BranchTraceLoadTask(mock_binary_view, str(trace_path))
+        task.run()
+
+        assert "BML_dst:" in mock_binary_view.get_comment_at(0x100000180)
+        assert "BML_src:" in mock_binary_view.get_comment_at(0x100000200)
+
+    def test_load_task_cancelled(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that a cancelled background task leaves the database untouched"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+
+        task = BranchTraceLoadTask(mock_binary_view, str(trace_path))
+        task.cancel()
+        task.run()
+
+        assert mock_binary_view._comments == {}
+        assert mock_binary_view.undo_log == []
+
+    @pytest.mark.parametrize("indent", [None, 2])
+    def test_parallel_trace_decoder(self, tmp_path, mock_binary_view, sample_branch_data, indent):
+        """Test that sharded decoding in worker processes matches sequential analysis"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data, indent=indent))
+        modules = {
+            module["name"]: int(module["addr"], 16)
+            for module in sample_branch_data["modules"]
+        }
+
+        sequential = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            sequential.analyze_branch(branch)
+
+        parallel = BranchAnalyzer(mock_binary_view, modules)
+        decoder = ParallelTraceDecoder(str(trace_path), modules, workers=2, shard_size=97)
+        assert decoder.run(parallel) == len(sample_branch_data["branches"])
+        assert parallel.edge_hits == sequential.edge_hits
+
+    def test_edge_store(self):
+        """Test deduplication and string interning of the columnar edge store"""
+        store = EdgeStore()
+        intra_edge = ("main", 0x480, "main", "module_func1", 0x200, 0x900)
+        inter_edge = ("main", 0x380, "libtest_module", "external_func1", 0x100, None)
+
+        assert store.add(intra_edge) == (0, True)
+        assert store.add(inter_edge, hits=2) == (1, True)
+        assert store.add(intra_edge) == (0, False)
+
+        assert len(store) == 2
+        assert store.strings.strings == ["main", "module_func1", "libtest_module", "external_func1"]
+        assert store.vtable_offset[1] == EdgeStore.NO_VTABLE
+        assert dict(store.items()) == {intra_edge: 2, inter_edge: 2}
+
+    def test_analyze_edges(self, mock_binary_view, sample_branch_data):
+        """Test that the analyzer consumes an edge store with its hit counts"""
+        modules = {
+            module["name"]: int(module["addr"], 16)
+            for module in sample_branch_data["modules"]
+        }
+        store = EdgeStore()
+        store.add(("main", 0x180, "main", "module_func1", 0x200, 0x800), hits=5)
+
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        analyzer.analyze_edges(store)
+        analyzer.comment_manager.set_comments()
+
+        comment = mock_binary_view.get_comment_at(0x100000180)
+        assert f"BML_dst: {hex(0x100000200)}(module_func1) (vt:{hex(0x100000800)}(func_table1)) [hits:5]" in comment
+
+    def test_edge_cache_round_trip(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test writing and memory-mapping the binary edge cache of a trace"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        modules = {
+            module["name"]: int(module["addr"], 16)
+            for module in sample_branch_data["modules"]
+        }
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            analyzer.analyze_branch(branch)
+
+        cache_path = EdgeCache.path_for(str(trace_path))
+        EdgeCache.write(cache_path, modules, analyzer.edges, str(trace_path))
+
+        with EdgeCache.open_for_trace(str(trace_path)) as cache:
+            assert cache.modules == modules
+            assert dict(cache.items()) == analyzer.edge_hits
+
+        trace_path.write_text(json.dumps(sample_branch_data, indent=2))
+        assert EdgeCache.open_for_trace(str(trace_path)) is None
+
+    def test_edge_cache_detects_edits(self, tmp_path, sample_branch_data):
+        """Test that a cache is only reused for a touched trace if its whole content is unchanged"""
+        trace_path = tmp_path / "branches.json"
+        padding = "x" * (3 << 20)
+        trace_path.write_text(json.dumps({**sample_branch_data, "padding": padding}))
+        cache_path = EdgeCache.path_for(str(trace_path))
+        EdgeCache.write(cache_path, {}, EdgeStore(), str(trace_path))
+
+        os.utime(trace_path, ns=(0, 1))
+        with EdgeCache.open_for_trace(str(trace_path)) as cache:
+            assert len(cache) == 0
+
+        # Same size, new mtime, one byte edited far from both ends
+        middle = len(padding) // 2
+        trace_path.write_text(json.dumps({**sample_branch_data, "padding": padding[:middle] + "y" + padding[middle + 1:]}))
+        os.utime(trace_path, ns=(0, 2))
+        assert EdgeCache.open_for_trace(str(trace_path)) is None
+
+    def test_load_task_from_edge_cache(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that a load writes an edge cache that a later load can use on its own"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        BranchTraceLoadTask(mock_binary_view, str(trace_path)).run()
+        expected_comments = dict(mock_binary_view._comments)
+
+        mock_binary_view._comments = {}
+        mock_binary_view._metadata = {}
+        BranchTraceLoadTask(mock_binary_view, EdgeCache.path_for(str(trace_path))).run()
+        assert mock_binary_view._comments == expected_comments
+
+    def test_reload_is_idempotent(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that loading the same trace twice neither rewrites nor stacks comments"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        BranchTraceLoadTask(mock_binary_view, str(trace_path), use_cache=False).run()
+        expected_comments = dict(mock_binary_view._comments)
+
+        written = []
+        set_comment_at = mock_binary_view.set_comment_at
+        mock_binary_view.set_comment_at = lambda addr, comment: (written.append(addr), set_comment_at(addr, comment))
+        BranchTraceLoadTask(mock_binary_view, str(trace_path), use_cache=False).run()
+
+        assert written == []
+        assert mock_binary_view._comments == expected_comments
+
+    def test_reload_extended_trace(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that an extended trace only re-annotates the addresses of new or hotter edges"""
+        trace_path = tmp_path / "branches.json"
+        first_trace = dict(sample_branch_data, branches=sample_branch_data["branches"][:2])
+        trace_path.write_text(json.dumps(first_trace))
+        mock_binary_view.set_comment_at(0x100000200, "user note")
+        BranchTraceLoadTask(mock_binary_view, str(trace_path), use_cache=False).run()
+
+        written = []
+        set_comment_at = mock_binary_view.set_comment_at
+        mock_binary_view.set_comment_at = lambda addr, comment: (written.append(addr), set_comment_at(addr, comment))
+        trace_path.write_text(json.dumps(sample_branch_data))
+        BranchTraceLoadTask(mock_binary_view, str(trace_path), use_cache=False).run()
+
+        assert sorted(written) == [0x100000200, 0x100000380, 0x100000480, 0x100000500]
+        comment = mock_binary_view.get_comment_at(0x100000200)
+        assert comment.count("BML_src:") == 1
+        assert comment.startswith("user note\nBML_src:")
+        assert f"{hex(0x100000180)}(test_intra_module_call1) [hits:1]" in comment
+        assert f"{hex(0x100000480)}(test_intra_module_call2) [hits:2]" in comment
+
+    def test_reload_separate_traces(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that the hits of separate traces add up and a trace loaded again is not counted twice"""
+        trace_paths = []
+        for name, indent in [("monday", None), ("tuesday", 2)]:
+            trace_path = tmp_path / f"{name}.json"
+            trace_path.write_text(json.dumps(sample_branch_data, indent=indent))
+            trace_paths.append(str(trace_path))
+        # A copy of a merged trace under another name is recognized by its content
+        copy_path = tmp_path / "copy.json"
+        copy_path.write_text(json.dumps(sample_branch_data))
+        trace_paths += [trace_paths[0], str(copy_path)]
+        for trace_path in trace_paths:
+            BranchTraceLoadTask(mock_binary_view, trace_path).run()
+
+        comment = mock_binary_view.get_comment_at(0x100000480)
+        assert f"{hex(0x100000200)}(module_func1) (vt:{hex(0x100000900)}(func_table2)) [hits:4]" in comment
+        traces = json.loads(mock_binary_view._metadata["binja_missinglink.traces"])
+        assert [trace["path"] for trace in traces] == trace_paths[:2]
+        assert all(trace["digest"] is not None for trace in traces)
+
+    def test_run_summary(self, tmp_path, mock_binary_view, sample_branch_data, capsys):
+        """Test the per-stage, per-API and skipped-record counts of a run"""
+        def make_branch(module, rip):
+            return {
+                "before": {"module": module, "func": "f", "registers": {"rip": rip}},
+                "after": {"module": module, "func": "g", "registers": {"rip": "0x100000200"}},
+            }
+
+        sample_branch_data["branches"] += [
+            make_branch("unknown_module", "0x300000100"),
+            make_branch("main", "0x100000600"),  # No disassembly
+            make_branch("main", "0x100000700"),
+            make_branch("main", "0x100000700"),
+        ]
+        get_disassembly = mock_binary_view.get_disassembly
+        mock_binary_view.get_disassembly = lambda addr: "mov rax, rbx" if addr == 0x100000700 else get_disassembly(addr)
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        stats_path = tmp_path / "branches.stats.json"
+
+        annotator = TraceAnnotator(
+            mock_binary_view, str(trace_path), use_cache=False, instrumentation=Instrumentation(profile=True),
+            stats_path=str(stats_path),
+        )
+        assert annotator.run() == 5
+        # The summary is logged to stderr, since stdout carries the JSON of headless runs
+        out, err = capsys.readouterr()
+        assert "run summary" in err and "run summary" not in out
+
+        summary = json.loads(stats_path.read_text())
+        assert summary == annotator.summary
+        assert summary["status"] == "ok"
+        assert summary["skipped"] == {"non_branch_instruction": 2, "missing_disassembly": 1, "unknown_module": 1}
+        assert summary["counters"]["records"] == 9
+        assert summary["counters"]["unique_edges"] == 6
+        assert summary["api"]["get_disassembly"]["calls"] == 4
+        assert summary["api"]["set_comment_at"]["calls"] == 5
+        assert {"collect", "collect.parse", "merge", "resolve", "set_comments", "store_metadata"} <= set(summary["stages"])
+        assert summary["cache"]["instruction"]["misses"] == 4
+        assert os.path.exists(summary["profile"])
+
+    @pytest.mark.parametrize("suffix, indent", [(".json", None), (".json", 2), (".jsonl", None)])
+    def test_trace_scanner(self, tmp_path, sample_branch_data, suffix, indent):
+        """Test that a scan stopped early resumes at the next record"""
+        trace_path = tmp_path / f"branches{suffix}"
+        if suffix == ".jsonl":
+            lines = [{"modules": sample_branch_data["modules"]}] + sample_branch_data["branches"]
+            trace_path.write_text("\n".join(json.dumps(line) for line in lines) + "\n")
+        else:
+            trace_path.write_text(json.dumps(sample_branch_data, indent=indent))
+
+        scanner = TraceScanner(str(trace_path), chunk_size=131)
+        branches = iter(scanner)
+        head = [next(branches) for _ in range(3)]
+        rest = list(TraceScanner(str(trace_path), scanner.offset, chunk_size=131))
+        assert head + rest == sample_branch_data["branches"]
+
+        scanner = TraceScanner(str(trace_path))
+        assert list(scanner) == sample_branch_data["branches"]
+        assert scanner.offset == scanner.size
+
+    def test_preview_resume(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that a full run continues a windowed preview and matches a run without one"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        modules = TraceReader(str(trace_path)).read_modules()
+        expected = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            expected.analyze_branch(branch)
+
+        preview = TraceAnnotator(mock_binary_view, str(trace_path), preview=PreviewOptions(max_records=2))
+        preview.run()
+        assert preview.summary["scan"]["stopped"] == "max_records"
+        assert not preview.summary["scan"]["complete"]
+        assert "BML_dst:" in mock_binary_view.get_comment_at(0x100000180)
+        assert not os.path.exists(EdgeCache.path_for(str(trace_path)))
+        offset, records, _ = PreviewCheckpoint.load(mock_binary_view, str(trace_path))
+        assert (offset, records) == (preview.summary["scan"]["end"], 2)
+
+        # A resumed run cancelled after reading the trace leaves the database as it was
+        metadata = dict(mock_binary_view._metadata)
+        cancelled = TraceAnnotator(mock_binary_view, str(trace_path), should_cancel=lambda: "end" in cancelled.scan)
+        with pytest.raises(OperationCancelled):
+            cancelled.run()
+        assert mock_binary_view._metadata == metadata
+
+        full = TraceAnnotator(mock_binary_view, str(trace_path))
+        full.run()
+        assert full.summary["scan"] == {"start": offset, "end": os.path.getsize(trace_path), "complete": True}
+        assert full.summary["counters"]["records"] == len(sample_branch_data["branches"])
+        assert PreviewCheckpoint.load(mock_binary_view, str(trace_path)) is None
+        with EdgeCache.open_for_trace(str(trace_path)) as cache:
+            assert dict(cache.items()) == expected.edge_hits
+
+    def test_sampled_preview(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that a sampled preview annotates without keeping a checkpoint or an edge cache"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data, indent=2))
+
+        annotator = TraceAnnotator(mock_binary_view, str(trace_path), preview=PreviewOptions(samples=4))
+        annotator.run()
+
+        assert annotator.summary["scan"]["windows"] == 4
+        assert not annotator.summary["scan"]["complete"]
+        assert 0 < annotator.summary["counters"]["records"] <= len(sample_branch_data["branches"])
+        assert PreviewCheckpoint.load(mock_binary_view, str(trace_path)) is None
+        assert not os.path.exists(EdgeCache.path_for(str(trace_path)))
+
+    def test_polymorphism_index(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test the target histogram and callers of every call site"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        annotator = TraceAnnotator(mock_binary_view, str(trace_path), use_cache=False)
+        annotator.run()
+
+        index = annotator.polymorphism
+        assert len(index) == 3
+        assert index.hottest(1) == [(("main", 0x480), 3)]
+        assert index.megamorphic(1) == [("main", 0x480)]
+        assert index.megamorphic(2) == []
+        assert index.targets_of(("main", 0x480)) == [(("main", 0x200), 2), (("main", 0x500), 1)]
+        assert index.targets_of(("main", 0x480), 1) == [(("main", 0x200), 2)]
+        assert index.vtables_of(("main", 0x480)) == [(0x900, 2), (0x1000, 1)]
+        assert index.callers_of(("main", 0x200)) == [("main", 0x180), ("main", 0x480)]
+        assert index.callers_of(("libtest_module", 0x100)) == [("main", 0x380)]
+        assert index.summary()["hottest"][0] == {
+            "site": "main+0x480", "hits": 3, "targets": 2, "vtables": ["0x900", "0x1000"]
+        }
+        # Built on first use, not by the load
+        assert "polymorphism_index" not in annotator.summary["stages"]
+
+        analyzer = BranchAnalyzer(mock_binary_view, TraceReader(str(trace_path)).read_modules())
+        analyzer.polymorphism = index
+        assert analyzer.get_site_vtables(("main", 0x480)) == [("func_table2", 2), ("func_table3", 1)]
+
+    def test_polymorphism_index_from_edges(self):
+        """Test building the index from an edge store without a BinaryView"""
+        edges = EdgeStore()
+        edges.add(("main", 0x10, "main", "f", 0x100, 0x900), 2)
+        edges.add(("main", 0x10, "main", "g", 0x200, None), 1)
+        edges.add(("main", 0x20, "lib", "h", 0x300, None), 4)
+        index = PolymorphismIndex.from_edges(edges)
+
+        assert index.hottest(2) == [(("main", 0x20), 4), (("main", 0x10), 3)]
+        assert index.megamorphic(1) == [("main", 0x10)]
+        assert index.targets_of(("main", 0x10)) == [(("main", 0x100), 2), (("main", 0x200), 1)]
+        assert index.vtables_of(("main", 0x10)) == [(0x900, 2)]
+        assert index.callers_of(("lib", 0x300)) == [("main", 0x20)]
+
+    def test_comment_truncation(self, mock_binary_view):
+        """Test that the entries of a comment are sorted by hits and truncated"""
+        comment_manager = CommentManager(mock_binary_view, max_entries=2)
+        for target, hits in [("a", 1), ("b", 5), ("c", 3), ("d", 5), ("e", 2)]:
+            comment_manager.add_source_comment(0x100000180, target, hits)
+        comment_manager.set_comments()
+
+        assert mock_binary_view.get_comment_at(0x100000180) == "BML_dst: b [hits:5], d [hits:5], +3 more [hits:6]"
+
+    def test_lazy_annotation(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that a lazy load writes no comment and renders them on demand"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        BranchTraceLoadTask(mock_binary_view, str(trace_path), use_cache=False, lazy=True).run()
+        assert mock_binary_view._comments == {}
+
+        query = AnnotationQuery.for_view(mock_binary_view)
+        assert query.addresses == [0x100000180, 0x100000200, 0x100000380, 0x100000480, 0x100000500]
+        text = query.annotations_at(0x100000480)
+        assert text.startswith(f"BML_dst: {hex(0x100000200)}(module_func1) (vt:{hex(0x100000900)}(func_table2)) [hits:2]")
+        assert query.annotations_at(0x100000300) is None
+
+        calls = []
+        mock_binary_view.get_disassembly = lambda addr: calls.append(addr)
+        assert query.annotations_at(0x100000480) == text
+        assert calls == []
+        assert query.rendered.hits == 1
+
+        func = next(func for func in mock_binary_view.functions if func.start == 0x100000400)
+        assert query.annotations_in_function(func) == {0x100000480: text}
+        assert query.materialize(query.addresses_in_function(func)) == 1
+        assert mock_binary_view._comments == {0x100000480: text}
+
+        AnnotationQuery.forget(mock_binary_view)
+        assert AnnotationQuery.for_view(mock_binary_view).addresses == query.addresses
+
+    def test_lazy_then_eager_annotation(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that a regular load writes the comments of the edges a lazy load only stored"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        assert TraceAnnotator(mock_binary_view, str(trace_path), lazy=True).run() == 0
+        assert AnalysisMetadata.load_state(mock_binary_view)["comments"] is False
+
+        assert TraceAnnotator(mock_binary_view, str(trace_path)).run() == 5
+        assert len(mock_binary_view._comments) == 5
+        assert "module_func1" in mock_binary_view.get_comment_at(0x100000480)
+        assert AnalysisMetadata.load_state(mock_binary_view)["comments"] is True
+        # Nothing is left to write
+        assert TraceAnnotator(mock_binary_view, str(trace_path)).run() == 0
+
+    def test_annotation_query_releases_closed_views(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that the query of a view does not keep the view alive"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        view = type(mock_binary_view)()
+        TraceAnnotator(view, str(trace_path), use_cache=False, lazy=True).run()
+        query = AnnotationQuery.for_view(view)
+        assert query.annotations_at(0x100000480) is not None
+        assert view in AnnotationQuery._views
+        # Views of earlier tests that are only left in reference cycles are released first
+        gc.collect()
+        registered = len(AnnotationQuery._views)
+
+        view_ref = weakref.ref(view)
+        del view
+        gc.collect()
+        assert view_ref() is None
+        assert len(AnnotationQuery._views) == registered - 1
+
+    @pytest.mark.parametrize("family, workers", [("tcp", 1), ("unix", 1), ("tcp", 2)])
+    def test_live_trace(self, tmp_path, mock_binary_view, sample_branch_data, family, workers):
+        """Test annotating branch records streamed over a socket"""
+        address = ("127.0.0.1", 0) if family == "tcp" else str(tmp_path / "live.sock")
+        annotator = LiveTraceAnnotator(mock_binary_view, address, workers=workers, flush_interval=0.05, queue_size=1)
+        thread = threading.Thread(target=annotator.run)
+        thread.start()
+        try:
+            lines = [{"modules": sample_branch_data["modules"]}] + sample_branch_data["branches"] + [{"before": "?"}]
+            data = "".join(json.dumps(line) + "\n" for line in lines).encode()
+            sock_family = socket.AF_INET if family == "tcp" else socket.AF_UNIX
+            with socket.socket(sock_family, socket.SOCK_STREAM) as client:
+                client.connect(annotator.server.address)
+                # Records split across writes are reassembled
+                for start in range(0, len(data), 37):
+                    client.sendall(data[start:start + 37])
+            deadline = time.time() + 10
+            while annotator.records < len(sample_branch_data["branches"]) and time.time() < deadline:
+                time.sleep(0.01)
+            assert annotator.records == len(sample_branch_data["branches"])
+            while annotator.flushes == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            assert "BML_dst:" in mock_binary_view.get_comment_at(0x100000180)
+        finally:
+            annotator.stop()
+            thread.join()
+
+        comment = mock_binary_view.get_comment_at(0x100000480)
+        assert f"{hex(0x100000200)}(module_func1) (vt:{hex(0x100000900)}(func_table2)) [hits:2]" in comment
+        assert comment.count("BML_dst:") == 1
+        # Flushes leave neither undo actions nor analysis updates behind
+        assert set(mock_binary_view.undo_log) == {"begin", "forget:undo-1"}
+        assert annotator.summary["status"] == "ok"
+        assert annotator.summary["live"]["malformed_records"] == 1
+        assert annotator.summary["counters"]["records"] == len(sample_branch_data["branches"])
+        assert not os.path.exists(tmp_path / "live.sock")
+
+    def test_trace_set(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test merging traces into one edge set tagged with the traces of every edge"""
+        modules = TraceReader.parse_modules(sample_branch_data["modules"])
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        branches = sample_branch_data["branches"]
+        traces = {"a": [branches[0], branches[1], branches[4]], "b": [branches[1], branches[2], branches[3]]}
+        trace_set = TraceSet(list(traces))
+        for name, trace_branches in traces.items():
+            edges = EdgeStore()
+            for branch in trace_branches:
+                edges.add(analyzer.get_edge_key(branch))
+            trace_set.add_trace(name, modules, edges)
+
+        def sites(edges):
+            return {(key[1], key[4]): hits for key, hits in edges.items()}
+
+        assert len(trace_set) == 4
+        assert sites(trace_set.query()) == {(0x180, 0x200): 1, (0x480, 0x200): 3, (0x480, 0x500): 1, (0x380, 0x100): 1}
+        assert sites(trace_set.query(SetOperation.INTERSECTION)) == {(0x480, 0x200): 3}
+        assert sites(trace_set.query(SetOperation.DIFFERENCE, ["a"])) == {(0x180, 0x200): 1}
+        assert sites(trace_set.query(SetOperation.DIFFERENCE, ["b"])) == {(0x480, 0x500): 1, (0x380, 0x100): 1}
+        assert sites(trace_set.query(SetOperation.DIFFERENCE, ["a", "b"], [])) == sites(trace_set.query())
+        assert [trace_set.traces_of(row) for row in range(len(trace_set))] == [["a"], ["a", "b"], ["b"], ["b"]]
+        with pytest.raises(KeyError):
+            trace_set.select(SetOperation.UNION, ["c"])
+        with pytest.raises(ValueError):
+            TraceSet(["a", "a"])
+
+        export_path = tmp_path / "merged.jsonl"
+        trace_set.export(str(export_path), trace_set.select(SetOperation.INTERSECTION))
+        header, edge = [json.loads(line) for line in export_path.read_text().splitlines()]
+        assert header == {"modules": sample_branch_data["modules"], "traces": ["a", "b"]}
+        assert edge == {
+            "src_module": "main", "src_offset": "0x480", "dst_module": "main", "dst_func": "module_func1",
+            "dst_offset": "0x200", "vtable_offset": "0x900", "hits": 3, "traces": ["a", "b"],
+        }
+        cache_path = tmp_path / "merged.bmlc"
+        trace_set.export(str(cache_path))
+        with EdgeCache(str(cache_path)) as cache:
+            assert dict(cache.items()) == dict(trace_set.edges.items())
+
+    def test_multi_trace_annotation(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test annotating the edges that only one of several traces hit"""
+        branches = sample_branch_data["branches"]
+        trace_paths = []
+        for name, trace_branches in [("a", [branches[0], branches[1]]), ("b", [branches[1], branches[2]])]:
+            trace_path = tmp_path / name / "branches.json"
+            trace_path.parent.mkdir()
+            trace_path.write_text(json.dumps({"modules": sample_branch_data["modules"], "branches": trace_branches}))
+            trace_paths.append(str(trace_path))
+        export_path = tmp_path / "only_b.jsonl"
+
+        # The second run reads both edge caches and finds no changed comment
+        for cache_hits, annotated in [(0, 2), (2, 0)]:
+            annotator = MultiTraceAnnotator(
+                mock_binary_view, trace_paths, operation=SetOperation.DIFFERENCE, selected=[trace_paths[1]],
+                export_path=str(export_path),
+            )
+            assert annotator.run() == annotated
+            assert annotator.summary["counters"].get("cache_hits", 0) == cache_hits
+            assert annotator.summary["set"]["merged_edges"] == 3
+            assert annotator.summary["set"]["selected_edges"] == 1
+
+        assert not mock_binary_view.get_comment_at(0x100000180)
+        comment = mock_binary_view.get_comment_at(0x100000480)
+        assert "module_func2" in comment and "module_func1" not in comment
+        assert "BML_src:" in mock_binary_view.get_comment_at(0x100000500)
+        assert [json.loads(line)["traces"] for line in export_path.read_text().splitlines()[1:]] == [[trace_paths[1]]]
+
+    def test_multi_trace_union_then_difference(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test that a set operation replaces the edges and comments of an earlier one"""
+        branches = sample_branch_data["branches"]
+        trace_paths = []
+        for name, trace_branches in [("a", [branches[0], branches[1]]), ("b", [branches[1], branches[2]])]:
+            trace_path = tmp_path / f"{name}.json"
+            trace_path.write_text(json.dumps({"modules": sample_branch_data["modules"], "branches": trace_branches}))
+            trace_paths.append(str(trace_path))
+        mock_binary_view.set_comment_at(0x100000180, "user note")
+
+        MultiTraceAnnotator(mock_binary_view, trace_paths).run()
+        assert "BML_dst:" in mock_binary_view.get_comment_at(0x100000180)
+        assert "module_func1" in mock_binary_view.get_comment_at(0x100000480)
+
+        annotator = MultiTraceAnnotator(
+            mock_binary_view, trace_paths, operation=SetOperation.DIFFERENCE, selected=["b.json"]
+        )
+        assert annotator.run() > 0
+        # Only the plugin's lines of the edges left out are removed
+        assert mock_binary_view.get_comment_at(0x100000180) == "user note"
+        comment = mock_binary_view.get_comment_at(0x100000480)
+        assert "module_func2" in comment and "module_func1" not in comment
+        assert dict(AnalysisMetadata.load(mock_binary_view).items()) == dict(annotator.result.items())
+        traces = AnalysisMetadata.load_traces(mock_binary_view)
+        assert [trace["path"] for trace in traces] == trace_paths
+        assert all(trace["digest"] for trace in traces)
+
+    def test_live_worker_base_register_log(self, monkeypatch, sample_branch_data):
+        """Test that a live decoding worker learns base registers from the entries it has not seen"""
+        monkeypatch.setattr(missinglink_decoding, "_worker_base_registers", {})
+        monkeypatch.setattr(missinglink_decoding, "_worker_log_size", 0)
+        modules = TraceReader.parse_modules(sample_branch_data["modules"])
+        lines = "".join(json.dumps(branch) + "\n" for branch in sample_branch_data["branches"]).encode()
+        log = [(("main", 0x180), "rax"), (("main", 0x480), "rax")]
+
+        def decode(log_start, entries):
+            (edges, pending, records, _), _, log_size = decode_lines_in_worker(lines, modules, log_start, entries)
+            assert records == len(sample_branch_data["branches"])
+            return {key[1] for key in pending}, log_size
+
+        assert decode(0, []) == ({0x180, 0x480}, 0)
+        assert decode(0, log[:1]) == ({0x480}, 1)
+        # A later batch only carries the entries the worker has not seen
+        assert decode(1, log[1:]) == (set(), 2)
+        # Entries past a gap are not applied, so the worker reports what it still needs
+        assert decode(3, [(("main", 0x380), None)]) == (set(), 2)
+
+    def test_interval_index(self):
+        """Test bisect lookups over overlapping and nested ranges"""
+        index = IntervalIndex([(0x100, 0x200, "a"), (0x180, 0x280, "b"), (0x120, 0x140, "nested"), (0x300, 0x310, "c")])
+
+        addresses = [0x0, 0x100, 0x130, 0x1ff, 0x200, 0x27f, 0x280, 0x305, 0x310]
+        expected = ["none", "a", "a", "a", "b", "b", "none", "c", "none"]
+        assert [index.find(addr) or "none" for addr in addresses] == expected
+        assert [value or "none" for value in index.find_many(addresses)] == expected
+
+    def test_module_index(self, sample_branch_data):
+        """Test rebasing addresses into the module that contains them"""
+        index = ModuleIndex(TraceReader.parse_modules(sample_branch_data["modules"]))
+
+        assert index.find(0x100000800) == "main"
+        assert index.find(0x200000100) == "libtest_module"
+        assert index.offset_in("main", 0x100000800) == 0x800
+        assert index.offset_in("main", 0x200000100) is None
+
+    def test_function_index_resolution(self, mock_binary_view, sample_branch_data):
+        """Test that function names from the index match the per-address BinaryView lookups"""
+        modules = TraceReader.parse_modules(sample_branch_data["modules"])
+        expected = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            expected.analyze_branch(branch)
+
+        analyzer = BranchAnalyzer(mock_binary_view, modules)
+        analyzer.function_index = FunctionIndex.from_binary_view(mock_binary_view)
+        keys = [analyzer.get_edge_key(branch) for branch in sample_branch_data["branches"]]
+        analyzer.prefetch_function_names(keys)
+        for key in keys:
+            analyzer.add_edge(key)
+
+        assert analyzer.comment_manager.comments_src == expected.comment_manager.comments_src
+        assert analyzer.comment_manager.comments_dst == expected.comment_manager.comments_dst
+        assert "get_function_at" not in analyzer.instrumentation.api_calls
+        assert "get_functions_containing" not in analyzer.instrumentation.api_calls
+
+    @pytest.mark.parametrize("disassembly, expected", [
+        ("call    qword [rax+0x10]", (OperandKind.MEMORY, "rax")),
+        ("jmp     qword [r12]", (OperandKind.MEMORY, "r12")),
+        ("call    qword [rel data_4010]", (OperandKind.RIP_RELATIVE, None)),
+        ("call    rdx", (OperandKind.REGISTER, "rdx")),
+        ("call    sub_1000", None),
+        ("mov     rax, qword [rbx]", None),
+    ])
+    def test_call_site_classification(self, disassembly, expected):
+        """Test classifying the operand of indirect branches from disassembly tokens"""
+        tokens = [type('Token', (), {'text': text})() for text in re.split(r"(\W)", disassembly) if text]
+        assert CallSiteTable.classify(tokens) == expected
+
+    def test_call_site_table(self, mock_binary_view, sample_branch_data):
+        """Test that branch sites classified by the call-site table match per-site lifting"""
+        table = CallSiteTable.from_binary_view(mock_binary_view)
+        assert list(table.addresses) == [0x100000180, 0x100000380, 0x100000480]
+        assert table.lookup_many([0x100000480, 0x100000500]) == [(OperandKind.MEMORY, "rax"), None]
+
+        modules = TraceReader.parse_modules(sample_branch_data["modules"])
+        expected = BranchAnalyzer(mock_binary_view, modules)
+        for branch in sample_branch_data["branches"]:
+            expected.analyze_branch(branch)
+
+        analyzer = BranchAnalyzer(mock_binary_view, modules, call_site_table_after=0)
+        for branch in sample_branch_data["branches"]:
+            analyzer.analyze_branch(branch)
+
+        assert analyzer.comment_manager.comments_src == expected.comment_manager.comments_src
+        assert analyzer.comment_manager.comments_dst == expected.comment_manager.comments_dst
+        assert "get_disassembly" not in analyzer.instrumentation.api_calls
+        assert "get_instruction_low_level_il_instruction" not in analyzer.instrumentation.api_calls
+
+    def test_multi_module_annotation(self, tmp_path, mock_binary_view, sample_branch_data):
+        """Test annotating the views of several modules from one trace"""
+        sample_branch_data["branches"].append({  # intra-module branch of a module without a view
+            "before": {"module": "libother", "func": "f", "registers": {"rip": "0x300000180", "rax": "0x300000800"}},
+            "after": {"module": "libother", "func": "g", "registers": {"rip": "0x300000200"}},
+        })
+        sample_branch_data["modules"].append({"name": "libother", "addr": "0x300000000"})
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        lib_view = type(mock_binary_view)()
+        lib_view.start = 0x200000000
+
+        annotator = MultiModuleAnnotator(
+            {"main": mock_binary_view, "libtest_module": lib_view}, str(trace_path), use_cache=False
+        )
+        assert annotator.run() == 6
+
+        assert annotator.module_counts == {"main": 5, "libtest_module": 1}
+        assert mock_binary_view.get_comment_at(0x100000380) == "BML_dst: <libtest_module>.external_func1 [hits:1]"
+        assert "BML_dst:" in mock_binary_view.get_comment_at(0x100000180)
+        assert lib_view._comments == {0x200000100: "BML_src: <main>+0x380 [hits:1]"}
+        assert set(annotator.summary["modules"]) == {"main", "libtest_module"}
+        assert lib_view._metadata.keys() == {
+            "binja_missinglink.edges", "binja_missinglink.module", "binja_missinglink.traces",
+            "binja_missinglink.state",
+        }
+        assert lib_view._metadata["binja_missinglink.module"] == "libtest_module"
+
+    @pytest.mark.parametrize("loaded_before", [False, True])
+    def test_apply_xrefs(self, tmp_path, mock_binary_view, sample_branch_data, loaded_before):
+        """Test registering resolved targets as cross references in one analysis update, also
+        for the edges of an earlier load without cross references"""
+        class RecordingFunction:
+            def __init__(self, start, name):
+                self.start = start
+                self.name = name
+                self.arch = "x86_64"
+                self.code_refs = []
+                self.indirect_branches = {}
+
+            def add_user_code_ref(self, src_addr, dst_addr):
+                self.code_refs.append((src_addr, dst_addr))
+
+            def get_indirect_branches_at(self, addr):
+                return []
+
+            def set_user_indirect_branches(self, src_addr, branches):
+                self.indirect_branches[src_addr] = branches
+
+        sample_branch_data["branches"].append({  # call to code without a function
+            "before": {"module": "main", "func": "f", "registers": {"rip": "0x100000180", "rax": "0x100000800"}},
+            "after": {"module": "main", "func": "g", "registers": {"rip": "0x100000600"}},
+        })
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        functions = mock_binary_view._functions = {
+            addr: RecordingFunction(addr, func.name) for addr, func in mock_binary_view._functions.items()
+        }
+        get_disassembly = mock_binary_view.get_disassembly
+        mock_binary_view.get_disassembly = lambda addr: "jmp [rax+0x10]" if addr == 0x100000480 else get_disassembly(addr)
+        created = []
+        mock_binary_view.create_user_function = created.append
+
+        if loaded_before:
+            TraceAnnotator(mock_binary_view, str(trace_path), use_cache=False).run()
+            mock_binary_view.undo_log.clear()
+        annotator = TraceAnnotator(mock_binary_view, str(trace_path), use_cache=False, apply_xrefs=True)
+        # The comments of an earlier load are not rewritten
+        assert (annotator.run() == 0) == loaded_before
+
+        assert created == [0x100000600]
+        assert functions[0x100000100].code_refs == [(0x100000180, 0x100000200), (0x100000180, 0x100000600)]
+        assert functions[0x100000400].indirect_branches == {
+            0x100000480: [("x86_64", 0x100000200), ("x86_64", 0x100000500)]
+        }
+        assert annotator.summary["counters"]["xrefs.functions"] == 1
+        assert mock_binary_view.undo_log == ["begin", "hold:True", "commit:undo-1", "hold:False", "update"]
+
+    def test_apply_xrefs_jump_table(self, mock_binary_view):
+        """Test that jump table targets become indirect branches without creating functions"""
+        class RecordingFunction:
+            arch = "x86_64"
+
+            def __init__(self, start, name):
+                self.start = start
+                self.name = name
+                self.indirect_branches = {}
+
+            def add_user_code_ref(self, src_addr, dst_addr):
+                pass
+
+            def get_indirect_branches_at(self, addr):
+                return []
+
+            def set_user_indirect_branches(self, src_addr, branches):
+                self.indirect_branches[src_addr] = branches
+
+        functions = mock_binary_view._functions = {
+            addr: RecordingFunction(addr, func.name) for addr, func in mock_binary_view._functions.items()
+        }
+        get_disassembly = mock_binary_view.get_disassembly
+        mock_binary_view.get_disassembly = (
+            lambda addr: "jmp qword [rax*8+0x100001000]" if addr == 0x100000480 else get_disassembly(addr)
+        )
+        created = []
+        mock_binary_view.create_user_function = created.append
+
+        xref_manager = XrefManager(mock_binary_view)
+        # Two jump table cases, a tail call to code without a function and one to a function
+        for dst_addr in (0x100000440, 0x100000460, 0x100000700, 0x100000200):
+            xref_manager.add_target(0x100000480, dst_addr)
+        xref_manager.add_target(0x100000180, 0x100000600)
+        counts = xref_manager.apply()
+
+        assert created == [0x100000600, 0x100000700]
+        assert counts == {"functions": 2, "code_refs": 1, "indirect_branches": 4}
+        assert [addr for _, addr in functions[0x100000400].indirect_branches[0x100000480]] == [
+            0x100000200, 0x100000440, 0x100000460, 0x100000700
+        ]
+
+    def test_headless_jobs(self, tmp_path, monkeypatch, mock_binary_view, sample_branch_data):
+        """Test annotating and saving binaries in headless batch mode"""
+        trace_path = tmp_path / "branches.json"
+        trace_path.write_text(json.dumps(sample_branch_data))
+        saved = []
+
+        class MockFile:
+            def create_database(self, path):
+                saved.append(path)
+                return True
+
+            def close(self):
+                pass
+
+        mock_binary_view.file = MockFile()
+        mock_binary_view.update_analysis_and_wait = lambda: None
+        monkeypatch.setattr(
+            binaryninja, "load", lambda path: mock_binary_view if path == "main" else None, raising=False
+        )
+
+        results = run_headless_jobs([
+            HeadlessJob("main", str(trace_path)),
+            HeadlessJob("missing", str(trace_path)),
+        ], processes=1)
+
+        assert results[0]["output"] == "main.bndb"
+        assert results[0]["annotated"] == 5
+        assert "error" in results[1]
+        assert saved == ["main.bndb"]
+        assert "BML_dst:" in mock_binary_view.get_comment_at(0x100000180)
+
+    def test_benchmark_smoke(self):
+        """Test the benchmark suite at a tiny scale"""
+        from bench_binja_missinglink import TraceConfig, run_benchmark
+
+        config = TraceConfig(records=200, call_sites=10, fanout=3, modules=2, duplicate_ratio=0.5)
+        result = run_benchmark(config, memory=False, decode_workers=2)
+
+        assert {"parse", "load", "load.collect", "load.resolve", "reload", "load_parallel"} <= set(result.stages)
+        assert result.stages["parse"].items == result.stages["load"].items == 200
+        assert result.unique_edges == 30
+        assert result.bv_calls["get_disassembly"] == 10
+        # The reload finds every edge already annotated
+        assert result.bv_calls["set_comment_at"] == 30